@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# Gamepad input handling and the control loop of robot_arm.py.
+#
+# Nothing in here touches hardware directly, which is what allows recorded input sessions to be replayed
+# through the exact same code (see input_replay.py).
+from math_helper import scale_stick
+
+
+# Define speeds
+FULL_SPEED = 100
+FAST_SPEED = 75
+NORMAL_SPEED = 50
+SLOW_SPEED = 25
+VERY_SLOW_SPEED = 10
+BASE_SPEEDS = (FULL_SPEED, FAST_SPEED, NORMAL_SPEED, SLOW_SPEED, VERY_SLOW_SPEED)
+
+EV_KEY = 1
+EV_ABS = 3
+
+# button code: (flag it sets while pressed, opposite flag it clears)
+BUTTONS = {
+    310: ('waist_left', 'waist_right'),  # L1
+    311: ('waist_right', 'waist_left'),  # R1
+    308: ('roll_left', 'roll_right'),  # Square
+    305: ('roll_right', 'roll_left'),  # Circle
+    307: ('pitch_up', 'pitch_down'),  # Triangle
+    304: ('pitch_down', 'pitch_up'),  # X
+    312: ('spin_left', 'spin_right'),  # L2
+    313: ('spin_right', 'spin_left'),  # R2
+    317: ('grabber_open', 'grabber_close'),  # L3
+    318: ('grabber_close', 'grabber_open'),  # R3
+}
+
+# what handle_event asks the caller to do, besides updating the state
+ACTION_POWER_INFO = 'power_info'  # Share
+ACTION_DEBUG = 'debug'  # Options
+ACTION_QUIT = 'quit'  # PS
+
+ACTIONS = {
+    314: ACTION_POWER_INFO,
+    315: ACTION_DEBUG,
+    316: ACTION_QUIT,
+}
+
+
+class Speeds:
+    """ the speed constants, scaled as a whole to make up for battery sag """
+
+    def __init__(self, factor=1.0):
+        self.scale(factor)
+
+    def scale(self, factor):
+        self.full, self.fast, self.normal, self.slow, self.very_slow = (
+            min(100, round(speed * factor)) for speed in BASE_SPEEDS)
+
+
+class ControlState:
+    """ what the gamepad currently asks the arm to do
+
+    filters optionally maps 'shoulder' and 'elbow' to stick filters (see stick_filter.py) applied to the scaled
+    stick values.
+    """
+
+    def __init__(self, filters=None):
+        self.filters = filters or {}
+
+        # Variables for stick input
+        self.shoulder_speed = 0
+        self.elbow_speed = 0
+
+        # Variables for button input
+        self.waist_left = False
+        self.waist_right = False
+        self.roll_left = False
+        self.roll_right = False
+        self.pitch_up = False
+        self.pitch_down = False
+        self.spin_left = False
+        self.spin_right = False
+        self.grabber_open = False
+        self.grabber_close = False
+
+        # We are running!
+        self.running = True
+
+    def release(self):
+        """ center the sticks and let go of all buttons, the control loop stops every joint """
+        self.shoulder_speed = 0
+        self.elbow_speed = 0
+        for flag, _ in BUTTONS.values():
+            setattr(self, flag, False)
+
+
+def _filter_stick(state, axis, value, event):
+    stick_filter = state.filters.get(axis)
+    if stick_filter is None:
+        return value
+    return stick_filter(value, event.sec + event.usec / 1000000.0)
+
+
+def handle_event(state, event):
+    """ update the state from an input event, returns one of the ACTION_ constants or None """
+    if event.type == EV_ABS:  # stick input
+        if event.code == 0:  # Left stick X-axis
+            state.shoulder_speed = _filter_stick(state, 'shoulder', scale_stick(event.value, invert=True), event)
+        elif event.code == 3:  # Right stick X-axis
+            state.elbow_speed = _filter_stick(state, 'elbow', scale_stick(event.value), event)
+
+    elif event.type == EV_KEY:  # button input
+        button = BUTTONS.get(event.code)
+        if button is not None:
+            if event.value == 1:
+                setattr(state, button[1], False)
+                setattr(state, button[0], True)
+            elif event.value == 0:
+                setattr(state, button[0], False)
+        elif event.value == 1:
+            action = ACTIONS.get(event.code)
+            if action == ACTION_QUIT:
+                # stop control loop
+                state.running = False
+            return action
+
+    return None
+
+
+def _limit(guard, name, speed, target=None):
+    return speed if guard is None else guard.limit(name, speed, target)
+
+
+def _toward(joint, speed, limit):
+    """ run a joint towards limit, its minPos or maxPos """
+    if getattr(joint, 'soft_limits', None) is not None:
+        # the joint slows down and stops ahead of the limit by itself, a plain speed command will do
+        joint.on(abs(speed) if limit == joint.maxPos else -abs(speed), True, False)
+    else:
+        joint.on_to_position(speed, limit, True, False)
+
+
+def control_tick(state, joints, speeds, guard=None):
+    """ one pass of the control loop, sends the commands the state asks for to the joints
+
+    An optional CollisionGuard (see collision_map.py) gets to slow down or block the moves. Joints with soft limits
+    (see soft_limits.py) get speed commands, others run-to-position commands to the limit they're heading for.
+    """
+    if guard is not None:
+        guard.update()
+
+    # Proportional control
+    shoulder_motors = joints['shoulder']
+    speed = state.shoulder_speed
+    if speed != 0:
+        target = shoulder_motors.minPos if speed > 0 else shoulder_motors.maxPos
+        speed = _limit(guard, 'shoulder', speed, target)
+    if speed != 0:
+        _toward(shoulder_motors, speed, target)
+    elif shoulder_motors.is_running:
+        shoulder_motors.stop()
+
+    # Proportional control
+    elbow_motor = joints['elbow']
+    speed = state.elbow_speed
+    if speed != 0:
+        target = elbow_motor.minPos if speed > 0 else elbow_motor.maxPos
+        speed = _limit(guard, 'elbow', speed, target)
+    if speed != 0:
+        _toward(elbow_motor, speed, target)
+    elif elbow_motor.is_running:
+        elbow_motor.stop()
+
+    # on/off control
+    waist_motor = joints['waist']
+    if state.waist_left:
+        waist_motor.on(_limit(guard, 'waist', -speeds.slow), False)  # Left
+    elif state.waist_right:
+        waist_motor.on(_limit(guard, 'waist', speeds.slow), False)  # Right
+    elif waist_motor.is_running:
+        waist_motor.stop()
+
+    # on/off control
+    roll_motor = joints['roll']
+    if state.roll_left:
+        _toward(roll_motor, speeds.slow, roll_motor.minPos)  # Left
+    elif state.roll_right:
+        _toward(roll_motor, speeds.slow, roll_motor.maxPos)  # Right
+    elif roll_motor.is_running:
+        roll_motor.stop()
+
+    # on/off control
+    pitch_motor = joints['pitch']
+    speed = 0
+    if state.pitch_up:
+        speed = _limit(guard, 'pitch', speeds.very_slow)
+    elif state.pitch_down:
+        speed = _limit(guard, 'pitch', -speeds.very_slow)
+    if speed != 0:
+        pitch_motor.on(speed, False)
+    elif pitch_motor.is_running:
+        pitch_motor.stop()
+
+    # on/off control
+    spin_motor = joints['spin']
+    if state.spin_left:
+        _toward(spin_motor, speeds.slow, spin_motor.minPos)  # Left
+    elif state.spin_right:
+        _toward(spin_motor, speeds.slow, spin_motor.maxPos)  # Right
+    elif spin_motor.is_running:
+        spin_motor.stop()
+
+    # on/off control
+    grabber_motor = joints.get('grabber')
+    if grabber_motor:
+        if state.grabber_open:
+            grabber_motor.on(speeds.normal, False)
+        elif state.grabber_close:
+            grabber_motor.on(-speeds.normal, False)
+        elif grabber_motor.is_running:
+            grabber_motor.stop()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# Resident daemon mode for robot_arm.py (RUN_AS_DAEMON), and the thin front ends attaching to it.
+#
+# Connecting RPyC, finding the motors, resetting and calibrating them takes seconds every time robot_arm.py starts.
+# The daemon does that once and keeps the brick connections, motor handles, position estimates and calibration,
+# running the control loop for whichever front end is attached over a local socket. Attaching takes milliseconds,
+# and restarting a front end doesn't restart the arm.
+#
+# The protocol is JSON, one message per line. Input events are sent as
+#
+#   {"op": "event", "sec": 1, "usec": 4000, "type": 3, "code": 0, "value": 200}
+#
+# and never answered, so a front end can stream them without waiting for the daemon. Every other request gets
+# exactly one reply, {"ok": true, ...} or {"ok": false, "error": "..."}:
+#
+#   hello      protocol version, joints and whether the arm was calibrated
+#   status     joint limits and position estimates, plus counters
+#   state      set ControlState fields directly, e.g. {"op": "state", "elbow_speed": 30, "pitch_up": true}
+#   stop       let go of all controls
+#   calibrate  calibrate the joints, with the control loop paused
+#   shutdown   stop the daemon
+#
+# When a client which sent input goes away, or the PS button is pressed, the daemon lets go of the controls so
+# nothing keeps moving, and waits for the next front end.
+#
+#   python3 arm_daemon.py gamepad                   # drive the arm from the gamepad
+#   python3 arm_daemon.py replay session.evrec      # or from a recorded session
+#   python3 arm_daemon.py status                    # also calibrate, stop, shutdown
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+from arm_control import ACTION_QUIT, ACTIONS, BUTTONS, EV_ABS, EV_KEY, ControlState, control_tick, handle_event
+from input_replay import ReplayEvent, read_events, replay
+from trace_buffer import OP_INPUT
+
+
+DAEMON_SOCKET = '/tmp/robot_arm.sock'
+PROTOCOL = 1
+TICK_INTERVAL = 0.01  # seconds between control loop passes
+
+# ControlState fields the state request may set
+STICKS = ('shoulder_speed', 'elbow_speed')
+FLAGS = tuple(flag for flag, _ in BUTTONS.values())
+
+logger = logging.getLogger(__name__)
+
+
+class ArmDaemon:
+    """ run the control loop for a ControlState driven by clients on a local socket
+
+    calibrate is a callable calibrating the joints, run while the control loop is paused. info optionally
+    returns a dict with more status, it mustn't block on remote bricks.
+    """
+
+    def __init__(self, joints, speeds, state=None, guard=None, estimated_joints=(), on_action=None, calibrate=None,
+                 info=None, trace=None, recorder=None, path=DAEMON_SOCKET, tick_interval=TICK_INTERVAL):
+        self._joints = joints
+        self._speeds = speeds
+        self._guard = guard
+        self._estimated_joints = list(estimated_joints)
+        self._on_action = on_action
+        self._calibrate = calibrate
+        self._info = info
+        self._trace = trace
+        self._recorder = recorder
+        self._tick_interval = tick_interval
+        self._requests = {
+            'hello': self._hello,
+            'status': self._status,
+            'state': self._set_state,
+            'stop': self._stop,
+            'calibrate': self._calibrate_joints,
+            'shutdown': self._shutdown,
+        }
+        # held for every control loop pass, and while calibrating
+        self._lock = threading.Lock()
+        self._socket = None
+        self._control_thread = None
+        self.path = path
+        self.state = state or ControlState()
+        self.running = False
+        self.calibrated = False
+        self.clients = 0
+        self.events = 0
+        self.started = time.monotonic()
+
+    def start(self):
+        """ listen on the socket and start the control loop """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                # left behind by a daemon which didn't shut down cleanly
+                os.unlink(self.path)
+            else:
+                raise RuntimeError('Another daemon is listening on {}'.format(self.path))
+            finally:
+                probe.close()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.path)
+        # anyone who can connect can drive the arm, and nobody can connect before listen()
+        os.chmod(self.path, 0o600)
+        self._socket.listen(4)
+
+        self.running = True
+        self._control_thread = threading.Thread(target=self._control_loop, name='control', daemon=True)
+        self._control_thread.start()
+
+    def _control_loop(self):
+        next_tick = time.monotonic()
+        while self.running:
+            with self._lock:
+                # Correct position estimates where needed, the reads are queued on the brick workers
+                for joint in self._estimated_joints:
+                    joint.refresh_estimate()
+                control_tick(self.state, self._joints, self._speeds, self._guard)
+
+            now = time.monotonic()
+            next_tick = max(next_tick + self._tick_interval, now)
+            time.sleep(next_tick - now)
+
+    def serve_forever(self):
+        """ accept clients until stop() or a shutdown request """
+        while self.running:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve_client, args=(conn,), name='client', daemon=True).start()
+
+    def _serve_client(self, conn):
+        self.clients += 1
+        sent_input = False
+        try:
+            for line in conn.makefile('rb'):
+                op = None
+                try:
+                    message = json.loads(line.decode())
+                    op = message.get('op')
+                    if op == 'event':
+                        sent_input = True
+                        self._event(message)
+                        continue
+                    if op not in self._requests:
+                        raise ValueError('Unknown request {}'.format(op))
+                    sent_input = sent_input or op == 'state'
+                    reply = {'ok': True}
+                    reply.update(self._requests[op](message))
+                except Exception as ex:
+                    if op == 'event':
+                        logger.error('Bad input event: {}'.format(ex))
+                        continue
+                    reply = {'ok': False, 'error': str(ex)}
+                conn.sendall((json.dumps(reply) + '\n').encode())
+        except OSError:
+            # the client went away halfway through a message
+            pass
+        finally:
+            if sent_input:
+                # a front end which quit or crashed mustn't leave the arm moving
+                self.state.release()
+            self.clients -= 1
+            conn.close()
+
+    def _event(self, message):
+        event = ReplayEvent(message['sec'], message['usec'], message['type'], message['code'], message['value'])
+        self.events += 1
+        if self._recorder:
+            self._recorder.record(event)
+        if self._trace:
+            self._trace.record(OP_INPUT, event.type, event.code, event.value)
+        action = handle_event(self.state, event)
+        if action == ACTION_QUIT:
+            # the PS button detaches the front end, the arm stays up for the next one
+            self.state.running = True
+            self.state.release()
+        elif action is not None and self._on_action:
+            self._on_action(action)
+
+    def _hello(self, message):
+        return {'protocol': PROTOCOL, 'joints': list(self._joints), 'calibrated': self.calibrated}
+
+    def _status(self, message):
+        estimated = set(joint.name for joint in self._estimated_joints)
+        joints = {}
+        for name, joint in self._joints.items():
+            joints[name] = {
+                'min': joint.minPos,
+                'max': joint.maxPos,
+                'running': joint.is_running,
+                # estimates only, reading encoders could block on a remote brick
+                'position': round(joint.estimated_position) if name in estimated else None,
+            }
+        status = {
+            'joints': joints,
+            'calibrated': self.calibrated,
+            'clients': self.clients,
+            'events': self.events,
+            'uptime': round(time.monotonic() - self.started, 1),
+        }
+        if self._info:
+            status.update(self._info())
+        return status
+
+    def _set_state(self, message):
+        controls = dict((name, value) for name, value in message.items() if name != 'op')
+        for name in controls:
+            if name not in STICKS and name not in FLAGS:
+                raise ValueError('Unknown control {}'.format(name))
+        for name, value in controls.items():
+            if name in STICKS:
+                setattr(self.state, name, min(100.0, max(-100.0, float(value))))
+            else:
+                setattr(self.state, name, bool(value))
+        return {}
+
+    def _stop(self, message):
+        self.state.release()
+        return {}
+
+    def _calibrate_joints(self, message):
+        if self._calibrate is None:
+            raise ValueError('Calibration is not available')
+        self.state.release()
+        with self._lock:
+            self._calibrate()
+        self.calibrated = True
+        return {}
+
+    def _shutdown(self, message):
+        # stop() waits for the control loop, which isn't ours to wait for here
+        threading.Thread(target=self.stop, name='shutdown', daemon=True).start()
+        return {}
+
+    def stop(self, timeout=1):
+        """ stop accepting clients and stop the control loop """
+        if not self.running:
+            return
+        self.running = False
+        self.state.release()
+        # gone before serve_forever() returns
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        try:
+            # wakes up a blocking accept
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        if self._control_thread is not threading.current_thread():
+            self._control_thread.join(timeout)
+
+
+class DaemonClient:
+    """ front end side of the control socket """
+
+    def __init__(self, path=DAEMON_SOCKET):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._reader = self._socket.makefile('rb')
+
+    def _send(self, message):
+        self._socket.sendall((json.dumps(message) + '\n').encode())
+
+    def request(self, op, **fields):
+        """ send a request and wait for the reply, raises RuntimeError when the daemon refused it """
+        fields['op'] = op
+        self._send(fields)
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError('The daemon closed the connection')
+        reply = json.loads(line.decode())
+        if not reply.pop('ok'):
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def send_event(self, event):
+        self._send({'op': 'event', 'sec': event.sec, 'usec': event.usec, 'type': event.type, 'code': event.code,
+                    'value': event.value})
+
+    def forward(self, events):
+        """ send the stick and button events to the daemon until the PS button, returns how many were sent """
+        count = 0
+        for event in events:
+            if event.type != EV_KEY and event.type != EV_ABS:
+                # sync and misc events, the daemon would ignore them anyway
+                continue
+            self.send_event(event)
+            count += 1
+            if event.type == EV_KEY and event.value == 1 and ACTIONS.get(event.code) == ACTION_QUIT:
+                break
+        return count
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+
+def gamepad_events():
+    import evdev
+    # If bluetooth is not available, check https://github.com/ev3dev/ev3dev/issues/1314
+    gamepad = evdev.InputDevice(evdev.list_devices()[0])
+    if gamepad.name != 'Wireless Controller':
+        raise RuntimeError('Failed to connect to wireless controller')
+    return gamepad.read_loop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Front end for robot_arm.py running as a daemon')
+    parser.add_argument('--socket', default=DAEMON_SOCKET)
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('gamepad', help='drive the arm from the gamepad, until the PS button')
+    replay_parser = commands.add_parser('replay', help='drive the arm from a recorded session')
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor')
+    for command in ('status', 'calibrate', 'stop', 'shutdown'):
+        commands.add_parser(command)
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('a command is required')
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(message)s')
+
+    tic = time.perf_counter()
+    client = DaemonClient(args.socket)
+    hello = client.request('hello')
+    logger.info('Attached to the daemon in {}ms, joints: {}{}'.format(
+        round((time.perf_counter() - tic) * 1000, 1), ', '.join(hello['joints']),
+        '' if hello['calibrated'] else ' (not calibrated)'))
+
+    try:
+        if args.command == 'gamepad':
+            logger.info('Forwarded {} events'.format(client.forward(gamepad_events())))
+        elif args.command == 'replay':
+            logger.info('Forwarded {} events'.format(
+                client.forward(replay(read_events(args.path), speed=args.speed))))
+            client.request('stop')
+        elif args.command == 'status':
+            print(json.dumps(client.request('status'), indent=2, sort_keys=True))
+        else:
+            client.request(args.command)
+    except KeyboardInterrupt:
+        client.request('stop')
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# asyncio runtime for robot_arm.py (USE_ASYNCIO), as an alternative to the input loop plus motor thread.
+#
+# Input handling, the control loop, power sampling and sending the motor commands of every brick are tasks on one
+# event loop. Commands for the local brick are sent inline, remote calls go to a single thread executor per brick
+# so bricks are driven in parallel while keeping their commands in order. Every task keeps latency statistics,
+# logged when the runtime stops.
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import time
+from signal import SIGINT
+
+from arm_control import ACTION_QUIT, ControlState, control_tick, handle_event
+from trace_buffer import OP_INPUT
+
+
+TICK_INTERVAL = 0.01  # seconds between control loop passes
+POWER_INTERVAL = 1.0  # seconds between power samples
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyStats:
+    """ recent durations in seconds, with the worst one ever seen """
+
+    def __init__(self, samples=1000):
+        self.count = 0
+        self.max = 0.0
+        self._samples = collections.deque(maxlen=samples)
+
+    def add(self, seconds):
+        self.count += 1
+        self.max = max(self.max, seconds)
+        self._samples.append(seconds)
+
+    def summary(self):
+        samples = sorted(self._samples)
+        if not samples:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': sum(samples) / len(samples) * 1000,
+            'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class AsyncBrickWorker:
+    """ BrickWorker counterpart running as a task of the event loop
+
+    Same coalescing per key. submit() is only meant to be called from the event loop, cancel() and flush() also
+    work from other threads (as emergency_stop does).
+    """
+
+    def __init__(self, brick):
+        self.name = 'brick-{}'.format(brick.name)
+        self._pending = collections.OrderedDict()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if brick.host is not None else None
+        self._in_flight = None
+        self._loop = None
+        self._wake = None
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_delay = 0.0
+        self.delay = LatencyStats()  # time commands spent queued
+        self.duration = LatencyStats()  # time commands took to send
+
+    def start(self):
+        # runs as a task of AsyncRuntime
+        pass
+
+    def submit(self, key, fn, *args, **kwargs):
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = (time.monotonic(), fn, args, kwargs)
+        if self._wake is not None:
+            self._wake.set()
+
+    def call(self, fn, *args, **kwargs):
+        """ run fn right away, only possible while the event loop isn't running """
+        if self._loop is not None and self._loop.is_running():
+            raise RuntimeError('{} can only queue commands while the event loop runs'.format(self.name))
+        return fn(*args, **kwargs)
+
+    def _busy(self):
+        return self._in_flight is not None and not self._in_flight.done()
+
+    def cancel(self):
+        """ drop everything still queued, returns True when a command is being sent right now """
+        self.coalesced += len(self._pending)
+        self._pending.clear()
+        return self._busy()
+
+    def flush(self, timeout=None):
+        """ wait until everything queued has been sent, returns False on timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending or self._busy():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if self._pending:
+                # sent by the event loop
+                time.sleep(0.005 if remaining is None else min(0.005, remaining))
+            else:
+                concurrent.futures.wait([self._in_flight], remaining)
+        return True
+
+    async def run(self):
+        self._loop = asyncio.get_event_loop()
+        self._wake = asyncio.Event()
+        while True:
+            if not self._pending:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            key, (queued, fn, args, kwargs) = self._pending.popitem(last=False)
+            delay = time.monotonic() - queued
+            self.max_delay = max(self.max_delay, delay)
+            self.delay.add(delay)
+            tic = time.monotonic()
+            try:
+                if self._executor is None:
+                    fn(*args, **kwargs)
+                else:
+                    self._in_flight = self._executor.submit(fn, *args, **kwargs)
+                    await asyncio.wrap_future(self._in_flight)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.errors += 1
+                logger.error('{} failed: {}'.format(self.name, ex))
+            self.duration.add(time.monotonic() - tic)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def join(self, timeout=None):
+        pass
+
+
+class AsyncReplay:
+    """ replay recorded events on the event loop, like input_replay.replay() """
+
+    def __init__(self, events, realtime=True, speed=1.0):
+        self._events = iter(events)
+        self._realtime = realtime
+        self._speed = speed
+        self._start = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            event = next(self._events)
+        except StopIteration:
+            raise StopAsyncIteration
+        if self._realtime:
+            now = time.monotonic()
+            if self._start is None:
+                self._start = (now, event.timestamp())
+            else:
+                delay = self._start[0] + (event.timestamp() - self._start[1]) / self._speed - now
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        return event
+
+
+class AsyncRuntime:
+    """ input handling, control loop, power sampling and brick workers as tasks on one event loop
+
+    Stops when the events run out, on the PS button or on SIGINT, cancelling all tasks.
+    """
+
+    def __init__(self, loop, events, joints, speeds, state=None, guard=None, estimated_joints=(), workers=(),
+                 power_sampler=None, on_action=None, trace=None, recorder=None, tick_interval=TICK_INTERVAL,
+                 power_interval=POWER_INTERVAL):
+        self._loop = loop
+        self._events = events
+        self._joints = joints
+        self._speeds = speeds
+        self._guard = guard
+        self._estimated_joints = list(estimated_joints)
+        self._workers = list(workers)
+        self._power_sampler = power_sampler
+        self._on_action = on_action
+        self._trace = trace
+        self._recorder = recorder
+        self._tick_interval = tick_interval
+        self._power_interval = power_interval
+        self._tasks = []
+        self.state = state or ControlState()
+        self.stats = collections.OrderedDict((name, LatencyStats()) for name in (
+            'input', 'tick', 'tick lateness', 'power'))
+
+    async def _input(self):
+        async for event in self._events:
+            tic = time.monotonic()
+            if self._recorder:
+                self._recorder.record(event)
+            if self._trace:
+                self._trace.record(OP_INPUT, event.type, event.code, event.value)
+            action = handle_event(self.state, event)
+            if action == ACTION_QUIT:
+                self.stop()
+                return
+            if action is not None and self._on_action:
+                self._on_action(action)
+            self.stats['input'].add(time.monotonic() - tic)
+
+    async def _control(self):
+        loop = self._loop
+        next_tick = loop.time()
+        while self.state.running:
+            tic = loop.time()
+            self.stats['tick lateness'].add(max(0.0, tic - next_tick))
+
+            # Correct position estimates where needed, the reads are queued on the brick workers
+            for joint in self._estimated_joints:
+                joint.refresh_estimate()
+            control_tick(self.state, self._joints, self._speeds, self._guard)
+
+            now = loop.time()
+            self.stats['tick'].add(now - tic)
+            # don't try to catch up on missed ticks
+            next_tick = max(next_tick + self._tick_interval, now)
+            await asyncio.sleep(next_tick - now)
+
+    async def _power(self):
+        while True:
+            tic = time.monotonic()
+            await self._loop.run_in_executor(None, self._power_sampler.sample)
+            self.stats['power'].add(time.monotonic() - tic)
+            await asyncio.sleep(self._power_interval)
+
+    async def _main(self):
+        coroutines = [self._input(), self._control()] + [worker.run() for worker in self._workers]
+        if self._power_sampler is not None:
+            coroutines.append(self._power())
+        self._tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            done, _ = await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.state.running = False
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    def stop(self):
+        """ stop the control loop and cancel all tasks """
+        self.state.running = False
+        for task in self._tasks:
+            task.cancel()
+
+    def run(self):
+        try:
+            self._loop.add_signal_handler(SIGINT, self.stop)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # not on the main thread, or no signal support
+            pass
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            try:
+                self._loop.remove_signal_handler(SIGINT)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+
+    def summary(self):
+        """ latency statistics of all tasks """
+        stats = collections.OrderedDict((name, value.summary()) for name, value in self.stats.items())
+        for worker in self._workers:
+            stats['{} queued'.format(worker.name)] = worker.delay.summary()
+            stats['{} send'.format(worker.name)] = worker.duration.summary()
+        return stats
+
+    def log_stats(self):
+        for name, stats in self.summary().items():
+            if stats['count']:
+                logger.info('{}: {} runs, mean {}ms, p99 {}ms, max {}ms'.format(
+                    name, stats['count'], round(stats['mean_ms'], 2), round(stats['p99_ms'], 2),
+                    round(stats['max_ms'], 2)))
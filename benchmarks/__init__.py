@@ -0,0 +1,36 @@
+# Benchmarks, run from the repository root like `python3 -m benchmarks.sysfs_motor`
+import time
+
+
+def measure(fn, iterations=1000, warmup=10):
+    """ call fn repeatedly and return timing statistics in microseconds """
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(iterations):
+        tic = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - tic)
+
+    return summarize(samples)
+
+
+def summarize(samples):
+    """ timing statistics in microseconds for a list of durations in seconds """
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        'iterations': count,
+        'mean_us': sum(samples) / count * 1e6,
+        'p50_us': samples[count // 2] * 1e6,
+        'p99_us': samples[min(count - 1, int(count * 0.99))] * 1e6,
+        'max_us': samples[-1] * 1e6,
+    }
+
+
+def print_results(title, results):
+    print(title)
+    for name, stats in results:
+        print('  {:<32} mean {:9.1f}us  p50 {:9.1f}us  p99 {:9.1f}us  max {:9.1f}us'.format(
+            name, stats['mean_us'], stats['p50_us'], stats['p99_us'], stats['max_us']))
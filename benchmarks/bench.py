@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# On-device micro-benchmarks of the I/O paths the arm depends on, with machine-readable results.
+#
+#   python3 -m benchmarks.bench --host 10.42.0.3 --label wifi-dongle -o before.json
+#   python3 -m benchmarks.bench --host 10.42.0.3 --label wifi-dongle -o after.json --compare before.json
+#
+# Measures sysfs attribute latency of the local large motor (SysfsMotor and ev3dev2's LargeMotor), RPyC round
+# trips to a medium motor on the slave (netref attribute reads against method calls and a teleported function
+# reading several attributes at once), scale_stick throughput and how fast the motor thread loop can spin. The loop
+# drives SysfsMotor joints on a fake tacho-motor tree through a brick worker, refreshing position estimates and
+# checking the collision guard on every pass like MotorThread.run in robot_arm.py.
+#
+# Motors are only ever sent stop commands. Off the brick the sysfs part runs against a fake tacho-motor tree and
+# the RPyC part is skipped without --host. Results are written as JSON together with the kernel, Python and
+# ev3dev2 versions and the git commit, so runs on different kernels, Wi-Fi setups or code versions can be compared.
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+from arm_control import ControlState, Speeds, control_tick
+from benchmarks import measure, print_results, summarize
+from brick_registry import BrickWorker, QueuedJoint
+from collision_map import CollisionGuard, load_or_build
+from input_replay import REPLAY_LIMITS
+from math_helper import scale_stick
+from smart_motor import LimitedRangeMotor
+from sysfs_motor import SYSFS_ROOT, DeviceNotFound, SysfsMotor, create_fake_motor, find_motor_path
+
+
+def environment(label):
+    """ what the results depend on besides the code """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import ev3dev2
+        ev3dev2_version = getattr(ev3dev2, '__version__', 'unknown')
+    except ImportError:
+        ev3dev2_version = None
+    return collections.OrderedDict([
+        ('label', label),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('host', platform.node()),
+        ('kernel', platform.release()),
+        ('machine', platform.machine()),
+        ('python', platform.python_version()),
+        ('ev3dev2', ev3dev2_version),
+        ('commit', commit),
+    ])
+
+
+def bench_sysfs(root, address, iterations):
+    results = collections.OrderedDict()
+    motor = SysfsMotor(address, sysfs_root=root)
+    results['SysfsMotor read position'] = measure(lambda: motor.position, iterations)
+    results['SysfsMotor read speed'] = measure(lambda: motor.speed, iterations)
+    results['SysfsMotor read duty_cycle'] = measure(lambda: motor.duty_cycle, iterations)
+    results['SysfsMotor read state'] = measure(lambda: motor.state, iterations)
+    results['SysfsMotor write command'] = measure(lambda: setattr(motor, 'command', 'stop'), iterations)
+    motor.close()
+
+    try:
+        import ev3dev2
+        from ev3dev2.motor import LargeMotor
+    except ImportError:
+        return results
+
+    ev3dev2.Device.DEVICE_ROOT_PATH = root
+    motor = LargeMotor(address)
+    results['LargeMotor read position'] = measure(lambda: motor.position, iterations)
+    results['LargeMotor read speed'] = measure(lambda: motor.speed, iterations)
+    results['LargeMotor read duty_cycle'] = measure(lambda: motor.duty_cycle, iterations)
+    results['LargeMotor read state'] = measure(lambda: motor.state, iterations)
+    results['LargeMotor write command'] = measure(lambda: setattr(motor, 'command', 'stop'), iterations)
+    results['LargeMotor write speed_sp'] = measure(lambda: setattr(motor, 'speed_sp', 0), iterations)
+    return results
+
+
+def read_motor(motor):
+    # teleported to the slave, so it mustn't use anything from this module
+    return motor.position, motor.speed, motor.state
+
+
+def bench_rpyc(host, port, iterations):
+    import rpyc
+    from rpyc.utils.classic import teleport_function
+
+    results = collections.OrderedDict()
+    conn = rpyc.classic.connect(host)
+    try:
+        remote_motor = conn.modules['ev3dev2.motor']
+        motor = remote_motor.MediumMotor(getattr(remote_motor, port))
+        stop = motor.stop
+        remote_read = teleport_function(conn, read_motor)
+
+        results['ping'] = measure(conn.ping, iterations)
+        results['netref read position'] = measure(lambda: motor.position, iterations)
+        results['netref read position, speed, state'] = measure(
+            lambda: (motor.position, motor.speed, motor.state), iterations)
+        results['teleported read position, speed, state'] = measure(lambda: remote_read(motor), iterations)
+        # looking up the method is a round trip of its own
+        results['netref method call stop()'] = measure(lambda: motor.stop(), iterations)
+        results['bound method call stop()'] = measure(stop, iterations)
+    finally:
+        conn.close()
+    return results
+
+
+def bench_scale_stick(repeat):
+    values = list(range(256)) * 40
+    best = None
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        for value in values:
+            scale_stick(value)
+        elapsed = time.perf_counter() - tic
+        best = elapsed if best is None else min(best, elapsed)
+    return collections.OrderedDict([('calls_per_s', len(values) / best), ('mean_ns', best / len(values) * 1e9)])
+
+
+def control_loop_joints(root, estimate):
+    """ SysfsMotor joints on a fake tree behind a brick worker, like robot_arm.py drives the real ones """
+    worker = BrickWorker('bench')
+    worker.start()
+    joints = {}
+    for index, (name, (low, high)) in enumerate(sorted(REPLAY_LIMITS.items())):
+        address = 'bench:{}'.format(name)
+        create_fake_motor(root, index, address)
+        motor = SysfsMotor(address, sysfs_root=root)
+        motor.position = (low + high) // 2
+        joint = LimitedRangeMotor(motor, name=name)
+        joint._minPos = low
+        joint._maxPos = high
+        if estimate:
+            joint.enable_estimator()
+        joints[name] = QueuedJoint(joint, worker)
+    return worker, joints
+
+
+def bench_control_loop(duration):
+    """ passes per second of the motor thread loop, idle and with the controls held """
+    results = collections.OrderedDict()
+    idle = ControlState()
+    held = ControlState()
+    held.shoulder_speed = 40
+    held.elbow_speed = -40
+    held.waist_left = True
+    held.spin_right = True
+    collision_map = load_or_build()
+
+    for name, state, estimate in (('idle', idle, False), ('controls held', held, False),
+                                  ('idle, estimates and guard', idle, True),
+                                  ('controls held, estimates and guard', held, True)):
+        root = tempfile.mkdtemp()
+        worker, joints = control_loop_joints(root, estimate)
+        estimated_joints = list(joints.values()) if estimate else []
+        guard = CollisionGuard(collision_map, joints) if estimate else None
+        speeds = Speeds()
+        samples = []
+        deadline = time.perf_counter() + duration
+        try:
+            while True:
+                tic = time.perf_counter()
+                if tic >= deadline:
+                    break
+                for joint in estimated_joints:
+                    joint.refresh_estimate()
+                control_tick(state, joints, speeds, guard)
+                samples.append(time.perf_counter() - tic)
+        finally:
+            worker.stop()
+            worker.join()
+            for joint in joints.values():
+                joint.motor.close()
+            shutil.rmtree(root)
+        stats = summarize(samples)
+        stats['hz'] = len(samples) / duration
+        results['motor thread loop, {}'.format(name)] = stats
+    return results
+
+
+def flatten(results):
+    """ (section/name, metric, value, higher is better) for every result which can be compared """
+    for section, entries in results.items():
+        for name, stats in entries.items():
+            if not isinstance(stats, dict):
+                continue
+            key = '{}/{}'.format(section, name)
+            if 'hz' in stats:
+                yield key, 'hz', stats['hz'], True
+            elif 'calls_per_s' in stats:
+                yield key, 'calls_per_s', stats['calls_per_s'], True
+            elif 'mean_us' in stats:
+                yield key, 'mean_us', stats['mean_us'], False
+
+
+def compare(old, new):
+    old_values = dict((key, value) for key, _, value, _ in flatten(old['results']))
+    print('Compared to {} ({})'.format(old['environment'].get('label') or old['environment'].get('time'),
+                                       old['environment'].get('commit')))
+    for key, metric, value, higher_is_better in flatten(new['results']):
+        if key not in old_values or not old_values[key]:
+            continue
+        change = (value - old_values[key]) / old_values[key] * 100
+        better = change > 0 if higher_is_better else change < 0
+        print('  {:<56} {:>12.1f} -> {:>12.1f} {:<12} {:+7.1f}% {}'.format(
+            key, old_values[key], value, metric, change, 'better' if better else 'worse'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the arm I/O paths, on the brick')
+    parser.add_argument('-o', '--output', default='bench.json', help='JSON results file, - for stdout')
+    parser.add_argument('--label', help='free text describing the setup, e.g. the Wi-Fi adapter')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--root', help='sysfs class root, by default {} when the motor is connected and a fake '
+                                       'tree otherwise'.format(SYSFS_ROOT))
+    parser.add_argument('--address', default='outA', help='local large motor port')
+    parser.add_argument('--host', help='slave brick running the RPyC classic server, skipped when left out')
+    parser.add_argument('--remote-port', default='OUTPUT_A', help='medium motor port on the slave')
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    parser.add_argument('--rpyc-iterations', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per control loop run')
+    args = parser.parse_args()
+
+    root = args.root
+    fake_root = None
+    if root is None:
+        try:
+            find_motor_path(args.address)
+            root = SYSFS_ROOT
+        except DeviceNotFound:
+            root = fake_root = tempfile.mkdtemp()
+            create_fake_motor(root, 0, 'ev3-ports:{}'.format(args.address))
+
+    results = collections.OrderedDict()
+    try:
+        results['sysfs'] = bench_sysfs(root, args.address, args.iterations)
+    finally:
+        if fake_root is not None:
+            shutil.rmtree(fake_root)
+    print_results('sysfs ({})'.format('fake tree' if fake_root else root), list(results['sysfs'].items()))
+
+    if args.host:
+        results['rpyc'] = bench_rpyc(args.host, args.remote_port, args.rpyc_iterations)
+        print_results('RPyC ({})'.format(args.host), list(results['rpyc'].items()))
+    else:
+        results['rpyc'] = {'skipped': 'no --host given'}
+
+    results['scale_stick'] = collections.OrderedDict([('scale_stick', bench_scale_stick(5))])
+    print('scale_stick')
+    print('  {:<32} {:12.0f} calls/s'.format('scale_stick', results['scale_stick']['scale_stick']['calls_per_s']))
+
+    results['control_loop'] = bench_control_loop(args.duration)
+    print('control loop')
+    for name, stats in results['control_loop'].items():
+        print('  {:<44} {:12.0f} passes/s'.format(name, stats['hz']))
+
+    report = collections.OrderedDict([
+        ('environment', environment(args.label)),
+        ('sysfs_root', 'fake' if fake_root else root),
+        ('results', results),
+    ])
+    if args.output == '-':
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print('Results written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as compare_file:
+            compare(json.load(compare_file), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Input event to motor command latency, with input handled in a thread (the default) or in a process of its own
+# (SEPARATE_INPUT_PROCESS in robot_arm.py).
+#
+# Events are scheduled at a fixed interval, alternately pressing and releasing L1 so every event changes the waist
+# command. Latency runs from the time an event was due to the command it caused. The fake joints burn CPU for
+# every command, standing in for the serialisation work of RPyC calls which holds the GIL.
+import argparse
+import threading
+import time
+
+from arm_control import ControlState, Speeds, control_tick, handle_event
+from benchmarks import print_results, summarize
+from input_replay import ReplayEvent, recording_joints
+from shared_state import SharedControlState
+
+L1 = 310
+
+
+class BusyJoint:
+    """ recording joint which takes work seconds of CPU time per command """
+
+    def __init__(self, joint, work):
+        self._joint = joint
+        self._work = work
+
+    def _busy(self):
+        deadline = time.perf_counter() + self._work
+        while time.perf_counter() < deadline:
+            pass
+
+    def on(self, *args):
+        self._busy()
+        self._joint.on(*args)
+
+    def on_to_position(self, *args):
+        self._busy()
+        self._joint.on_to_position(*args)
+
+    def stop(self):
+        self._busy()
+        self._joint.stop()
+
+    def __getattr__(self, name):
+        return getattr(self._joint, name)
+
+
+def schedule(count, interval, start):
+    """ (due time, event) pairs """
+    return [(start + i * interval, ReplayEvent(0, 0, 1, L1, 1 - i % 2)) for i in range(count)]
+
+
+def feed(events, on_event):
+    for due, event in events:
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        on_event(due, event)
+
+
+def control_loop(read, count, work, timeout):
+    """ busy control loop like the motor thread, returns the latencies of the first command after every update """
+    joints = dict((name, BusyJoint(joint, work)) for name, joint in recording_joints([]).items())
+    state = ControlState()
+    speeds = Speeds()
+    latencies = []
+    last = 0
+    deadline = time.monotonic() + timeout
+    while len(latencies) < count and time.monotonic() < deadline:
+        updates, due = read(state)
+        control_tick(state, joints, speeds)
+        if updates != last:
+            last = updates
+            latencies.append(time.monotonic() - due)
+    return latencies
+
+
+def run_threaded(count, interval, work):
+    state_lock = threading.Lock()
+    shared = {'state': ControlState(), 'updates': 0, 'due': 0.0}
+
+    def on_event(due, event):
+        with state_lock:
+            handle_event(shared['state'], event)
+            shared['updates'] += 1
+            shared['due'] = due
+
+    def read(state):
+        with state_lock:
+            state.__dict__.update(shared['state'].__dict__)
+            return shared['updates'], shared['due']
+
+    start = time.monotonic() + 0.1
+    thread = threading.Thread(target=feed, args=(schedule(count, interval, start), on_event), daemon=True)
+    thread.start()
+    latencies = control_loop(read, count, work, count * interval + 5)
+    thread.join()
+    return latencies
+
+
+def run_process(count, interval, work):
+    import multiprocessing
+    shared = SharedControlState()
+    start = time.monotonic() + 0.1
+
+    def input_process():
+        state = ControlState()
+
+        def on_event(due, event):
+            handle_event(state, event)
+            shared.publish(state, stamp=due)
+        feed(schedule(count, interval, start), on_event)
+
+    def read(state):
+        shared.read(state)
+        return shared.updates, shared.stamp
+
+    process = multiprocessing.get_context('fork').Process(target=input_process, daemon=True)
+    process.start()
+    try:
+        return control_loop(read, count, work, count * interval + 5)
+    finally:
+        process.join(1)
+        shared.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare input to command latency of threaded and process input')
+    parser.add_argument('-n', '--events', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between events')
+    parser.add_argument('--work-us', type=float, default=2000, help='CPU time per motor command in microseconds')
+    args = parser.parse_args()
+
+    work = args.work_us / 1e6
+    results = []
+    for name, run in (('threaded', run_threaded), ('separate process', run_process)):
+        latencies = run(args.events, args.interval, work)
+        if len(latencies) < args.events:
+            print('{}: only {} of {} events reached the control loop'.format(name, len(latencies), args.events))
+        results.append((name, summarize(latencies)))
+    print_results('Input to command latency, {} events every {}ms, {}us per command'.format(
+        args.events, args.interval * 1000, args.work_us), results)
+
+
+if __name__ == '__main__':
+    main()
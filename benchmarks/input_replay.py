@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Throughput of input event dispatch and control loop passes, replaying a recorded session as fast as possible.
+#
+# Without a session file a synthetic one is generated: stick sweeps interleaved with button presses, at the rate
+# a DualShock reports while both sticks are moving.
+import argparse
+import time
+
+from arm_control import ControlState, Speeds, control_tick, handle_event
+from input_replay import ReplayEvent, read_events, recording_joints
+
+BUTTON_CODES = (310, 311, 308, 305, 307, 304, 312, 313, 317, 318)
+
+
+def synthetic_session(count, rate=250):
+    events = []
+    for index in range(count):
+        sec, usec = divmod(index * 1000000 // rate, 1000000)
+        if index % 10 == 9:
+            code = BUTTON_CODES[(index // 20) % len(BUTTON_CODES)]
+            events.append(ReplayEvent(sec, usec, 1, code, (index // 10) % 2))
+        else:
+            events.append(ReplayEvent(sec, usec, 3, 3 * (index % 2), (index * 7) % 256))
+    return events
+
+
+def throughput(events, tick, repeat):
+    """ events per second, best of repeat runs """
+    best = None
+    for _ in range(repeat):
+        log = []
+        joints = recording_joints(log)
+        state = ControlState()
+        speeds = Speeds()
+        tic = time.perf_counter()
+        for event in events:
+            handle_event(state, event)
+            if tick:
+                control_tick(state, joints, speeds)
+        elapsed = time.perf_counter() - tic
+        best = elapsed if best is None else min(best, elapsed)
+    return len(events) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark input dispatch by replaying a gamepad session')
+    parser.add_argument('path', nargs='?', help='session recorded with RECORD_INPUT, synthetic when left out')
+    parser.add_argument('-n', '--events', type=int, default=20000, help='length of the synthetic session')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    events = read_events(args.path) if args.path else synthetic_session(args.events)
+    # a replayed PS press would end the session, leave it out
+    events = [event for event in events if not (event.type == 1 and event.code == 316)]
+
+    print('{} ({} events)'.format(args.path or 'synthetic session', len(events)))
+    print('  {:<32} {:12.0f} events/s'.format('handle_event', throughput(events, False, args.repeat)))
+    print('  {:<32} {:12.0f} events/s'.format('handle_event + control_tick', throughput(events, True, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Compare RPyC and UDP slave controller transports over loopback.
+#
+# Starts a slave controller with simulated motors in this process, serving both transports on localhost, then
+# pushes setpoints through each client as fast as possible and measures throughput and round trip latency.
+import argparse
+import threading
+import time
+
+from benchmarks import measure, print_results
+from sim_motor import SimulatedMotor
+from slave_controller import RpycSlaveClient, SlaveController, make_rpyc_service
+from smart_motor import LimitedRangeMotor
+from udp_transport import UdpSetpointServer, UdpSlaveClient
+
+
+def start_slave():
+    motors = dict((name, LimitedRangeMotor(SimulatedMotor(name), name=name))
+                  for name in ('roll', 'pitch', 'spin', 'grabber'))
+    controller = SlaveController(motors)
+    threading.Thread(target=controller.run, daemon=True).start()
+
+    from rpyc.utils.server import ThreadedServer
+    rpyc_server = ThreadedServer(make_rpyc_service(controller), hostname='localhost', port=0)
+    threading.Thread(target=rpyc_server.start, daemon=True).start()
+
+    udp_server = UdpSetpointServer(controller, 'localhost', 0)
+    threading.Thread(target=udp_server.serve_forever, daemon=True).start()
+    return controller, rpyc_server, udp_server
+
+
+def setpoint_sender():
+    speeds = [10, -10, 20, -20]
+    index = [0]
+
+    def send(client):
+        index[0] += 1
+        client.set_velocity('roll', speeds[index[0] % len(speeds)])
+    return send
+
+
+def throughput(client, seconds):
+    send = setpoint_sender()
+    count = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        send(client)
+        count += 1
+    return count / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare RPyC and UDP slave transports over loopback')
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    parser.add_argument('-t', '--seconds', type=float, default=2.0, help='duration of the throughput runs')
+    args = parser.parse_args()
+
+    controller, rpyc_server, udp_server = start_slave()
+    while not rpyc_server.port:
+        time.sleep(0.01)
+
+    rpyc_client = RpycSlaveClient('localhost', rpyc_server.port)
+    send = setpoint_sender()
+    print_results('RPyC', [('set_velocity round trip', measure(lambda: send(rpyc_client), args.iterations))])
+    print('  throughput: {:.0f} setpoints/s'.format(throughput(rpyc_client, args.seconds)))
+    rpyc_client.close()
+
+    udp_client = UdpSlaveClient('localhost', udp_server.address[1])
+    send = setpoint_sender()
+    print_results('UDP', [('set_velocity send', measure(lambda: send(udp_client), args.iterations))])
+    applied = udp_server.stats.received
+    sent = throughput(udp_client, args.seconds)
+    applied = (udp_server.stats.received - applied) / args.seconds
+    # with UDP the sender never waits, what counts is how many setpoints the slave got to apply
+    print('  throughput: {:.0f} setpoints/s sent, {:.0f} setpoints/s applied'.format(sent, applied))
+    # let the last telemetry come in
+    time.sleep(0.2)
+    stats = udp_client.stats.summary()
+    print('  telemetry: {received} received, {lost} lost ({loss:.1%}), {stale} stale'.format(**stats))
+    if 'rtt_mean_ms' in stats:
+        print('  round trip: min {rtt_min_ms:.3f}ms mean {rtt_mean_ms:.3f}ms p99 {rtt_p99_ms:.3f}ms '
+              'max {rtt_max_ms:.3f}ms'.format(**stats))
+    server_stats = udp_server.stats.summary()
+    print('  setpoints: {received} applied, {lost} lost, {stale} stale'.format(**server_stats))
+    udp_client.close()
+
+    controller.stop()
+    udp_server.close()
+    rpyc_server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Compare the direct sysfs motor backend with ev3dev2's LargeMotor.
+#
+# Off the brick this runs against a fake tacho-motor tree in a temp directory. On the brick, pass
+# `--root /sys/class` to measure the real driver (the motor is only ever commanded to speed 0).
+import argparse
+import shutil
+import tempfile
+
+from benchmarks import measure, print_results
+from sysfs_motor import SysfsMotor, create_fake_motor
+
+
+def bench_motor(motor, iterations):
+    return [
+        ('read position', measure(lambda: motor.position, iterations)),
+        ('read state', measure(lambda: motor.state, iterations)),
+        ('is_running', measure(lambda: motor.is_running, iterations)),
+        ('on(0) + stop()', measure(lambda: (motor.on(0, brake=False), motor.stop()), iterations)),
+        ('on_to_position(0, 0)', measure(lambda: motor.on_to_position(0, 0, False, False), iterations)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare SysfsMotor with ev3dev2 LargeMotor')
+    parser.add_argument('--root', help='sysfs class root, defaults to a fake tree in a temp directory')
+    parser.add_argument('--address', default='outA')
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    root = args.root
+    if root is None:
+        root = tempfile.mkdtemp()
+        create_fake_motor(root, 0, 'ev3-ports:{}'.format(args.address))
+
+    try:
+        motor = SysfsMotor(args.address, sysfs_root=root)
+        print_results('SysfsMotor ({})'.format(root), bench_motor(motor, args.iterations))
+        motor.close()
+
+        try:
+            import ev3dev2
+            from ev3dev2.motor import LargeMotor
+        except ImportError:
+            print('ev3dev2 not installed, skipping LargeMotor comparison')
+            return
+
+        ev3dev2.Device.DEVICE_ROOT_PATH = root
+        motor = LargeMotor(args.address)
+        print_results('ev3dev2 LargeMotor ({})'.format(root), bench_motor(motor, args.iterations))
+    finally:
+        if args.root is None:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# Connections to all EV3 bricks of the arm, and the joints they drive.
+#
+# Which joint lives on which brick comes from a topology, either DEFAULT_TOPOLOGY (one master and one slave,
+# the original setup) or a JSON file with the same layout:
+#
+#   {
+#       "bricks": {"master": {}, "slave": {"host": "10.42.0.3"}, "rail": {"host": "10.42.0.4"}},
+#       "joints": {
+#           "elbow": {"brick": "master", "ports": ["OUTPUT_D"], "motor": "large", "speed": 30},
+#           "rail": {"brick": "rail", "ports": ["OUTPUT_A"], "motor": "large", "speed": 30},
+#           ...
+#       }
+#   }
+#
+# Every brick gets its own worker thread which sends the motor commands for its joints, so commands for
+# different bricks go out in parallel and a slow RPyC round trip to one brick doesn't hold up the others.
+import collections
+import copy
+import json
+import logging
+import threading
+import time
+
+from smart_motor import LimitedRangeMotor, LimitedRangeMotorSet, ColorSensorMotor, StaticRangeMotor
+from sysfs_motor import DeviceNotFound, SysfsMotor
+from trace_buffer import OP_HOLD, OP_ON, OP_READ, OP_RESET, OP_STOP, OP_TO_POSITION
+
+
+REMOTE_HOST = '10.42.0.3'
+
+DEFAULT_TOPOLOGY = {
+    'bricks': {
+        # no host means this brick, without RPyC
+        'master': {},
+        # controller: None for plain RPyC motor access, or 'rpyc'/'udp' when running slave_controller.py
+        'slave': {'host': REMOTE_HOST, 'controller': None},
+    },
+    'joints': {
+        'waist': {'brick': 'master', 'ports': ['OUTPUT_A'], 'motor': 'large', 'type': 'color', 'speed': 40,
+                  'sensor': 'INPUT_1', 'color': 5},  # 5 = red
+        'shoulder': {'brick': 'master', 'ports': ['OUTPUT_B', 'OUTPUT_C'], 'motor': 'large', 'speed': 30},
+        'elbow': {'brick': 'master', 'ports': ['OUTPUT_D'], 'motor': 'large', 'speed': 30},
+        'roll': {'brick': 'slave', 'ports': ['OUTPUT_A'], 'motor': 'medium', 'speed': 30},
+        'pitch': {'brick': 'slave', 'ports': ['OUTPUT_B'], 'motor': 'medium', 'speed': 10, 'coast': True},
+        'spin': {'brick': 'slave', 'ports': ['OUTPUT_C'], 'motor': 'medium', 'type': 'static', 'speed': 20,
+                 'max_pos': 14 * 360},
+        'grabber': {'brick': 'slave', 'ports': ['OUTPUT_D'], 'motor': 'medium', 'speed': 20, 'coast': True,
+                    'optional': True},
+    },
+}
+
+logger = logging.getLogger(__name__)
+
+
+def load_topology(path=None):
+    """ read a topology from a JSON file, or the default one when no path is given """
+    if path is None:
+        topology = copy.deepcopy(DEFAULT_TOPOLOGY)
+    else:
+        with open(path) as topology_file:
+            topology = json.load(topology_file)
+
+    bricks = topology.get('bricks', {})
+    for name, joint in topology.get('joints', {}).items():
+        if joint.get('brick') not in bricks:
+            raise ValueError('Joint {} is assigned to unknown brick {}'.format(name, joint.get('brick')))
+        if not joint.get('ports'):
+            raise ValueError('Joint {} has no motor ports'.format(name))
+    return topology
+
+
+class BrickWorker(threading.Thread):
+    """ send commands to a single brick from a thread of its own
+
+    Commands are keyed by joint. A newer command for a joint replaces one which hasn't been sent yet, so a
+    slow brick only ever has the latest command per joint waiting instead of a growing backlog.
+    """
+
+    def __init__(self, name):
+        threading.Thread.__init__(self, name='brick-{}'.format(name), daemon=True)
+        self._pending = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._running = True
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_delay = 0.0
+
+    def submit(self, key, fn, *args, **kwargs):
+        """ queue fn(*args, **kwargs), replacing anything still queued under the same key """
+        with self._condition:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (time.monotonic(), fn, args, kwargs)
+            self._condition.notify()
+
+    def call(self, fn, *args, **kwargs):
+        """ run fn on the worker, in order with queued commands, and wait for its result """
+        done = threading.Event()
+        result = {}
+
+        def run():
+            try:
+                result['value'] = fn(*args, **kwargs)
+            except Exception as ex:
+                result['error'] = ex
+            finally:
+                done.set()
+
+        self.submit(object(), run)
+        done.wait()
+        if 'error' in result:
+            raise result['error']
+        return result.get('value')
+
+    def flush(self, timeout=None):
+        """ wait until everything queued has been sent, returns False on timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def cancel(self):
+        """ drop everything still queued, returns True when a command is being sent right now """
+        with self._condition:
+            self.coalesced += len(self._pending)
+            self._pending.clear()
+            self._condition.notify_all()
+            return self._busy
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running and not self._pending:
+                    return
+                key, (queued, fn, args, kwargs) = self._pending.popitem(last=False)
+                self._busy = True
+
+            self.max_delay = max(self.max_delay, time.monotonic() - queued)
+            try:
+                fn(*args, **kwargs)
+                self.sent += 1
+            except Exception as ex:
+                self.errors += 1
+                logger.error('{} failed: {}'.format(self.name, ex))
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def stop(self):
+        """ finish what is queued, then exit """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+
+class QueuedJoint:
+    """ hand a joint's motor commands to its brick worker instead of sending them from the caller's thread
+
+    Repeating the previous command is free, and is_running reflects what was commanded so the control loop
+    doesn't have to read the motor state every pass.
+    """
+
+    def __init__(self, joint, worker, trace=None, joint_id=0):
+        self._joint = joint
+        self._worker = worker
+        self._trace = trace
+        self._id = joint_id
+        self._last = None
+        self._running = False
+
+    @property
+    def joint(self):
+        return self._joint
+
+    @property
+    def worker(self):
+        return self._worker
+
+    @property
+    def is_running(self):
+        return self._running
+
+    def _command(self, command, block=False):
+        if command == self._last:
+            return
+        self._last = command
+        self._running = command[0] != 'stop'
+        if self._trace:
+            if command[0] == 'on':
+                self._trace.record(OP_ON, self._id, 0, command[1])
+            elif command[0] == 'on_to_position':
+                self._trace.record(OP_TO_POSITION, self._id, command[2], command[1])
+            elif command[0] == 'hold':
+                self._trace.record(OP_HOLD, self._id, 0, command[1])
+            else:
+                self._trace.record(OP_STOP, self._id)
+        fn = getattr(self._joint, command[0])
+        if block:
+            self._worker.call(fn, *command[1:])
+        else:
+            self._worker.submit(self, fn, *command[1:])
+
+    def on(self, speed, brake=True, block=False):
+        self._command(('on', speed, brake, block), block)
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        self._command(('on_to_position', speed, position, brake, block), block)
+
+    def hold(self, duty_cycle):
+        self._command(('hold', duty_cycle))
+
+    def stop(self):
+        self._command(('stop',))
+
+    def emergency_stop(self):
+        """ stop the motor from the caller's thread right away, without waiting for the worker """
+        self._last = ('stop',)
+        self._running = False
+        # nothing, not even the trace, goes ahead of the stop
+        self._joint.stop()
+        if self._trace:
+            self._trace.record(OP_STOP, self._id)
+
+    def reset(self):
+        self._last = None
+        self._running = False
+        if self._trace:
+            self._trace.record(OP_RESET, self._id)
+        self._worker.call(self._joint.reset)
+
+    def calibrate(self, *args, **kwargs):
+        self._last = None
+        self._worker.call(self._joint.calibrate, *args, **kwargs)
+
+    def _refresh_estimate(self, force):
+        if self._joint.refresh_estimate(force) and self._trace:
+            self._trace.record(OP_READ, self._id, 0, self._joint.estimated_position)
+
+    def refresh_estimate(self, force=False):
+        # reading the encoder is the worker's job as well, so queue it behind the motor commands
+        self._worker.submit((self, 'estimate'), self._refresh_estimate, force)
+
+    def __getattr__(self, name):
+        return getattr(self._joint, name)
+
+
+class Brick:
+    """ a single EV3, local or over RPyC """
+
+    def __init__(self, name, host=None, controller=None, use_sysfs=False, worker_factory=None):
+        self.name = name
+        self.host = host
+        self.controller = controller
+        self._use_sysfs = use_sysfs and host is None
+        self._conn = None
+        self._client = None
+        # worker_factory(brick) can provide something else with the BrickWorker interface
+        self.worker = BrickWorker(name) if worker_factory is None else worker_factory(self)
+
+    def connect(self):
+        if self.host is None:
+            import importlib
+            self._module = importlib.import_module
+        else:
+            import rpyc
+            # Setup on slave EV3: https://ev3dev-lang.readthedocs.io/projects/python-ev3dev/en/stable/rpyc.html
+            # If this fails, verify your IP connectivty via ``ping X.X.X.X``
+            logger.info("Connecting RPyC to {}...".format(self.host))
+            self._conn = rpyc.classic.connect(self.host)
+            self._module = self._conn.modules.__getitem__
+            logger.info("RPyC started succesfully")
+        self.worker.start()
+
+    def module(self, name):
+        """ an ev3dev2 module on this brick, e.g. module('ev3dev2.motor') """
+        return self._module(name)
+
+    @property
+    def client(self):
+        """ slave controller client, for bricks running slave_controller.py """
+        if self._client is None:
+            from slave_controller import SLAVE_CONTROLLER_PORT, make_client
+            logger.info("Connecting to slave controller on {} using {}...".format(self.host, self.controller))
+            self._client = make_client(self.controller, self.host, SLAVE_CONTROLLER_PORT)
+        return self._client
+
+    def teleport(self, fn):
+        """ fn running on this brick, so it reads several remote attributes in one round trip
+
+        fn mustn't use anything from the module it is defined in.
+        """
+        if self._conn is None:
+            return fn
+        import rpyc
+        return rpyc.classic.teleport_function(self._conn, fn)
+
+    def leds(self):
+        return self.module('ev3dev2.led').Leds()
+
+    def power(self):
+        return self.module('ev3dev2.power').PowerSupply(name_pattern='*ev3*')
+
+    def motor(self, kind, port):
+        motor_module = self.module('ev3dev2.motor')
+        address = getattr(motor_module, port)
+        if self._use_sysfs:
+            return SysfsMotor(address)
+        return (motor_module.LargeMotor if kind == 'large' else motor_module.MediumMotor)(address)
+
+    def create_joint(self, name, config):
+        """ build the SmartMotor for a joint as described by its topology entry """
+        if self.controller:
+            from slave_controller import RemoteJoint
+            return RemoteJoint(self.client, name)
+
+        motors = [self.motor(config.get('motor', 'medium'), port) for port in config['ports']]
+        if config.get('coast'):
+            for motor in motors:
+                motor.stop_action = 'coast'
+
+        kind = config.get('type', 'limited')
+        speed = config.get('speed', 10)
+        if len(motors) > 1:
+            return LimitedRangeMotorSet(motors, speed=speed, name=name)
+        if kind == 'static':
+            return StaticRangeMotor(motors[0], maxPos=config['max_pos'], speed=speed, name=name)
+        if kind == 'color':
+            sensor_module = self.module('ev3dev2.sensor.lego')
+            sensor = sensor_module.ColorSensor(getattr(self.module('ev3dev2.sensor'), config['sensor']))
+            sensor.mode = sensor_module.ColorSensor.MODE_COL_COLOR
+            return ColorSensorMotor(motors[0], speed=speed, name=name, sensor=sensor, color=config['color'])
+        return LimitedRangeMotor(motors[0], speed=speed, name=name)
+
+    def close(self, timeout=None):
+        self.worker.stop()
+        self.worker.join(timeout)
+        if self._client is not None:
+            self._client.close()
+        if self._conn is not None:
+            self._conn.close()
+
+
+class BrickRegistry:
+    """ all bricks from a topology, with their joints """
+
+    def __init__(self, topology, use_sysfs=False, trace=None, worker_factory=None):
+        self.topology = topology
+        self.trace = trace
+        self.bricks = collections.OrderedDict(
+            (name, Brick(name, config.get('host'), config.get('controller'), use_sysfs, worker_factory))
+            for name, config in topology['bricks'].items())
+        self.joints = collections.OrderedDict()
+
+    def connect(self):
+        for brick in self.bricks.values():
+            brick.connect()
+
+    def create_joints(self):
+        """ build a QueuedJoint for every joint in the topology, optional joints which aren't connected are skipped """
+        for joint_id, (name, config) in enumerate(self.topology['joints'].items()):
+            brick = self.bricks[config['brick']]
+            try:
+                joint = brick.create_joint(name, config)
+            except (DeviceNotFound, ValueError):
+                if not config.get('optional'):
+                    raise
+                logger.info("{} motor not detected - running without it...".format(name.capitalize()))
+                continue
+            self.joints[name] = QueuedJoint(joint, brick.worker, self.trace, joint_id)
+        if self.trace is not None:
+            self.trace.joint_names = list(self.topology['joints'])
+        return self.joints
+
+    def flush(self, timeout=None):
+        """ wait until all bricks have sent their queued commands, returns False on timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = True
+        for brick in self.bricks.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done = brick.worker.flush(remaining) and done
+        return done
+
+    def close(self, timeout=None):
+        for brick in self.bricks.values():
+            brick.close(timeout)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Precomputed map of where the arm is about to hit the floor or its own base.
+#
+# The map covers the shoulder, elbow and pitch encoder positions on a grid. Every cell holds the clearance
+# between the arm and the floor/base at that pose, worked out by forward kinematics when the map is built, so the
+# control loop only does a table lookup. Building takes a while on the brick, so the map is cached on disk and
+# only rebuilt when the geometry changes. Build it up front with
+#
+#   python3 collision_map.py
+#
+# The geometry below has to be measured on the actual arm. Encoder positions are relative to the pose the arm
+# is in when the motors are reset at startup.
+import argparse
+import hashlib
+import json
+import math
+import struct
+import time
+
+
+GEOMETRY = {
+    # lengths in mm
+    'shoulder_height': 190,  # shoulder axis above the floor
+    'upper_arm': 200,  # shoulder axis to elbow axis
+    'forearm': 190,  # elbow axis to pitch axis
+    'hand': 120,  # pitch axis to grabber tip
+    'base_radius': 90,  # the base (and waist) as a cylinder around the waist axis
+    'base_height': 120,
+    # horizontal reach beyond which the waist gearing is strained
+    'waist_reach': 330,
+    # per joint: angle in degrees at encoder position 0, encoder counts per degree (negative when the encoder counts
+    # the other way), the encoder range covered by the map and its number of cells. The shoulder angle is against
+    # the horizontal, elbow and pitch are relative to the previous link (0 is straight)
+    'joints': {
+        'shoulder': {'zero': 90, 'counts_per_degree': -7.0, 'range': [-1000, 1000], 'cells': 64},
+        'elbow': {'zero': 0, 'counts_per_degree': -5.0, 'range': [-1000, 1000], 'cells': 64},
+        'pitch': {'zero': 0, 'counts_per_degree': 3.0, 'range': [-400, 400], 'cells': 32},
+    },
+}
+
+AXES = ('shoulder', 'elbow', 'pitch')
+
+# cell layout: clearance in CLEARANCE_UNIT mm steps in the low bits, EXTENDED set when past the waist reach.
+# Clearance is offset so poses inside the floor or base still tell how deep they are (-64 up to 190mm)
+CLEARANCE_MASK = 0x7F
+CLEARANCE_UNIT = 2
+CLEARANCE_OFFSET = 32
+EXTENDED = 0x80
+
+MAP_FILE = 'collision_map.bin'
+# magic, version, geometry hash, cells per axis
+HEADER = struct.Struct('<4sB20s3H')
+MAGIC = b'EV3C'
+VERSION = 1
+
+# guard defaults: block moves getting closer than MIN_CLEARANCE (mm), slow down below SLOW_CLEARANCE
+MIN_CLEARANCE = 20
+SLOW_CLEARANCE = 60
+SLOW_FACTOR = 0.5
+LOOKAHEAD = 30  # encoder counts ahead of the current position to check
+
+
+def cell_clearance(value):
+    """ clearance in mm stored in a cell """
+    return ((value & CLEARANCE_MASK) - CLEARANCE_OFFSET) * CLEARANCE_UNIT
+
+
+def geometry_hash(geometry):
+    return hashlib.sha1(json.dumps(geometry, sort_keys=True).encode()).digest()
+
+
+def clearance(geometry, shoulder, elbow, pitch):
+    """ (clearance in mm, horizontal reach in mm) of the arm at joint angles in degrees """
+    radius = geometry['base_radius']
+    height = geometry['base_height']
+
+    def point_clearance(r, z):
+        # distance above the floor, or outside the base cylinder (negative inside)
+        return min(z, max(abs(r) - radius, z - height))
+
+    angle = math.radians(shoulder)
+    r1 = geometry['upper_arm'] * math.cos(angle)
+    z1 = geometry['shoulder_height'] + geometry['upper_arm'] * math.sin(angle)
+    angle -= math.radians(elbow)
+    r2 = r1 + geometry['forearm'] * math.cos(angle)
+    z2 = z1 + geometry['forearm'] * math.sin(angle)
+    angle -= math.radians(pitch)
+    r3 = r2 + geometry['hand'] * math.cos(angle)
+    z3 = z2 + geometry['hand'] * math.sin(angle)
+
+    points = ((r1, z1), ((r1 + r2) / 2, (z1 + z2) / 2), (r2, z2), ((r2 + r3) / 2, (z2 + z3) / 2), (r3, z3))
+    return min(point_clearance(r, z) for r, z in points), max(abs(r2), abs(r3))
+
+
+def _axis_angles(joint):
+    """ joint angle in degrees at the center of every cell along an axis """
+    low, high = joint['range']
+    step = (high - low) / joint['cells']
+    return [joint['zero'] + (low + (i + 0.5) * step) / joint['counts_per_degree'] for i in range(joint['cells'])]
+
+
+class CollisionMap:
+    """ clearance of the arm for every cell of a shoulder x elbow x pitch encoder position grid """
+
+    def __init__(self, geometry, cells):
+        self.geometry = geometry
+        self.cells = cells
+        self.shape = tuple(geometry['joints'][axis]['cells'] for axis in AXES)
+        if len(cells) != self.shape[0] * self.shape[1] * self.shape[2]:
+            raise ValueError('Collision map has {} cells, expected {}'.format(len(cells), self.shape))
+        # per axis: (first encoder position, cells per encoder count, last cell index)
+        self._axes = []
+        for axis, size in zip(AXES, self.shape):
+            low, high = geometry['joints'][axis]['range']
+            self._axes.append((low, size / (high - low), size - 1))
+
+    def index(self, shoulder, elbow, pitch):
+        """ cell index for encoder positions, positions outside the map use the nearest edge cell """
+        (s0, s_scale, s_max), (e0, e_scale, e_max), (p0, p_scale, p_max) = self._axes
+        s = min(max(int((shoulder - s0) * s_scale), 0), s_max)
+        e = min(max(int((elbow - e0) * e_scale), 0), e_max)
+        p = min(max(int((pitch - p0) * p_scale), 0), p_max)
+        return (s * self.shape[1] + e) * self.shape[2] + p
+
+    def lookup(self, shoulder, elbow, pitch):
+        """ raw cell value, see clearance_mm() and is_extended() """
+        return self.cells[self.index(shoulder, elbow, pitch)]
+
+    def clearance_mm(self, shoulder, elbow, pitch):
+        return cell_clearance(self.lookup(shoulder, elbow, pitch))
+
+    def is_extended(self, shoulder, elbow, pitch):
+        return bool(self.lookup(shoulder, elbow, pitch) & EXTENDED)
+
+    def save(self, path):
+        with open(path, 'wb') as map_file:
+            map_file.write(HEADER.pack(MAGIC, VERSION, geometry_hash(self.geometry), *self.shape))
+            map_file.write(self.cells)
+
+
+def build_map(geometry=GEOMETRY):
+    joints = geometry['joints']
+    shoulder_angles, elbow_angles, pitch_angles = (_axis_angles(joints[axis]) for axis in AXES)
+    cells = bytearray(len(shoulder_angles) * len(elbow_angles) * len(pitch_angles))
+    index = 0
+    for shoulder in shoulder_angles:
+        for elbow in elbow_angles:
+            for pitch in pitch_angles:
+                distance, reach = clearance(geometry, shoulder, elbow, pitch)
+                value = min(CLEARANCE_MASK, max(0, int(distance // CLEARANCE_UNIT) + CLEARANCE_OFFSET))
+                if reach > geometry['waist_reach']:
+                    value |= EXTENDED
+                cells[index] = value
+                index += 1
+    return CollisionMap(geometry, cells)
+
+
+def load_map(path, geometry=GEOMETRY):
+    """ read a cached map, returns None when there is none or it was built for a different geometry """
+    try:
+        with open(path, 'rb') as map_file:
+            header = map_file.read(HEADER.size)
+            cells = bytearray(map_file.read())
+    except (IOError, OSError):
+        return None
+    if len(header) != HEADER.size:
+        return None
+    magic, version, digest, s, e, p = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or digest != geometry_hash(geometry):
+        return None
+    try:
+        return CollisionMap(geometry, cells)
+    except ValueError:
+        return None
+
+
+def load_or_build(path=MAP_FILE, geometry=GEOMETRY):
+    collision_map = load_map(path, geometry)
+    if collision_map is None:
+        collision_map = build_map(geometry)
+        collision_map.save(path)
+    return collision_map
+
+
+class CollisionGuard:
+    """ limit joint speeds against a collision map, from the joints' position estimates
+
+    update() once per control loop pass, then limit() every speed before it is sent. A move which would bring
+    the arm closer than min_clearance to the floor or base is blocked, one that gets closer while below
+    slow_clearance is slowed down, and moves away from an obstacle are always allowed. The waist is slowed while
+    the arm is extended.
+    """
+
+    def __init__(self, collision_map, joints, lookahead=LOOKAHEAD, min_clearance=MIN_CLEARANCE,
+                 slow_clearance=SLOW_CLEARANCE, slow_factor=SLOW_FACTOR):
+        self._map = collision_map
+        self._joints = [joints.get(axis) for axis in AXES]
+        for axis, joint in zip(AXES, self._joints):
+            if joint is not None and not hasattr(joint, 'estimated_position'):
+                # e.g. joints run by the slave controller
+                raise ValueError('The {} joint has no position estimate to guard it with'.format(axis))
+        self._lookahead = lookahead
+        self._min_clearance = min_clearance // CLEARANCE_UNIT + CLEARANCE_OFFSET
+        self._slow_clearance = slow_clearance // CLEARANCE_UNIT + CLEARANCE_OFFSET
+        self._slow_factor = slow_factor
+        self._positions = [0.0, 0.0, 0.0]
+        self._cell = 0
+        self.blocked = 0
+        self.slowed = 0
+
+    def update(self):
+        """ look up the cell of the current pose """
+        for axis, joint in enumerate(self._joints):
+            if joint is not None:
+                self._positions[axis] = joint.estimated_position
+        self._cell = self._map.lookup(*self._positions)
+
+    def limit(self, name, speed, target=None):
+        """ speed a joint may move at, 0 when the move has to be blocked
+
+        target is the position for run-to-position moves, the direction of other moves follows the speed.
+        """
+        if not speed:
+            return speed
+        if name == 'waist':
+            if self._cell & EXTENDED:
+                self.slowed += 1
+                return speed * self._slow_factor
+            return speed
+        if name not in AXES:
+            return speed
+
+        axis = AXES.index(name)
+        position = self._positions[axis]
+        if target is not None:
+            direction = 1 if target > position else -1
+        else:
+            direction = 1 if speed > 0 else -1
+        probe = list(self._positions)
+        probe[axis] = position + direction * self._lookahead
+
+        current = self._cell & CLEARANCE_MASK
+        ahead = self._map.lookup(*probe) & CLEARANCE_MASK
+        if ahead >= current:
+            # moving away from whatever is closest
+            return speed
+        if ahead < self._min_clearance:
+            self.blocked += 1
+            return 0
+        if ahead < self._slow_clearance:
+            self.slowed += 1
+            return speed * self._slow_factor
+        return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the collision map cache for robot_arm.py')
+    parser.add_argument('--path', default=MAP_FILE)
+    parser.add_argument('--rebuild', action='store_true', help='rebuild even when the cached map is up to date')
+    args = parser.parse_args()
+
+    tic = time.perf_counter()
+    collision_map = None if args.rebuild else load_map(args.path)
+    if collision_map is None:
+        collision_map = build_map()
+        collision_map.save(args.path)
+        print('Built {} in {:.2f}s'.format(args.path, time.perf_counter() - tic))
+    else:
+        print('{} is up to date'.format(args.path))
+
+    cells = collision_map.cells
+    blocked = sum(1 for value in cells if cell_clearance(value) < MIN_CLEARANCE)
+    extended = sum(1 for value in cells if value & EXTENDED)
+    print('{} cells ({} x {} x {}), {:.1%} too close to floor or base, {:.1%} extended'.format(
+        len(cells), collision_map.shape[0], collision_map.shape[1], collision_map.shape[2],
+        blocked / len(cells), extended / len(cells)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Stop every joint on every brick at once, within a deadline.
+#
+# Stops are sent directly from one thread per joint instead of through the brick workers, so a slow RPyC round
+# trip to one motor doesn't hold up the others and a worker stuck on a command can't hold up the stop. Joints
+# which haven't confirmed stopping by the deadline are reset, which also leaves the motor coasting.
+import collections
+import logging
+import threading
+import time
+
+from trace_buffer import OP_MARK
+
+
+DEADLINE = 1.0  # seconds for all joints to confirm stopping
+ESCALATION_TIMEOUT = 1.0  # seconds for the resets of joints which didn't
+
+logger = logging.getLogger(__name__)
+
+
+class StopReport:
+    """ outcome of an emergency stop, times in seconds since it started """
+
+    def __init__(self):
+        self.stopped = collections.OrderedDict()  # joint name: time it confirmed stopping
+        self.escalated = collections.OrderedDict()  # joint name: True when the reset went through
+        self.elapsed = None  # time until all joints were stopped, None if some never were
+
+    @property
+    def all_stopped(self):
+        return self.elapsed is not None
+
+    def summary(self):
+        if not self.stopped and not self.escalated:
+            return 'No joints to stop'
+        if self.all_stopped:
+            text = 'All joints stopped in {}ms'.format(round(self.elapsed * 1000, 1))
+        else:
+            text = 'Not all joints stopped'
+        slowest = max(self.stopped.items(), key=lambda item: item[1]) if self.stopped else None
+        if slowest:
+            text += ', slowest {} ({}ms)'.format(slowest[0], round(slowest[1] * 1000, 1))
+        for name, reset in self.escalated.items():
+            text += ', {} {}'.format(name, 'reset' if reset else 'FAILED to reset')
+        return text
+
+
+def _run_all(targets, deadline, clock):
+    """ run callables in parallel threads, waiting for them until the deadline """
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline - clock()))
+
+
+def emergency_stop(joints, deadline=DEADLINE, escalation_timeout=ESCALATION_TIMEOUT, trace=None,
+                   clock=time.monotonic):
+    """ stop all QueuedJoints in parallel, returns a StopReport
+
+    A joint counts as stopped when its stop command went through, no command still in flight on its brick
+    worker could restart it, and the motor no longer reports running.
+    """
+    report = StopReport()
+    start = clock()
+    stop_deadline = start + deadline
+
+    # nothing queued should go out after the stop, commands already in flight are waited for below
+    busy = dict((worker, worker.cancel()) for worker in set(joint.worker for joint in joints.values()))
+
+    def stop_joint(name, joint):
+        try:
+            joint.emergency_stop()
+            if busy[joint.worker]:
+                if not joint.worker.flush(max(0.0, stop_deadline - clock())):
+                    return
+                # the command that was in flight may have restarted the motor
+                joint.emergency_stop()
+            if not joint.joint.is_running:
+                report.stopped[name] = clock() - start
+        except Exception as ex:
+            logger.error('Failed to stop {}: {}'.format(name, ex))
+
+    _run_all([lambda name=name, joint=joint: stop_joint(name, joint) for name, joint in joints.items()],
+             stop_deadline, clock)
+
+    unconfirmed = [name for name in joints if name not in report.stopped]
+    if unconfirmed:
+        logger.error('No stop confirmation from {}, resetting'.format(', '.join(unconfirmed)))
+
+        def reset_joint(name, joint):
+            try:
+                joint.joint.reset()
+                report.escalated[name] = True
+            except Exception as ex:
+                logger.error('Failed to reset {}: {}'.format(name, ex))
+
+        for name in unconfirmed:
+            report.escalated[name] = False
+        _run_all([lambda name=name: reset_joint(name, joints[name]) for name in unconfirmed],
+                 clock() + escalation_timeout, clock)
+
+    if all(report.escalated.get(name) for name in unconfirmed):
+        report.elapsed = clock() - start
+    if trace is not None:
+        trace.record(OP_MARK, 0, len(unconfirmed), -1.0 if report.elapsed is None else report.elapsed)
+    return report
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Grip detection for the grabber.
+#
+# Closing the grabber is a speed command for as long as R3 is held. Once the jaws close on something, the speed
+# regulation keeps pushing against it at full duty cycle, draining the battery and heating up the motor for nothing.
+# A GripJoint samples duty cycle and speed in the background while closing. Once the motor pushes hard without
+# getting anywhere, it switches to a run-direct command with a lower, fixed duty cycle and holds on with limited
+# force until the grabber is told to open.
+#
+# Samples are read through the grabber brick's worker like every other motor access, all values in one call
+# (teleported to a remote brick, see Brick.teleport()). On the slave brick that's an RPyC round trip which may have
+# to wait for other commands, so the contact rule is in seconds, not in samples.
+import logging
+import threading
+import time
+
+
+SAMPLE_INTERVAL = 0.01  # seconds from one sample to the next while closing, if reading them is that quick
+# duty cycle percentage at which the speed regulation is pushing against something
+CONTACT_DUTY = 70
+# fraction of the commanded speed below which the grabber isn't getting anywhere
+CONTACT_SPEED = 0.3
+# consecutive samples showing contact, a single slow one may be noise
+CONTACT_SAMPLES = 2
+# seconds contact has to last, however long the samples take
+CONTACT_TIME = 0.03
+# seconds after a close command during which samples are ignored, accelerating looks just like contact
+STARTUP = 0.15
+# duty cycle percentage holding on to something
+HOLD_DUTY = 30
+# tacho counts, contact this close to the closed end means there's nothing in between
+EMPTY_MARGIN = 30
+
+GRIP_IDLE = 'idle'
+GRIP_CLOSING = 'closing'
+GRIP_HOLDING = 'holding'
+GRIP_CLOSED = 'closed'  # closed all the way without finding anything
+
+logger = logging.getLogger(__name__)
+
+
+def read_sample(motor):
+    """ duty cycle, speed and position of a motor in one go """
+    # teleported to remote bricks, so it mustn't use anything from this module
+    return motor.duty_cycle, motor.speed, motor.position
+
+
+class GripDetector:
+    """ tell contact from duty cycle and speed samples of a closing grabber
+
+    Contact is when the duty cycle is at least contact_duty while the speed is below speed_ratio of the speed the
+    motor was told to run at, for samples samples in a row spanning at least contact_time seconds.
+    """
+
+    def __init__(self, contact_duty=CONTACT_DUTY, speed_ratio=CONTACT_SPEED, samples=CONTACT_SAMPLES,
+                 contact_time=CONTACT_TIME, startup=STARTUP, clock=time.monotonic):
+        self._contact_duty = contact_duty
+        self._speed_ratio = speed_ratio
+        self._samples = samples
+        self._contact_time = contact_time
+        self._startup = startup
+        self._clock = clock
+        self._expected = 0
+        self._started = clock()
+        self._count = 0
+        self._since = None
+
+    def start(self, speed):
+        """ a close command at speed (tacho counts/s) was sent """
+        self._expected = abs(speed)
+        self._started = self._clock()
+        self._count = 0
+
+    def update(self, duty_cycle, speed):
+        """ a new sample, returns True once it shows contact """
+        now = self._clock()
+        if now - self._started < self._startup:
+            return False
+        if abs(duty_cycle) >= self._contact_duty and abs(speed) <= self._expected * self._speed_ratio:
+            if not self._count:
+                self._since = now
+            self._count += 1
+        else:
+            self._count = 0
+        return self._count >= self._samples and now - self._since >= self._contact_time
+
+
+class GripJoint:
+    """ a grabber joint holding on with limited force to whatever it closes on
+
+    Wraps the grabber joint (a QueuedJoint in robot_arm.py, or anything with a hold() method), samples are read
+    on its worker when it has one. read is read_sample(), or a copy of it teleported to the grabber's brick.
+    close_direction is the sign of the speeds closing the grabber. Once holding, closing again and stop() are
+    ignored, so letting go of the close button doesn't drop anything. is_running is False while holding, so the
+    control loop doesn't keep trying to stop it. Opening, moving it to a position or release() let go.
+    """
+
+    def __init__(self, joint, close_direction=-1, hold_duty=HOLD_DUTY, empty_margin=EMPTY_MARGIN,
+                 interval=SAMPLE_INTERVAL, detector=None, read=read_sample, clock=time.monotonic):
+        self._joint = joint
+        self._motor = joint.motor
+        self._read = read
+        worker = getattr(joint, 'worker', None)
+        self._call = worker.call if worker is not None else (lambda fn, *args: fn(*args))
+        self._close_direction = close_direction
+        self._hold_duty = hold_duty
+        self._empty_margin = empty_margin
+        self._interval = interval
+        self._detector = detector or GripDetector(clock=clock)
+        self._max_speed = joint.max_speed
+        # the control loop and the sampler both send commands
+        self._lock = threading.RLock()
+        self._closing = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._state = GRIP_IDLE
+        self.holds = 0
+        self.empty = 0
+        self.samples = 0
+        self.errors = 0
+        # (duty cycle, speed) of the latest sample
+        self.last_sample = None
+        # seconds a sample takes, averaged
+        self.sample_time = None
+
+    @property
+    def state(self):
+        """ one of the GRIP_ constants """
+        return self._state
+
+    @property
+    def is_running(self):
+        return self._state != GRIP_HOLDING and self._joint.is_running
+
+    def _set_state(self, state):
+        self._state = state
+        if state == GRIP_CLOSING:
+            self._closing.set()
+        else:
+            self._closing.clear()
+
+    def on(self, speed, brake=True, block=False):
+        with self._lock:
+            if speed * self._close_direction > 0:
+                if self._state in (GRIP_HOLDING, GRIP_CLOSED):
+                    # nothing more to close
+                    return
+                if self._state != GRIP_CLOSING:
+                    self._detector.start(speed * self._max_speed / 100.0)
+                    self._set_state(GRIP_CLOSING)
+            else:
+                self._set_state(GRIP_IDLE)
+            self._joint.on(speed, brake, block)
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        with self._lock:
+            self._set_state(GRIP_IDLE)
+            self._joint.on_to_position(speed, position, brake, block)
+
+    def stop(self):
+        with self._lock:
+            if self._state == GRIP_HOLDING:
+                return
+            if self._state == GRIP_CLOSING:
+                self._set_state(GRIP_IDLE)
+            self._joint.stop()
+
+    def release(self):
+        """ let go of whatever is held """
+        with self._lock:
+            self._set_state(GRIP_IDLE)
+            self._joint.stop()
+
+    def emergency_stop(self):
+        with self._lock:
+            self._set_state(GRIP_IDLE)
+            self._joint.emergency_stop()
+
+    def reset(self):
+        with self._lock:
+            self._set_state(GRIP_IDLE)
+            self._joint.reset()
+
+    def calibrate(self, *args, **kwargs):
+        with self._lock:
+            self._set_state(GRIP_IDLE)
+            self._joint.calibrate(*args, **kwargs)
+
+    def _distance_to_closed(self, position):
+        if self._close_direction < 0:
+            return position - self._joint.minPos
+        return self._joint.maxPos - position
+
+    def sample(self):
+        """ read duty cycle and speed once while closing, and hold on once they show contact """
+        if self._state != GRIP_CLOSING:
+            return
+        tic = time.monotonic()
+        duty_cycle, speed, position = self._call(self._read, self._motor)
+        elapsed = time.monotonic() - tic
+        self.sample_time = elapsed if self.sample_time is None else self.sample_time * 0.9 + elapsed * 0.1
+        self.samples += 1
+        self.last_sample = (duty_cycle, speed)
+        if not self._detector.update(duty_cycle, speed):
+            return
+
+        with self._lock:
+            if self._state != GRIP_CLOSING:
+                # opened or stopped in the meantime
+                return
+            if self._distance_to_closed(position) <= self._empty_margin:
+                self.empty += 1
+                self._set_state(GRIP_CLOSED)
+                self._joint.stop()
+                logger.info('Grabber closed at {}, nothing to hold on to'.format(position))
+            else:
+                self.holds += 1
+                self._set_state(GRIP_HOLDING)
+                self._joint.hold(self._close_direction * self._hold_duty)
+                logger.info('Grabber holding on at {} (duty cycle {}%, speed {})'.format(
+                    position, duty_cycle, speed))
+        if hasattr(self._joint, 'refresh_estimate'):
+            # the estimate ran on at the commanded speed
+            self._joint.refresh_estimate(True)
+
+    def _run(self):
+        while True:
+            self._closing.wait()
+            if self._stop_event.is_set():
+                break
+            tic = time.monotonic()
+            try:
+                self.sample()
+            except Exception as ex:
+                # a remote brick going away shouldn't take the sampler down with it
+                self.errors += 1
+                logger.debug('Failed to sample the grabber: {}'.format(ex))
+            self._stop_event.wait(max(0.0, self._interval - (time.monotonic() - tic)))
+
+    def start_sampling(self):
+        """ sample in a background thread whenever the grabber is closing """
+        self._thread = threading.Thread(target=self._run, name='grip', daemon=True)
+        self._thread.start()
+
+    def stop_sampling(self, timeout=1):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._closing.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def __getattr__(self, name):
+        return getattr(self._joint, name)
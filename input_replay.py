@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Record gamepad sessions and replay them through the input handling and control loop, without a controller.
+#
+# Set RECORD_INPUT in robot_arm.py to capture a session while driving the arm, then replay it:
+#
+#   python3 input_replay.py session.evrec             # print the motor commands it results in
+#   python3 input_replay.py session.evrec --realtime  # same, at the pace it was recorded
+#
+# Replaying into recording joints makes the resulting command sequence comparable between code changes, see
+# tests/input_replay.py and benchmarks/input_replay.py.
+import argparse
+import collections
+import struct
+import time
+
+from arm_control import ACTION_QUIT, ControlState, Speeds, control_tick, handle_event
+from stick_filter import DEFAULT_CHAIN, build_filter
+
+
+# sec, usec, type, code, value, the fields of a kernel input_event
+EVENT = struct.Struct('<qiHHi')
+HEADER = struct.Struct('<4sB')
+MAGIC = b'EV3I'
+VERSION = 1
+
+# joint limits used when replaying without hardware, roughly those found by calibration
+REPLAY_LIMITS = {
+    'waist': (-900, 900),
+    'shoulder': (-1000, 0),
+    'elbow': (-2800, 0),
+    'roll': (-400, 400),
+    'pitch': (-200, 200),
+    'spin': (-1000, 1000),
+    'grabber': (-1200, 0),
+}
+
+
+class ReplayEvent(collections.namedtuple('ReplayEvent', 'sec usec type code value')):
+    """ stands in for evdev's InputEvent """
+    __slots__ = ()
+
+    def timestamp(self):
+        return self.sec + self.usec / 1000000.0
+
+
+class EventRecorder:
+    """ append input events to a session file """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+
+    def record(self, event):
+        self._file.write(EVENT.pack(event.sec, event.usec, event.type, event.code, event.value))
+        self.count += 1
+
+    def wrap(self, events):
+        """ pass events through, recording each one on the way """
+        for event in events:
+            self.record(event)
+            yield event
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_events(path):
+    """ all events in a session file, as ReplayEvents """
+    with open(path, 'rb') as session_file:
+        header = session_file.read(HEADER.size)
+        if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION):
+            raise ValueError('{} is not an input session this reader understands'.format(path))
+        data = session_file.read()
+    return [ReplayEvent(*values) for values in EVENT.iter_unpack(data[:len(data) - len(data) % EVENT.size])]
+
+
+def replay(events, realtime=True, speed=1.0, clock=time.monotonic, sleep=time.sleep):
+    """ yield events like read_loop() would, at the recorded pace (scaled by speed) or as fast as possible """
+    start = None
+    for event in events:
+        if realtime:
+            if start is None:
+                start = (clock(), event.timestamp())
+            else:
+                delay = start[0] + (event.timestamp() - start[1]) / speed - clock()
+                if delay > 0:
+                    sleep(delay)
+        yield event
+
+
+class RecordingJoint:
+    """ fake joint logging the commands it gets, skipping repeats like the brick workers do """
+
+    def __init__(self, name, log, min_pos=-1000, max_pos=1000):
+        self.name = name
+        self.minPos = min_pos
+        self.maxPos = max_pos
+        self.centerPos = (min_pos + max_pos) // 2
+        self.is_running = False
+        self._log = log
+        self._last = None
+
+    def _command(self, command):
+        if command != self._last:
+            self._last = command
+            self._log.append((self.name,) + command)
+
+    def on(self, speed, brake=True, block=False):
+        self.is_running = bool(speed)
+        self._command(('on', speed))
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        self.is_running = True
+        self._command(('on_to_position', speed, position))
+
+    def stop(self):
+        self.is_running = False
+        self._command(('stop',))
+
+
+def recording_joints(log, grabber=True):
+    return dict((name, RecordingJoint(name, log, *limits)) for name, limits in REPLAY_LIMITS.items()
+                if grabber or name != 'grabber')
+
+
+def run_session(events, joints, state=None, speeds=None):
+    """ feed events through the input handling, with a control loop pass after every event
+
+    Returns the actions handle_event asked for. Stops at the PS button, like robot_arm.py.
+    """
+    state = state or ControlState()
+    speeds = speeds or Speeds()
+    actions = []
+    for event in events:
+        action = handle_event(state, event)
+        if action is not None:
+            actions.append(action)
+        control_tick(state, joints, speeds)
+        if action == ACTION_QUIT:
+            break
+    return actions
+
+
+def replay_commands(path, realtime=False, grabber=True):
+    """ the motor command sequence a session file results in """
+    log = []
+    run_session(replay(read_events(path), realtime=realtime), recording_joints(log, grabber))
+    return log
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded gamepad session and print the motor commands')
+    parser.add_argument('path')
+    parser.add_argument('--realtime', action='store_true', help='replay at the pace the session was recorded')
+    parser.add_argument('--speed', type=float, default=1.0, help='realtime replay speed factor')
+    parser.add_argument('--no-grabber', action='store_true')
+    parser.add_argument('--filter', action='store_true', help='pass the sticks through the default filter chain')
+    args = parser.parse_args()
+
+    filters = {}
+    if args.filter:
+        filters = dict((axis, build_filter(DEFAULT_CHAIN)) for axis in ('shoulder', 'elbow'))
+
+    events = read_events(args.path)
+    log = []
+    tic = time.perf_counter()
+    run_session(replay(events, realtime=args.realtime, speed=args.speed), recording_joints(log, not args.no_grabber),
+                ControlState(filters))
+    elapsed = time.perf_counter() - tic
+
+    for command in log:
+        print(' '.join(str(part) for part in command))
+    print('{} events, {} commands in {:.3f}s'.format(len(events), len(log), elapsed))
+    for axis, stick_filter in filters.items():
+        print('{}: {} of {} stick updates suppressed'.format(axis, stick_filter.suppressed, stick_filter.updates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import time
+
+
+# bounds on how often the encoder is actually read, in seconds
+MIN_READ_INTERVAL = 0.05
+MAX_READ_INTERVAL = 2.0
+# prediction error (in tacho counts) we're happy with before reading more often
+TOLERANCE = 15
+# uncertainty (in tacho counts) after which a read is due regardless of the interval
+MAX_UNCERTAINTY = 60
+# initial guess of the relative speed error, learned from reads afterwards
+DRIFT = 0.1
+# time the motor needs to reach a new speed, in seconds
+RESPONSE_TIME = 0.1
+
+
+class JointEstimator:
+    """ dead-reckoning estimate of a joint position from the commanded speed
+
+    The position is predicted from the last real read and the speed commands sent since, with an uncertainty
+    which grows with distance travelled. A real read is only done when it is due: the read interval shrinks
+    when predictions turn out wrong and grows again while they are right, and a read is forced when the
+    uncertainty gets too large.
+    """
+
+    def __init__(self, read_position, max_speed, tolerance=TOLERANCE, max_uncertainty=MAX_UNCERTAINTY,
+                 min_interval=MIN_READ_INTERVAL, max_interval=MAX_READ_INTERVAL, drift=DRIFT,
+                 response_time=RESPONSE_TIME, clock=time.monotonic):
+        self._read_position = read_position
+        self._max_speed = max_speed
+        self._tolerance = tolerance
+        self._max_uncertainty = max_uncertainty
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._response_time = response_time
+        self._clock = clock
+        self.drift = drift
+        self.interval = min_interval
+
+        # state at the last anchor point (a read or a command)
+        self._position = 0.0
+        self._uncertainty = 0.0
+        self._time = clock()
+        self._velocity = 0.0  # tacho counts per second
+        self._target = None
+        self._last_read = None
+        self._travelled = 0.0
+
+        self.reads = 0
+        self.predictions = 0
+        self.max_error = 0
+
+    def _moving_time(self, now):
+        """ time spent moving since the last anchor, run-to-position commands stop at their target """
+        dt = now - self._time
+        if self._target is not None and self._velocity:
+            dt = min(dt, max(0.0, (self._target - self._position) / self._velocity))
+        return dt
+
+    def _predict(self, now):
+        dt = self._moving_time(now)
+        position = self._position + self._velocity * dt
+        uncertainty = self._uncertainty + abs(self._velocity) * dt * self.drift
+        return position, uncertainty
+
+    def _anchor(self, now):
+        self._travelled += abs(self._velocity) * self._moving_time(now)
+        self._position, self._uncertainty = self._predict(now)
+        self._time = now
+
+    def command(self, speed, target=None):
+        """ register a speed command (percentage), with the target position for run-to-position commands """
+        now = self._clock()
+        self._anchor(now)
+        velocity = speed * self._max_speed / 100.0
+        if target is not None:
+            velocity = abs(velocity) if target >= self._position else -abs(velocity)
+        # the motor doesn't change speed instantly
+        self._uncertainty += abs(velocity - self._velocity) * self._response_time
+        self._velocity = velocity
+        self._target = target
+
+    def stop(self):
+        self.command(0)
+
+    @property
+    def position(self):
+        """ predicted position """
+        self.predictions += 1
+        return self._predict(self._clock())[0]
+
+    @property
+    def uncertainty(self):
+        return self._predict(self._clock())[1]
+
+    def interval_bounds(self):
+        """ (low, high) range the position is expected to be in """
+        position, uncertainty = self._predict(self._clock())
+        return position - uncertainty, position + uncertainty
+
+    def due(self):
+        now = self._clock()
+        uncertainty = self._predict(now)[1]
+        if self._last_read is None or uncertainty > self._max_uncertainty:
+            return True
+        standing_still = not self._velocity or self._moving_time(now) < now - self._time
+        if standing_still and uncertainty <= self._tolerance:
+            # nothing to drift
+            return False
+        return now - self._last_read >= self.interval
+
+    def _due_near_limit(self):
+        now = self._clock()
+        if self._last_read is not None and now - self._last_read < self._min_interval:
+            return False
+        return self._predict(now)[1] > 0
+
+    def correct(self, position):
+        """ feed a real position read into the estimate """
+        now = self._clock()
+        predicted, _ = self._predict(now)
+        error = abs(position - predicted)
+        self.max_error = max(self.max_error, error)
+
+        if self._last_read is not None:
+            travelled = self._travelled + abs(self._velocity) * self._moving_time(now)
+            if error > self._tolerance:
+                self.interval = max(self._min_interval, self.interval / 2)
+                if travelled:
+                    self.drift = min(1.0, max(self.drift, error / travelled))
+            else:
+                self.interval = min(self._max_interval, self.interval * 1.5)
+                self.drift = max(DRIFT / 10, self.drift * 0.9)
+
+        self._position = float(position)
+        self._uncertainty = 0.0
+        self._time = now
+        self._travelled = 0.0
+        self._last_read = now
+        self.reads += 1
+
+    def set_position(self, position):
+        """ the encoder was set to a known position (e.g. by a reset), without learning from it """
+        self._position = float(position)
+        self._uncertainty = 0.0
+        self._time = self._clock()
+        self._travelled = 0.0
+
+    def update(self, force=False, near_limit=False):
+        """ read the real position if it is due, returns True when a read was done
+
+        near_limit reads whenever the position is uncertain at all, but still not more often than min_interval.
+        """
+        if force or self.due() or (near_limit and self._due_near_limit()):
+            self.correct(self._read_position())
+            return True
+        return False
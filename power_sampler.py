@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import collections
+import logging
+import os
+import threading
+import time
+
+
+SAMPLE_INTERVAL = 1.0  # seconds
+HISTORY = 600  # samples per supply
+# number of recent samples averaged for compensation, load spikes shouldn't make the arm jump
+AVERAGE_SAMPLES = 10
+# don't push the motors harder than this to make up for an empty battery
+MAX_COMPENSATION = 1.3
+
+logger = logging.getLogger(__name__)
+
+
+class PowerSampler(threading.Thread):
+    """ sample voltage and current of one or more PowerSupply instances in the background
+
+    Reading a remote PowerSupply is an RPyC round trip, so it is done here at low priority instead of in the
+    input or control threads. Samples are kept in a ring buffer per supply as (timestamp, volts, amps).
+    """
+
+    def __init__(self, supplies, interval=SAMPLE_INTERVAL, history=HISTORY, nominal_volts=None, on_sample=None):
+        threading.Thread.__init__(self, daemon=True)
+        self._supplies = supplies
+        self._interval = interval
+        self._nominal_volts = nominal_volts
+        self._on_sample = on_sample
+        self._stop_event = threading.Event()
+        self.history = dict((name, collections.deque(maxlen=history)) for name in supplies)
+        self.errors = 0
+
+    def _lower_priority(self):
+        # niceness is per thread on Linux, only available from python 3.8
+        if hasattr(threading, 'get_native_id') and hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+
+    def sample(self):
+        """ read all supplies once """
+        for name, supply in self._supplies.items():
+            try:
+                volts = supply.measured_volts
+                amps = supply.measured_amps
+            except Exception as ex:
+                # a remote brick going away shouldn't take the sampler down with it
+                self.errors += 1
+                logger.debug('Failed to read {} power supply: {}'.format(name, ex))
+                continue
+            self.history[name].append((time.time(), volts, amps))
+
+        if self._on_sample:
+            self._on_sample(self)
+
+    def run(self):
+        self._lower_priority()
+        while not self._stop_event.is_set():
+            self.sample()
+            self._stop_event.wait(self._interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def latest(self, name):
+        """ most recent (timestamp, volts, amps) for a supply, or None before the first sample """
+        history = self.history[name]
+        return history[-1] if history else None
+
+    def average_volts(self, name, samples=AVERAGE_SAMPLES):
+        history = list(self.history[name])[-samples:]
+        if not history:
+            return None
+        return sum(volts for _, volts, _ in history) / len(history)
+
+    def speed_factor(self):
+        """ factor to scale speeds with to make up for battery sag, based on the emptiest battery """
+        if not self._nominal_volts:
+            return 1.0
+
+        volts = [self.average_volts(name) for name in self._supplies]
+        volts = [value for value in volts if value]
+        if not volts:
+            return 1.0
+
+        factor = self._nominal_volts / min(volts)
+        return min(max(factor, 1.0), MAX_COMPENSATION)
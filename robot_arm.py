@@ -11,6 +11,7 @@
 #
 __author__ = 'Nino Guba'
 
+import asyncio
 import logging
 import os
 import sys
@@ -18,31 +19,88 @@ import threading
 import time
 
 import evdev
-import rpyc
-from signal import signal, SIGINT
-from ev3dev2 import DeviceNotFound
-from ev3dev2.led import Leds
-from ev3dev2.sensor import INPUT_1
-from ev3dev2.sensor.lego import ColorSensor
-from ev3dev2.motor import OUTPUT_A, OUTPUT_B, OUTPUT_C, OUTPUT_D, LargeMotor
-from ev3dev2.power import PowerSupply
+from signal import signal, SIGINT, SIGUSR1
 
 # from ev3dev2.sound import Sound
 from evdev import InputDevice
 
-from smart_motor import LimitedRangeMotor, LimitedRangeMotorSet, ColorSensorMotor, StaticRangeMotor
-from math_helper import scale_stick
+from arm_control import ACTION_DEBUG, ACTION_POWER_INFO, ACTION_QUIT, ControlState, Speeds, control_tick, handle_event
+from arm_daemon import ArmDaemon
+from async_runtime import AsyncBrickWorker, AsyncReplay, AsyncRuntime
+from brick_registry import BrickRegistry, load_topology
+from collision_map import CollisionGuard, load_or_build
+from emergency_stop import emergency_stop
+from grip import GripJoint, read_sample
+from input_replay import EventRecorder, read_events, replay
+from power_sampler import PowerSampler
+from shared_state import SharedControlState, start_input_process
+from stick_filter import DEFAULT_CHAIN, build_filter
+from trace_buffer import TraceBuffer, OP_INPUT
 
 
 # Config
 REMOTE_HOST = '10.42.0.3'
-
-# Define speeds
-FULL_SPEED = 100
-FAST_SPEED = 75
-NORMAL_SPEED = 50
-SLOW_SPEED = 25
-VERY_SLOW_SPEED = 10
+# JSON file assigning joints to bricks (see brick_registry.py), None for the master plus a slave at REMOTE_HOST
+TOPOLOGY_FILE = None
+# Drive the local large motors through sysfs directly instead of ev3dev2's attribute layer
+USE_SYSFS_MOTORS = False
+# Let slave_controller.py on the slave brick run the wrist and grabber joints, we only send it setpoints
+USE_SLAVE_CONTROLLER = False
+# Transport for slave controller setpoints, 'rpyc' or 'udp'
+SLAVE_TRANSPORT = 'rpyc'
+# Scale the speeds below up as the batteries drain, so joints keep moving at the same pace during long runs
+POWER_COMPENSATION = False
+# Battery voltage the speeds were tuned at
+NOMINAL_VOLTS = 8.0
+# Track joint positions by dead reckoning, only reading the encoders when the estimate needs correcting. Costs
+# encoder reads the plain control loop doesn't do, needed for SOFT_LIMITS and AVOID_COLLISIONS
+ESTIMATE_POSITIONS = False
+# Drive every joint with plain speed commands, slowing down and stopping ahead of its limits from the position
+# estimates (see soft_limits.py), instead of run-to-position commands. Needs ESTIMATE_POSITIONS
+SOFT_LIMITS = False
+# Stop pushing once the grabber closes on something and hold on with a reduced force instead (see grip.py).
+# Threads only, not with USE_ASYNCIO or USE_SLAVE_CONTROLLER. Samples go through the grabber brick's worker, one RPyC
+# round trip each on the slave brick, so contact is timed (grip.CONTACT_TIME), not counted
+GRIP_DETECTION = False
+GRIP_HOLD_DUTY = 30  # duty cycle percentage
+# Binary trace of input events, motor commands and encoder reads, dumped on SIGUSR1 and on shutdown.
+# Decode with `python3 trace_buffer.py robot_arm.trace`
+TRACE_CAPACITY = 65536  # records, 16 bytes each
+TRACE_FILE = 'robot_arm.trace'
+# Keep the arm off the floor and its base using a precomputed collision map (needs ESTIMATE_POSITIONS, and doesn't
+# work with USE_SLAVE_CONTROLLER). Measure GEOMETRY in collision_map.py before enabling this
+AVOID_COLLISIONS = False
+COLLISION_MAP_FILE = 'collision_map.bin'
+# Run input handling, the control loop, power sampling and the brick workers as tasks on one asyncio event loop
+# instead of threads (see async_runtime.py)
+USE_ASYNCIO = False
+# Handle gamepad input in a process of its own, so it doesn't compete with the motor thread for the GIL
+SEPARATE_INPUT_PROCESS = False
+# Filter chain for the proportional stick axes (see stick_filter.py), an empty list passes values unfiltered.
+# Smoothing filters only advance on input events, so they can lag behind a stick which is held still
+STICK_FILTERS = {
+    'shoulder': DEFAULT_CHAIN,
+    'elbow': DEFAULT_CHAIN,
+}
+# Record gamepad input to this file, for replaying with input_replay.py
+RECORD_INPUT = None
+# Drive the arm from a recorded session file instead of the gamepad (at the recorded pace)
+REPLAY_INPUT = None
+# Stay resident, keeping the bricks connected and the arm calibrated, and take input from front ends attaching to
+# a local socket instead of the gamepad (see arm_daemon.py)
+RUN_AS_DAEMON = False
+DAEMON_SOCKET = '/tmp/robot_arm.sock'
+
+# the daemon runs a control loop of its own, with brick worker threads
+if RUN_AS_DAEMON:
+    USE_ASYNCIO = SEPARATE_INPUT_PROCESS = False
+
+# Seconds between control loop passes. Commands only go out when they change and are sent by the brick workers, so
+# nothing else paces the loop
+TICK_INTERVAL = 0.01
+
+# Speeds used by the control loop, see arm_control.py for the defaults
+speeds = Speeds()
 
 # Setup logging
 os.system('setfont Lat7-Terminus12x6')
@@ -68,144 +126,202 @@ def motors_to_center():
     """ move all motors to their default position """
 
     shoulder_motors.on_to_position(
-        SLOW_SPEED, shoulder_motors.centerPos, True, True)
-    elbow_motor.on_to_position(SLOW_SPEED, elbow_motor.centerPos, True, True)
+        speeds.slow, shoulder_motors.centerPos, True, True)
+    elbow_motor.on_to_position(speeds.slow, elbow_motor.centerPos, True, True)
 
-    roll_motor.on_to_position(NORMAL_SPEED, roll_motor.centerPos, True, False)
-    pitch_motor.on_to_position(NORMAL_SPEED, 0, True, False)
-    spin_motor.on_to_position(NORMAL_SPEED, spin_motor.centerPos, True, False)
+    roll_motor.on_to_position(speeds.normal, roll_motor.centerPos, True, False)
+    pitch_motor.on_to_position(speeds.normal, 0, True, False)
+    spin_motor.on_to_position(speeds.normal, spin_motor.centerPos, True, False)
 
     if grabber_motor:
         grabber_motor.on_to_position(
-            NORMAL_SPEED, grabber_motor.centerPos, True, True)
+            speeds.normal, grabber_motor.centerPos, True, True)
 
-    waist_motor.on_to_position(FAST_SPEED, waist_motor.centerPos, True, True)
+    waist_motor.on_to_position(speeds.fast, waist_motor.centerPos, True, True)
 
 
 # Initial setup
 
-# RPyC
-# Setup on slave EV3: https://ev3dev-lang.readthedocs.io/projects/python-ev3dev/en/stable/rpyc.html
-# Create a RPyC connection to the remote ev3dev device.
-# Use the hostname or IP address of the ev3dev device.
-# If this fails, verify your IP connectivty via ``ping X.X.X.X``
-logger.info("Connecting RPyC to {}...".format(REMOTE_HOST))
-# change this IP address for your slave EV3 brick
-conn = rpyc.classic.connect(REMOTE_HOST)
-# remote_ev3 = conn.modules['ev3dev.ev3']
-remote_power_mod = conn.modules['ev3dev2.power']
-remote_motor = conn.modules['ev3dev2.motor']
-remote_led = conn.modules['ev3dev2.led']
-logger.info("RPyC started succesfully")
-
 # Gamepad
-# If bluetooth is not available, check https://github.com/ev3dev/ev3dev/issues/1314
-logger.info("Connecting wireless controller...")
-gamepad = InputDevice(evdev.list_devices()[0])
-if gamepad.name != 'Wireless Controller':
-    logger.error('Failed to connect to wireless controller')
-    sys.exit(1)
+gamepad = None
+if REPLAY_INPUT is None and not RUN_AS_DAEMON:
+    # If bluetooth is not available, check https://github.com/ev3dev/ev3dev/issues/1314
+    logger.info("Connecting wireless controller...")
+    gamepad = InputDevice(evdev.list_devices()[0])
+    if gamepad.name != 'Wireless Controller':
+        logger.error('Failed to connect to wireless controller')
+        sys.exit(1)
+recorder = EventRecorder(RECORD_INPUT) if RECORD_INPUT else None
+
+# What the gamepad asks for, shared between the input loop and the motor thread
+stick_filters = dict((axis, build_filter(chain)) for axis, chain in STICK_FILTERS.items() if chain)
+state = ControlState(stick_filters)
+
+if RUN_AS_DAEMON:
+    # front ends bring their own input
+    events = None
+elif REPLAY_INPUT is not None:
+    logger.info('Replaying {}...'.format(REPLAY_INPUT))
+    events = AsyncReplay(read_events(REPLAY_INPUT)) if USE_ASYNCIO else replay(read_events(REPLAY_INPUT))
+else:
+    events = gamepad.async_read_loop() if USE_ASYNCIO else gamepad.read_loop()
+if recorder and events is not None and not USE_ASYNCIO:
+    events = recorder.wrap(events)
+
+# Fork the input process before connecting the bricks starts any threads (brick workers, slave controller
+# heartbeats), it only gets the events and the shared state block
+shared_state = None
+input_process = None
+if SEPARATE_INPUT_PROCESS and not USE_ASYNCIO:
+    shared_state = SharedControlState()
+    input_process = start_input_process(events, shared_state, recorder, stick_filters)
+    logger.info("Handling input in process {}".format(input_process.pid))
+
+# Bricks
+# Every brick gets a worker thread sending the commands for its joints, so bricks are driven in parallel
+topology = load_topology(TOPOLOGY_FILE)
+if TOPOLOGY_FILE is None:
+    topology['bricks']['slave']['host'] = REMOTE_HOST
+    if USE_SLAVE_CONTROLLER:
+        topology['bricks']['slave']['controller'] = SLAVE_TRANSPORT
+trace = TraceBuffer(TRACE_CAPACITY)
+registry = BrickRegistry(topology, use_sysfs=USE_SYSFS_MOTORS, trace=trace,
+                         worker_factory=AsyncBrickWorker if USE_ASYNCIO else None)
+registry.connect()
 
 # LEDs
-leds = Leds()
-remote_leds = remote_led.Leds()
+leds = [brick.leds() for brick in registry.bricks.values()]
 
 # Power
-power = PowerSupply(name_pattern='*ev3*')
-remote_power = remote_power_mod.PowerSupply(name_pattern='*ev3*')
+power_supplies = dict((name, brick.power()) for name, brick in registry.bricks.items())
 
 # Sound
 # sound = Sound()
 
-# Primary EV3
-# Sensors
-color_sensor = ColorSensor(INPUT_1)
-color_sensor.mode = ColorSensor.MODE_COL_COLOR
-
-# Motors
-waist_motor = ColorSensorMotor(LargeMotor(
-    OUTPUT_A), speed=40, name='waist', sensor=color_sensor, color=5)  # 5 = red
-shoulder_motors = LimitedRangeMotorSet(
-    [LargeMotor(OUTPUT_B), LargeMotor(OUTPUT_C)], speed=30, name='shoulder')
-elbow_motor = LimitedRangeMotor(LargeMotor(OUTPUT_D), speed=30, name='elbow')
-
-# Secondary EV3
 # Motors
-roll_motor = LimitedRangeMotor(remote_motor.MediumMotor(
-    remote_motor.OUTPUT_A), speed=30, name='roll')
-pitch_motor = LimitedRangeMotor(remote_motor.MediumMotor(
-    remote_motor.OUTPUT_B), speed=10, name='pitch')
-pitch_motor.stop_action = remote_motor.MediumMotor.STOP_ACTION_COAST
-spin_motor = StaticRangeMotor(remote_motor.MediumMotor(
-    remote_motor.OUTPUT_C), maxPos=14 * 360, speed=20, name='spin')
-
-try:
-    grabber_motor = LimitedRangeMotor(
-        remote_motor.MediumMotor(remote_motor.OUTPUT_D), speed=20, name='grabber')
-    grabber_motor.stop_action = remote_motor.MediumMotor.STOP_ACTION_COAST
+joints = registry.create_joints()
+waist_motor = joints['waist']
+shoulder_motors = joints['shoulder']
+elbow_motor = joints['elbow']
+roll_motor = joints['roll']
+pitch_motor = joints['pitch']
+spin_motor = joints['spin']
+grabber_motor = joints.get('grabber', False)
+if grabber_motor:
     logger.info("Grabber motor detected!")
-except DeviceNotFound:
-    logger.info("Grabber motor not detected - running without it...")
-    grabber_motor = False
-
 
 # Not sure why but resetting all motors before doing anything else seems to improve reliability
 reset_motors()
 
+# Joints with a position estimator, the slave controller tracks its own joints
+estimated_joints = []
+if ESTIMATE_POSITIONS:
+    for joint in joints.values():
+        if hasattr(joint.joint, 'enable_estimator'):
+            joint.enable_estimator()
+            if SOFT_LIMITS:
+                joint.enable_soft_limits()
+            estimated_joints.append(joint)
+
+# Watches the grabber's duty cycle and speed while it's closing, the sampler thread is started below
+grip = None
+if GRIP_DETECTION and not USE_ASYNCIO and grabber_motor and hasattr(grabber_motor.joint, 'hold'):
+    grabber_brick = registry.bricks[topology['joints']['grabber']['brick']]
+    grip = grabber_motor = joints['grabber'] = GripJoint(grabber_motor, hold_duty=GRIP_HOLD_DUTY,
+                                                         read=grabber_brick.teleport(read_sample))
+
+# Slows down or blocks moves towards the floor or base, from the position estimates
+guard = None
+if AVOID_COLLISIONS and ESTIMATE_POSITIONS:
+    logger.info("Loading collision map...")
+    try:
+        guard = CollisionGuard(load_or_build(COLLISION_MAP_FILE), joints)
+    except ValueError as ex:
+        logger.error('Cannot avoid collisions: {} (AVOID_COLLISIONS doesn\'t work with USE_SLAVE_CONTROLLER)'.format(
+            ex))
+        sys.exit(1)
+
+
+def compensate_speeds(sampler):
+    """ scale the speed constants to make up for battery sag """
+    speeds.scale(sampler.speed_factor())
+
+
+def set_leds(color):
+    for brick_leds in leds:
+        brick_leds.set_color("LEFT", color)
+        brick_leds.set_color("RIGHT", color)
+
+
+def daemon_status():
+    """ the latest battery readings and the grip state, for the daemon's status requests """
+    status = {}
+    for name in power_supplies:
+        sample = power_sampler.latest(name)
+        if sample is not None:
+            status[name] = {'volts': round(sample[1], 2), 'amps': round(sample[2], 2)}
+    if grip is None:
+        return {'power': status}
+    return {'power': status, 'grip': {'state': grip.state, 'holds': grip.holds, 'empty': grip.empty}}
 
-# Variables for stick input
-shoulder_speed = 0
-elbow_speed = 0
 
-# Variables for button input
-waist_left = False
-waist_right = False
-roll_left = False
-roll_right = False
-pitch_up = False
-pitch_down = False
-spin_left = False
-spin_right = False
-grabber_open = False
-grabber_close = False
+def log_power_info():
+    """ log the latest battery readings, without blocking on remote bricks """
+    for name in power_supplies:
+        sample = power_sampler.latest(name)
+        if sample is None:
+            logger.info('{} battery power: no reading yet'.format(name.capitalize()))
+        else:
+            logger.info('{} battery power: {}V / {}A'.format(
+                name.capitalize(), round(sample[1], 2), round(sample[2], 2)))
+    if POWER_COMPENSATION:
+        logger.info('Speed compensation: x{}'.format(round(power_sampler.speed_factor(), 2)))
 
-# We are running!
-running = True
 
-def log_power_info():
-    logger.info('Local battery power: {}V / {}A'.format(round(power.measured_volts,2 ), round(power.measured_amps, 2)))
-    logger.info('Remote battery power: {}V / {}A'.format(round(remote_power.measured_volts, 2), round(remote_power.measured_amps, 2)))
+def dump_trace(signal_received=None, frame=None):
+    count = trace.dump(TRACE_FILE)
+    logger.info('Dumped {} trace records to {}'.format(count, TRACE_FILE))
 
 
 def clean_shutdown(signal_received=None, frame=None):
     """ make sure all motors are stopped when stopping this script """
     logger.info('Shutting down...')
 
-    global running
-    running = False
-    
-    logger.info('waist..')
-    waist_motor.stop()
-    logger.info('shoulder..')
-    shoulder_motors.stop()
-    logger.info('elbow..')
-    elbow_motor.stop()
-    logger.info('pitch..')
-    # For some reason the pitch motor sometimes gets stuck here, and a reset helps?
-    # pitch_motor.reset()
-    pitch_motor.stop()
-    logger.info('roll..')
-    roll_motor.stop()
-    logger.info('spin..')
-    spin_motor.stop()
-
-    if grabber_motor:
-        logger.info('grabber..')
-        grabber_motor.stop()
+    state.running = False
+    if daemon is not None:
+        # no more clients, and no more control loop passes
+        daemon.stop()
+    power_sampler.stop()
+    if grip is not None:
+        grip.stop_sampling()
+
+    # all joints on all bricks at once, escalating to a reset for any that don't confirm in time
+    # (the pitch motor sometimes gets stuck here, and a reset helps)
+    report = emergency_stop(joints, trace=trace)
+    if report.all_stopped:
+        logger.info(report.summary())
+    else:
+        logger.error(report.summary())
+
+    # let whatever the bricks were still sending finish before closing the connections
+    if not registry.flush(timeout=1):
+        logger.error('Not all bricks finished sending!')
+    registry.close(timeout=1)
+    dump_trace()
+
+    if input_process is not None:
+        # the input process closes the recorder itself
+        input_process.terminate()
+        input_process.join(1)
+        shared_state.close()
+    elif recorder:
+        recorder.close()
+        logger.info('Recorded {} input events to {}'.format(recorder.count, recorder.path))
 
     # See https://github.com/gvalkov/python-evdev/issues/19 if this raises exceptions, but it seems 
     # stable now.
-    gamepad.close()
+    if gamepad:
+        gamepad.close()
 
     logger.info('Shutdown completed.')
     sys.exit(0)
@@ -228,6 +344,47 @@ def calibrate_motors():
     if grabber_motor:
         grabber_motor.calibrate(to_center=False)
 
+    # calibration moves the motors behind the estimators' backs
+    for joint in estimated_joints:
+        joint.refresh_estimate(force=True)
+
+
+def log_joint_positions():
+    """ log estimated joint positions, without waiting for encoder reads """
+    for joint in estimated_joints:
+        low, high = joint.estimated_range()
+        logger.info('{}: {} ({}..{}), {} reads'.format(
+            joint.name, round(joint.estimated_position), round(low), round(high), joint.estimator.reads))
+        if joint.soft_limits:
+            logger.info('{} soft limits: {} stops, {} slowdowns'.format(
+                joint.name, joint.soft_limits.stops, joint.soft_limits.slowdowns))
+    if grip is not None:
+        logger.info('Grip: {}, held on {} times, closed empty {} times, {} samples ({} ms each)'.format(
+            grip.state, grip.holds, grip.empty, grip.samples,
+            '-' if grip.sample_time is None else round(grip.sample_time * 1000, 1)))
+    if guard:
+        logger.info('Collision guard: {} moves blocked, {} slowed'.format(guard.blocked, guard.slowed))
+    if shared_state is not None and stick_filters:
+        logger.info('Stick filters run in the input process, which logs their counters when it ends')
+        return
+    for axis, stick_filter in stick_filters.items():
+        logger.info('{} stick: {} of {} updates suppressed'.format(
+            axis.capitalize(), stick_filter.suppressed, stick_filter.updates))
+
+
+def handle_action(action):
+    """ do what a gamepad button asked for, besides moving the arm """
+    if action == ACTION_POWER_INFO:  # Share
+        # reset_motors()
+        log_power_info()
+
+    elif action == ACTION_DEBUG:  # Options
+        # debug info
+        log_joint_positions()
+        # Waist motor to starting point
+        # waist_motor.calibrate()
+        # @TODO cant run calibrate while running. But setting running to False terminates the program :/
+
 
 class MotorThread(threading.Thread):
     def __init__(self):
@@ -236,213 +393,99 @@ class MotorThread(threading.Thread):
     def run(self):
         logger.info("Engine running!")
         # os.system('setfont Lat7-Terminus12x6')
-        leds.set_color("LEFT", "BLACK")
-        leds.set_color("RIGHT", "BLACK")
-        remote_leds.set_color("LEFT", "BLACK")
-        remote_leds.set_color("RIGHT", "BLACK")
+        set_leds("BLACK")
         # sound.play_song((('C4', 'e'), ('D4', 'e'), ('E5', 'q')))
-        leds.set_color("LEFT", "GREEN")
-        leds.set_color("RIGHT", "GREEN")
-        remote_leds.set_color("LEFT", "GREEN")
-        remote_leds.set_color("RIGHT", "GREEN")
+        set_leds("GREEN")
 
         logger.info("Starting main loop...")
-        while running:
-            # Proportional control
-            if shoulder_speed != 0:
-                if shoulder_speed > 0:
-                    shoulder_motors.on_to_position(
-                        shoulder_speed, shoulder_motors.minPos, True, False)
-                else:
-                    shoulder_motors.on_to_position(
-                        shoulder_speed, shoulder_motors.maxPos, True, False)
-            elif shoulder_motors.is_running:
-                shoulder_motors.stop()
-
-            # Proportional control
-            if elbow_speed != 0:
-                if elbow_speed > 0:
-                    elbow_motor.on_to_position(
-                        elbow_speed, elbow_motor.minPos, True, False)
-                else:
-                    elbow_motor.on_to_position(
-                        elbow_speed, elbow_motor.maxPos, True, False)
-            elif elbow_motor.is_running:
-                elbow_motor.stop()
-
-            # on/off control
-            if waist_left:
-                # logger.info('moving left...')
-                waist_motor.on(-SLOW_SPEED, False)  # Left
-            elif waist_right:
-                # logger.info('moving right...')
-                waist_motor.on(SLOW_SPEED, False)  # Right
-            elif waist_motor.is_running:
-                # logger.info('stopped moving left/right')
-                waist_motor.stop()
-
-            # on/off control
-            if roll_left:
-                roll_motor.on_to_position(
-                    SLOW_SPEED, roll_motor.minPos, True, False)  # Left
-            elif roll_right:
-                roll_motor.on_to_position(
-                    SLOW_SPEED, roll_motor.maxPos, True, False)  # Right
-            elif roll_motor.is_running:
-                roll_motor.stop()
-
-            # on/off control
-            if pitch_up:
-                # pitch_motor.on_to_position(
-                #     SLOW_SPEED, pitch_motor.maxPos, True, False)  # Up
-                pitch_motor.on(VERY_SLOW_SPEED, False)
-            elif pitch_down:
-                pitch_motor.on(-VERY_SLOW_SPEED, False)
-                # pitch_motor.on_to_position(
-                #     SLOW_SPEED, pitch_motor.minPos, True, False)  # Down
-            elif pitch_motor.is_running:
-                pitch_motor.stop()
-
-            # on/off control
-            if spin_left:
-                spin_motor.on_to_position(
-                    SLOW_SPEED, spin_motor.minPos, True, False)  # Left
-            elif spin_right:
-                spin_motor.on_to_position(
-                    SLOW_SPEED, spin_motor.maxPos, True, False)  # Right
-            elif spin_motor.is_running:
-                spin_motor.stop()
-
-            # on/off control
-            if grabber_motor:
-                if grabber_open:
-                    # grabber_motor.on_to_position(
-                    #     NORMAL_SPEED, grabber_motor.maxPos, True, True)  # Close
-                    # grabber_motor.stop()
-                    grabber_motor.on(NORMAL_SPEED, False)
-                elif grabber_close:
-                    # grabber_motor.on_to_position(
-                    #     NORMAL_SPEED, grabber_motor.minPos, True, True)  # Open
-                    # grabber_motor.stop()
-                    grabber_motor.on(-NORMAL_SPEED, False)
-                elif grabber_motor.is_running:
-                    grabber_motor.stop()
-        
+        next_tick = time.monotonic()
+        while state.running:
+            if shared_state is not None:
+                # input is handled in another process, pick up what it published
+                handle_action(shared_state.read(state))
+
+            # Correct position estimates where needed, this is where encoders get read
+            for joint in estimated_joints:
+                joint.refresh_estimate()
+
+            control_tick(state, joints, speeds, guard)
+
+            now = time.monotonic()
+            next_tick = max(next_tick + TICK_INTERVAL, now)
+            time.sleep(next_tick - now)
+
         logger.info("Engine stopping!")
 
 
+daemon = None
+if RUN_AS_DAEMON:
+    daemon = ArmDaemon(joints, speeds, state=state, guard=guard, estimated_joints=estimated_joints,
+                       on_action=handle_action, calibrate=calibrate_motors, info=daemon_status, trace=trace,
+                       recorder=recorder, path=DAEMON_SOCKET, tick_interval=TICK_INTERVAL)
+
+# Battery monitoring in the background, reading the remote brick shouldn't stall input handling
+power_sampler = PowerSampler(power_supplies,
+                             nominal_volts=NOMINAL_VOLTS if POWER_COMPENSATION else None,
+                             on_sample=compensate_speeds if POWER_COMPENSATION else None)
+power_sampler.sample()
+if not USE_ASYNCIO:
+    power_sampler.start()
+if grip is not None:
+    grip.start_sampling()
+
 # Ensure clean shutdown on CTRL+C
 signal(SIGINT, clean_shutdown)
+# Dump the trace buffer with `kill -USR1 <pid>`
+signal(SIGUSR1, dump_trace)
 
 log_power_info()
 # calibrate_motors()
-motor_thread = MotorThread()
-motor_thread.setDaemon(True)
-motor_thread.start()
-
-for event in gamepad.read_loop():  # this loops infinitely
-    if event.type == 3:  # stick input
-        if event.code == 0:  # Left stick X-axis
-            shoulder_speed = scale_stick(event.value, invert=True)
-        elif event.code == 3:  # Right stick X-axis
-            elbow_speed = scale_stick(event.value)
-
-    elif event.type == 1:  # button input
-
-        if event.code == 310:  # L1
-            if event.value == 1:
-                waist_right = False
-                waist_left = True
-            elif event.value == 0:
-                waist_left = False
-
-        elif event.code == 311:  # R1
-            if event.value == 1:
-                waist_left = False
-                waist_right = True
-            elif event.value == 0:
-                waist_right = False
-
-        elif event.code == 308:  # Square
-            if event.value == 1:
-                roll_right = False
-                roll_left = True
-            elif event.value == 0:
-                roll_left = False
-
-        elif event.code == 305:  # Circle
-            if event.value == 1:
-                roll_left = False
-                roll_right = True
-            elif event.value == 0:
-                roll_right = False
-
-        elif event.code == 307:  # Triangle
-            if event.value == 1:
-                pitch_down = False
-                pitch_up = True
-            elif event.value == 0:
-                pitch_up = False
-
-        elif event.code == 304:  # X
-            if event.value == 1:
-                pitch_up = False
-                pitch_down = True
-            elif event.value == 0:
-                pitch_down = False
-
-        elif event.code == 312:  # L2
-            # print(event)
-            if event.value == 1:
-                spin_right = False
-                spin_left = True
-            elif event.value == 0:
-                spin_left = False
-
-        elif event.code == 313:  # R2
-            if event.value == 1:
-                spin_left = False
-                spin_right = True
-            elif event.value == 0:
-                spin_right = False
-
-        elif event.code == 317:  # L3
-            if event.value == 1:
-                grabber_close = False
-                grabber_open = True
-            elif event.value == 0:
-                grabber_open = False
-
-        elif event.code == 318:  # R3
-            if event.value == 1:
-                grabber_open = False
-                grabber_close = True
-            elif event.value == 0:
-                grabber_close = False
-
-        elif event.code == 314 and event.value == 1:  # Share
-            # reset_motors()
-            log_power_info()
-         
-        # elif event.code == 315 and event.value == 1:  # Options
-        #     # Waist motor to starting point
-        #     # waist_motor.calibrate()
-        #     # @TODO cant run calibrate while running. But setting running to False terminates the program :/
-
-        elif event.code == 316 and event.value == 1:  # PS
-            # stop control loop
-            running = False
-
+if not USE_ASYNCIO and not RUN_AS_DAEMON:
+    motor_thread = MotorThread()
+    motor_thread.setDaemon(True)
+    motor_thread.start()
+
+if RUN_AS_DAEMON:
+    daemon.start()
+    logger.info("Daemon listening on {}".format(DAEMON_SOCKET))
+    set_leds("GREEN")
+    # until a shutdown request or CTRL+C
+    daemon.serve_forever()
+    set_leds("BLACK")
+elif USE_ASYNCIO:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runtime = AsyncRuntime(loop, events, joints, speeds, state=state, guard=guard, estimated_joints=estimated_joints,
+                           workers=[brick.worker for brick in registry.bricks.values()],
+                           power_sampler=power_sampler, on_action=handle_action, trace=trace, recorder=recorder,
+                           tick_interval=TICK_INTERVAL)
+    logger.info("Engine running!")
+    set_leds("GREEN")
+    # until the PS button or CTRL+C
+    runtime.run()
+    logger.info("Engine stopping!")
+    runtime.log_stats()
+    set_leds("BLACK")
+elif input_process is not None:
+    # the motor thread follows the input process until the PS button stops both
+    input_process.join()
+    set_leds("BLACK")
+    time.sleep(1)  # Wait for the motor thread to finish
+else:
+    for event in events:  # this loops infinitely
+        trace.record(OP_INPUT, event.type, event.code, event.value)
+        action = handle_event(state, event)
+
+        if action == ACTION_QUIT:  # PS
             # Move motors to default position
             # motors_to_center()
 
             # sound.play_song((('E5', 'e'), ('C4', 'e')))
-            leds.set_color("LEFT", "BLACK")
-            leds.set_color("RIGHT", "BLACK")
-            remote_leds.set_color("LEFT", "BLACK")
-            remote_leds.set_color("RIGHT", "BLACK")
+            set_leds("BLACK")
 
             time.sleep(1)  # Wait for the motor thread to finish
             break
 
+        handle_action(action)
+
 clean_shutdown()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Control state in shared memory, for running input handling in a process of its own.
+#
+# The input process is the only writer. Readers use a seqlock: the writer makes the sequence number odd while it
+# updates the block and even again when done, and a reader retries when the sequence number was odd or changed
+# while it was reading. Neither side ever waits for the other, so a motor command stuck on a slow RPyC call can't
+# hold up input handling, and vice versa.
+#
+# The EV3 is single core, so stores are seen in program order. On multi core ARM boards the seqlock would need
+# memory barriers Python doesn't offer.
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from signal import signal, SIGINT, SIG_IGN
+
+from arm_control import ACTION_DEBUG, ACTION_POWER_INFO, ACTION_QUIT, ControlState, handle_event
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python < 3.8, as on ev3dev stretch
+    shared_memory = None
+
+
+SEQUENCE = struct.Struct('<I')
+# updates, input timestamp, shoulder speed, elbow speed, button flags, actions, last action
+PAYLOAD = struct.Struct('<IdffHIB')
+SIZE = SEQUENCE.size + PAYLOAD.size
+
+# ControlState flags, in bit order
+FLAGS = ('waist_left', 'waist_right', 'roll_left', 'roll_right', 'pitch_up', 'pitch_down', 'spin_left', 'spin_right',
+         'grabber_open', 'grabber_close', 'running')
+
+ACTION_CODES = {None: 0, ACTION_POWER_INFO: 1, ACTION_DEBUG: 2, ACTION_QUIT: 3}
+ACTIONS = dict((code, action) for action, code in ACTION_CODES.items())
+
+# reads retried this often in a row give up the time slice, the writer was interrupted halfway
+SPIN_RETRIES = 10
+
+logger = logging.getLogger(__name__)
+
+
+class SharedControlState:
+    """ a ControlState in a fixed layout shared memory block, one process writes and others read
+
+    Uses multiprocessing.shared_memory when available, an anonymous shared mmap otherwise. Both are inherited by
+    processes forked after creating it.
+    """
+
+    def __init__(self):
+        self._owner = os.getpid()
+        if shared_memory is not None:
+            self._shm = shared_memory.SharedMemory(create=True, size=SIZE)
+            self._buffer = self._shm.buf
+        else:
+            self._shm = None
+            self._buffer = mmap.mmap(-1, SIZE)
+        # writer side
+        self._sequence = 0
+        self._updates = 0
+        self._actions = 0
+        # reader side
+        self._seen_actions = 0
+        self.updates = 0
+        self.stamp = 0.0
+        self.retries = 0
+
+    def publish(self, state, stamp=None, action=None):
+        """ write a ControlState, with the time of the input event it came from and the action it asked for """
+        flags = 0
+        for bit, name in enumerate(FLAGS):
+            if getattr(state, name):
+                flags |= 1 << bit
+        self._updates += 1
+        if action is not None:
+            self._actions += 1
+
+        self._sequence += 1
+        SEQUENCE.pack_into(self._buffer, 0, self._sequence)
+        PAYLOAD.pack_into(self._buffer, SEQUENCE.size, self._updates, time.monotonic() if stamp is None else stamp,
+                          state.shoulder_speed, state.elbow_speed, flags, self._actions, ACTION_CODES[action])
+        self._sequence += 1
+        SEQUENCE.pack_into(self._buffer, 0, self._sequence)
+
+    def _read_consistent(self):
+        attempts = 0
+        while True:
+            before = SEQUENCE.unpack_from(self._buffer, 0)[0]
+            if not before & 1:
+                values = PAYLOAD.unpack_from(self._buffer, SEQUENCE.size)
+                if SEQUENCE.unpack_from(self._buffer, 0)[0] == before:
+                    return values
+            attempts += 1
+            self.retries += 1
+            if attempts % SPIN_RETRIES == 0:
+                time.sleep(0)
+
+    def read(self, state):
+        """ copy the shared state into a ControlState, returns an action published since the last read or None
+
+        Only the latest action is kept, an older one which wasn't read in time is lost.
+        """
+        updates, stamp, shoulder_speed, elbow_speed, flags, actions, action = self._read_consistent()
+        if updates == 0:
+            # nothing published yet
+            return None
+        self.updates = updates
+        self.stamp = stamp
+        state.shoulder_speed = shoulder_speed
+        state.elbow_speed = elbow_speed
+        for bit, name in enumerate(FLAGS):
+            setattr(state, name, bool(flags & (1 << bit)))
+        if actions != self._seen_actions:
+            self._seen_actions = actions
+            return ACTIONS[action]
+        return None
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            if os.getpid() == self._owner:
+                self._shm.unlink()
+        else:
+            self._buffer.close()
+
+
+def input_loop(events, shared, recorder=None, filters=None):
+    """ handle input events and publish the resulting state, until the PS button """
+    # CTRL+C goes to the whole process group, the control process shuts us down
+    signal(SIGINT, SIG_IGN)
+    state = ControlState(filters)
+    try:
+        for event in events:
+            action = handle_event(state, event)
+            shared.publish(state, action=action)
+            if action == ACTION_QUIT:
+                break
+    finally:
+        if recorder:
+            recorder.close()
+            logger.info('Recorded {} input events to {}'.format(recorder.count, recorder.path))
+        # the control process only has unused copies of the filters
+        for axis, stick_filter in (filters or {}).items():
+            logger.info('{} stick: {} of {} updates suppressed'.format(
+                axis.capitalize(), stick_filter.suppressed, stick_filter.updates))
+
+
+def start_input_process(events, shared, recorder=None, filters=None):
+    """ fork a process running input_loop, the events iterator is only ever used in there """
+    context = multiprocessing.get_context('fork')
+    process = context.Process(target=input_loop, args=(events, shared, recorder, filters), name='input', daemon=True)
+    process.start()
+    return process
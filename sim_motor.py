@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+import math
+import time
+
+
+class SimulatedMotor:
+    """ stand-in for an ev3dev2 tacho motor, so controllers can run on a single Linux machine
+
+    The position is integrated from the speed setpoint whenever the motor is inspected. Optional hard stops
+    make the motor stall at the ends of its travel like a real joint does, and an obstacle (see place_obstacle())
+    loads it like something between the grabber's jaws.
+    """
+    COMMAND_RUN_FOREVER = 'run-forever'
+    COMMAND_RUN_TO_ABS_POS = 'run-to-abs-pos'
+    COMMAND_RUN_DIRECT = 'run-direct'
+    COMMAND_STOP = 'stop'
+    COMMAND_RESET = 'reset'
+
+    STOP_ACTION_COAST = 'coast'
+    STOP_ACTION_BRAKE = 'brake'
+    STOP_ACTION_HOLD = 'hold'
+
+    STATE_RUNNING = 'running'
+    STATE_STALLED = 'stalled'
+    STATE_HOLDING = 'holding'
+
+    def __init__(self, address=None, max_speed=1560, count_per_rot=360, min_stop=None, max_stop=None,
+                 clock=time.monotonic):
+        self.address = address
+        self.max_speed = max_speed
+        self.count_per_rot = count_per_rot
+        self.speed_sp = 0
+        self.position_sp = 0
+        self.duty_cycle_sp = 0
+        self.stop_action = self.STOP_ACTION_COAST
+        self._min_stop = min_stop
+        self._max_stop = max_stop
+        self._clock = clock
+        self._position = 0.0
+        self._speed = 0
+        self._command = self.COMMAND_STOP
+        self._stalled = False
+        self._obstacle = None
+        self._obstacle_side = 0
+        self._compliance = 0
+        # how far the obstacle is squeezed, as a fraction of how far the motor can squeeze it
+        self._squeeze = 0.0
+        self._updated = clock()
+        # every command written, for tests
+        self.commands = []
+
+    def __str__(self):
+        return '{}({})'.format(self.__class__.__name__, self.address)
+
+    def _update(self):
+        now = self._clock()
+        dt = now - self._updated
+        self._updated = now
+        if not self._speed or dt <= 0:
+            return
+
+        position = self._position + self._speed * dt
+        if self._command == self.COMMAND_RUN_TO_ABS_POS:
+            if (self._speed > 0 and position >= self.position_sp) or (self._speed < 0 and position <= self.position_sp):
+                position = self.position_sp
+                self._speed = 0
+        if self._obstacle is not None:
+            position = self._squeeze_obstacle(position, dt)
+
+        if self._max_stop is not None and position >= self._max_stop:
+            position = self._max_stop
+            self._stalled = True
+        elif self._min_stop is not None and position <= self._min_stop:
+            position = self._min_stop
+            self._stalled = True
+        else:
+            self._stalled = False
+
+        self._position = position
+
+    def _squeeze_obstacle(self, position, dt):
+        if (self._obstacle - position) * self._obstacle_side <= 0 or self._speed * self._obstacle_side > 0:
+            # not there yet, or backing off
+            self._squeeze = 0.0
+            return position
+
+        # the obstacle gives way less the further it's squeezed, up to a depth depending on how hard it's pushed
+        force = abs(self.duty_cycle_sp) / 100.0 if self._command == self.COMMAND_RUN_DIRECT else 1.0
+        depth = self._compliance * force
+        if depth <= 0:
+            self._squeeze = 1.0
+            return self._obstacle
+        squeezed = max(0.0, (self._obstacle - self._position) * self._obstacle_side)
+        if squeezed < depth:
+            squeezed = depth - (depth - squeezed) * math.exp(-abs(self._speed) * dt / depth)
+        else:
+            # pushing less hard than before, it springs back
+            squeezed = depth
+        self._squeeze = squeezed / depth
+        return self._obstacle - self._obstacle_side * squeezed
+
+    def place_obstacle(self, position, compliance=20):
+        """ put something in the way at position, which the motor runs into from the side it's on now
+
+        The obstacle gives way by up to compliance tacho counts. Squeezing it, a speed regulated motor slows down
+        and raises its duty cycle until it comes to rest at full duty cycle, a run-direct motor pushes with its
+        duty_cycle_sp and squeezes it less.
+        """
+        self._update()
+        self._obstacle = position
+        self._obstacle_side = 1 if self._position >= position else -1
+        self._compliance = compliance
+        self._squeeze = 0.0
+
+    def remove_obstacle(self):
+        self._update()
+        self._obstacle = None
+        self._squeeze = 0.0
+
+    def _speed_native_units(self, speed):
+        if not -100 <= speed <= 100:
+            raise ValueError('{} is an invalid speed percentage, must be between -100 and 100 (inclusive)'.format(
+                speed))
+        return int(round(speed * self.max_speed / 100))
+
+    def _set_brake(self, brake):
+        self.stop_action = self.STOP_ACTION_HOLD if brake else self.STOP_ACTION_COAST
+
+    @property
+    def command(self):
+        raise AttributeError('command is a write-only attribute')
+
+    @command.setter
+    def command(self, value):
+        self._update()
+        self.commands.append(value)
+        self._command = value
+        if value == self.COMMAND_RUN_FOREVER:
+            self._speed = self.speed_sp
+        elif value == self.COMMAND_RUN_TO_ABS_POS:
+            self._speed = abs(self.speed_sp) if self.position_sp >= self._position else -abs(self.speed_sp)
+        elif value == self.COMMAND_RUN_DIRECT:
+            # unloaded, the speed follows the duty cycle
+            self._speed = int(round(self.duty_cycle_sp * self.max_speed / 100))
+        elif value == self.COMMAND_STOP:
+            self._speed = 0
+            self._squeeze = 0.0
+        elif value == self.COMMAND_RESET:
+            self._speed = 0
+            self._squeeze = 0.0
+            self._position = 0.0
+            self.speed_sp = 0
+            self.position_sp = 0
+            self.duty_cycle_sp = 0
+            self.stop_action = self.STOP_ACTION_COAST
+        self._stalled = False
+
+    @property
+    def position(self):
+        self._update()
+        return int(round(self._position))
+
+    @position.setter
+    def position(self, value):
+        self._update()
+        self._position = float(value)
+
+    @property
+    def speed(self):
+        self._update()
+        if self._stalled:
+            return 0
+        if self._squeeze:
+            return int(round(self._speed * (1 - self._squeeze)))
+        return self._speed
+
+    @property
+    def duty_cycle(self):
+        self._update()
+        if self._command == self.COMMAND_RUN_DIRECT:
+            return self.duty_cycle_sp
+        if self._stalled:
+            return 100 if self._speed > 0 else -100
+        duty_cycle = self._speed * 100 / self.max_speed
+        # the speed regulation pushes harder the more it's held back
+        duty_cycle += (math.copysign(100, self._speed) - duty_cycle) * self._squeeze
+        return int(round(duty_cycle))
+
+    @property
+    def state(self):
+        self._update()
+        if self._stalled:
+            return [self.STATE_RUNNING, self.STATE_STALLED]
+        if self._speed:
+            return [self.STATE_RUNNING]
+        if self.stop_action == self.STOP_ACTION_HOLD:
+            return [self.STATE_HOLDING]
+        return []
+
+    @property
+    def is_running(self):
+        return self.STATE_RUNNING in self.state
+
+    def on(self, speed, brake=True, block=False):
+        self.speed_sp = self._speed_native_units(speed)
+        self._set_brake(brake)
+        self.command = self.COMMAND_RUN_FOREVER
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        self.speed_sp = self._speed_native_units(speed)
+        self.position_sp = int(round(position))
+        self._set_brake(brake)
+        self.command = self.COMMAND_RUN_TO_ABS_POS
+
+    def run_direct(self, **kwargs):
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+        self.command = self.COMMAND_RUN_DIRECT
+
+    def stop(self, **kwargs):
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+        self.command = self.COMMAND_STOP
+
+    def reset(self, **kwargs):
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+        self.command = self.COMMAND_RESET
+
+    def wait_until(self, s, timeout=None):
+        tic = time.time()
+        while s not in self.state:
+            if timeout is not None and time.time() >= tic + timeout / 1000:
+                return False
+            time.sleep(0.01)
+        return True
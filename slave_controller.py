@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# Closed-loop controller for the wrist and grabber joints, running on the slave EV3.
+#
+# The master only sends high level setpoints (a joint velocity or a target position) and a heartbeat. The slave
+# runs its own fixed-rate loop, enforces the soft limits of every joint and stops all motors by itself when the
+# master goes quiet, so wrist responsiveness and safety no longer depend on the master-to-slave link.
+#
+# On the slave brick:      python3 slave_controller.py
+# Loopback on one machine: python3 slave_controller.py --loopback
+import argparse
+import logging
+import sys
+import threading
+import time
+
+from smart_motor import LimitedRangeMotor, StaticRangeMotor
+from sysfs_motor import DeviceNotFound
+
+
+SLAVE_CONTROLLER_PORT = 18813
+LOOP_RATE = 50  # Hz
+HEARTBEAT_TIMEOUT = 0.5  # seconds
+HEARTBEAT_INTERVAL = 0.1  # seconds
+
+WRIST_JOINTS = ('roll', 'pitch', 'spin', 'grabber')
+# joints which coast instead of holding position when stopped
+COAST_JOINTS = ('pitch', 'grabber')
+
+MODE_IDLE = 0
+MODE_VELOCITY = 1
+MODE_TARGET = 2
+
+logger = logging.getLogger(__name__)
+
+
+class JointController:
+    """ keep a single motor at its setpoint while staying within its soft limits """
+
+    def __init__(self, motor, brake=True):
+        self._motor = motor
+        self._brake = brake
+        self.mode = MODE_IDLE
+        self.speed = 0
+        self.target = None
+        self._dirty = False
+        self._running = False
+
+    @property
+    def motor(self):
+        return self._motor
+
+    @property
+    def is_running(self):
+        return self._running
+
+    def set_velocity(self, speed):
+        mode = MODE_VELOCITY if speed else MODE_IDLE
+        # stopping an idle joint again is a no-op, failsafe does that every tick
+        if mode != self.mode or (mode == MODE_VELOCITY and speed != self.speed):
+            self.mode = mode
+            self.speed = speed
+            self.target = None
+            self._dirty = True
+
+    def set_target(self, position, speed):
+        position = min(max(position, self._motor.minPos), self._motor.maxPos)
+        if self.mode != MODE_TARGET or position != self.target or speed != self.speed:
+            self.mode = MODE_TARGET
+            self.speed = speed
+            self.target = position
+            self._dirty = True
+
+    def stop(self):
+        self.set_velocity(0)
+
+    def tick(self):
+        """ send a motor command when the setpoint changed, returns True if a command was sent """
+        if not self._dirty:
+            if self._running and self.mode == MODE_TARGET and not self._motor.is_running:
+                # target reached
+                self.mode = MODE_IDLE
+                self._running = False
+            return False
+
+        self._dirty = False
+        if self.mode == MODE_VELOCITY:
+            # let the motor driver enforce the soft limit by running to it, instead of polling the position
+            limit = self._motor.maxPos if self.speed > 0 else self._motor.minPos
+            self._motor.on_to_position(abs(self.speed), limit, self._brake, False)
+            self._running = True
+        elif self.mode == MODE_TARGET:
+            self._motor.on_to_position(abs(self.speed), self.target, self._brake, False)
+            self._running = True
+        else:
+            self._motor.stop()
+            self._running = False
+        return True
+
+
+class SlaveController:
+    """ own the slave motors locally and run them from setpoints sent by the master """
+
+    def __init__(self, motors, coast=(), rate=LOOP_RATE, heartbeat_timeout=HEARTBEAT_TIMEOUT, clock=time.monotonic):
+        self.joints = dict((name, JointController(motor, brake=name not in coast)) for name, motor in motors.items())
+        self._interval = 1.0 / rate
+        self._heartbeat_timeout = heartbeat_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_heartbeat = None
+        self.failsafe = False
+        self.running = False
+        self.ticks = 0
+        self.overruns = 0
+        self.commands = 0
+
+    def _joint(self, name):
+        try:
+            return self.joints[name]
+        except KeyError:
+            raise ValueError('Unknown joint {}'.format(name))
+
+    def heartbeat(self):
+        with self._lock:
+            if self.failsafe:
+                logger.info('Heartbeat restored' if self._last_heartbeat else 'Master connected')
+                self.failsafe = False
+            self._last_heartbeat = self._clock()
+
+    def set_velocity(self, name, speed):
+        """ run a joint at speed (percentage), positive towards its max position """
+        joint = self._joint(name)
+        with self._lock:
+            if not self.failsafe:
+                joint.set_velocity(speed)
+
+    def set_target(self, name, position, speed):
+        """ move a joint to position at speed (percentage), clamped to its soft limits """
+        joint = self._joint(name)
+        with self._lock:
+            if not self.failsafe:
+                joint.set_target(position, speed)
+
+    def limits(self, name):
+        motor = self._joint(name).motor
+        return (motor.minPos, motor.maxPos, motor.centerPos)
+
+    def reset(self, name):
+        self._joint(name).motor.reset()
+
+    def calibrate(self, name, to_center=True):
+        joint = self._joint(name)
+        with self._lock:
+            joint.stop()
+            joint.tick()
+            joint.motor.calibrate(to_center=to_center)
+
+    def status(self):
+        """ snapshot of the controller state, positions are read from the motors """
+        with self._lock:
+            return {
+                'failsafe': self.failsafe,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'commands': self.commands,
+                'joints': dict((name, {
+                    'mode': joint.mode,
+                    'speed': joint.speed,
+                    'target': joint.target,
+                    'running': joint.is_running,
+                    'position': joint.motor.position,
+                }) for name, joint in self.joints.items()),
+            }
+
+    def stop_all(self):
+        with self._lock:
+            for joint in self.joints.values():
+                joint.stop()
+                joint.tick()
+
+    def tick(self):
+        """ run one control cycle """
+        with self._lock:
+            now = self._clock()
+            timed_out = self._last_heartbeat is None or now - self._last_heartbeat > self._heartbeat_timeout
+            if not self.failsafe and timed_out:
+                if self._last_heartbeat is not None:
+                    logger.warning('Heartbeat lost, stopping all motors')
+                self.failsafe = True
+
+            for joint in self.joints.values():
+                if self.failsafe:
+                    joint.stop()
+                if joint.tick():
+                    self.commands += 1
+            self.ticks += 1
+
+    def run(self):
+        """ run the control loop at a fixed rate until stop() is called """
+        self.running = True
+        next_tick = self._clock()
+        while self.running:
+            self.tick()
+            next_tick += self._interval
+            delay = next_tick - self._clock()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # we're late, don't try to catch up with a burst of ticks
+                self.overruns += 1
+                next_tick = self._clock()
+        self.stop_all()
+
+    def stop(self):
+        self.running = False
+
+
+def make_rpyc_service(controller):
+    """ wrap a controller in an RPyC service exposing only the setpoint interface """
+    import rpyc
+
+    class SlaveControllerService(rpyc.Service):
+        def exposed_heartbeat(self):
+            controller.heartbeat()
+
+        def exposed_set_velocity(self, name, speed):
+            controller.heartbeat()
+            controller.set_velocity(name, speed)
+
+        def exposed_set_target(self, name, position, speed):
+            controller.heartbeat()
+            controller.set_target(name, position, speed)
+
+        def exposed_limits(self, name):
+            return controller.limits(name)
+
+        def exposed_reset(self, name):
+            controller.reset(name)
+
+        def exposed_calibrate(self, name, to_center=True):
+            controller.calibrate(name, to_center)
+
+        def exposed_status(self):
+            return controller.status()
+
+    return SlaveControllerService
+
+
+class RpycSlaveClient:
+    """ master side of the slave controller, sends setpoints and keeps the heartbeat alive """
+
+    def __init__(self, host, port=SLAVE_CONTROLLER_PORT, heartbeat_interval=HEARTBEAT_INTERVAL):
+        import rpyc
+        self._conn = rpyc.connect(host, port)
+        self._root = self._conn.root
+        self._heartbeat_interval = heartbeat_interval
+        self._running = True
+        if heartbeat_interval:
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+            self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        while self._running:
+            self._root.heartbeat()
+            time.sleep(self._heartbeat_interval)
+
+    def set_velocity(self, name, speed):
+        self._root.set_velocity(name, speed)
+
+    def set_target(self, name, position, speed):
+        self._root.set_target(name, position, speed)
+
+    def limits(self, name):
+        return tuple(self._root.limits(name))
+
+    def reset(self, name):
+        self._root.reset(name)
+
+    def calibrate(self, name, to_center=True):
+        self._root.calibrate(name, to_center)
+
+    def status(self):
+        return self._root.status()
+
+    def close(self):
+        self._running = False
+        self._conn.close()
+
+
+def make_client(transport, host, rpyc_port=SLAVE_CONTROLLER_PORT, udp_port=None):
+    """ slave controller client for the given transport, 'rpyc' or 'udp' """
+    if transport == 'rpyc':
+        return RpycSlaveClient(host, rpyc_port)
+    if transport == 'udp':
+        from udp_transport import SLAVE_UDP_PORT, UdpSlaveClient
+        # the RPyC connection is only used for setup calls, the UDP setpoints double as the heartbeat
+        control = RpycSlaveClient(host, rpyc_port, heartbeat_interval=None)
+        return UdpSlaveClient(host, udp_port or SLAVE_UDP_PORT, control=control)
+    raise ValueError('Unknown slave transport {}'.format(transport))
+
+
+class RemoteJoint:
+    """ looks like a SmartMotor to the master control loop, but only sends setpoints to the slave controller
+
+    Commands are only sent when they differ from the previous one, the control loop re-issuing the same
+    command every pass costs nothing.
+    """
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+        self._last = None
+        self._minPos, self._maxPos, self._centerPos = client.limits(name)
+
+    @property
+    def maxPos(self):
+        return self._maxPos
+
+    @property
+    def minPos(self):
+        return self._minPos
+
+    @property
+    def centerPos(self):
+        return self._centerPos
+
+    @property
+    def is_running(self):
+        return self._last is not None
+
+    def _send(self, command):
+        if command != self._last:
+            if command[0] == 'target':
+                self._client.set_target(self._name, command[1], command[2])
+            else:
+                self._client.set_velocity(self._name, command[1])
+            # only a velocity of 0 means stopped, a target of 0 is a move like any other
+            self._last = None if command[0] == 'velocity' and not command[1] else command
+
+    def on(self, speed, brake=True, block=False):
+        self._send(('velocity', speed))
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        self._send(('target', position, speed))
+
+    def stop(self):
+        self._send(('velocity', 0))
+        self._last = None
+
+    def reset(self):
+        self._client.reset(self._name)
+        self._last = None
+
+    def calibrate(self, to_center=True):
+        self._client.calibrate(self._name, to_center)
+        self._minPos, self._maxPos, self._centerPos = self._client.limits(self._name)
+
+
+def create_motors(loopback=False):
+    """ the slave motors, wrapped the same way robot_arm.py used to do it remotely """
+    if loopback:
+        from sim_motor import SimulatedMotor
+
+        def medium_motor(address):
+            return SimulatedMotor(address)
+        outputs = ('outA', 'outB', 'outC', 'outD')
+        coast = SimulatedMotor.STOP_ACTION_COAST
+    else:
+        from ev3dev2.motor import OUTPUT_A, OUTPUT_B, OUTPUT_C, OUTPUT_D, MediumMotor
+        medium_motor = MediumMotor
+        outputs = (OUTPUT_A, OUTPUT_B, OUTPUT_C, OUTPUT_D)
+        coast = MediumMotor.STOP_ACTION_COAST
+
+    # set the stop action on the motor itself, the SmartMotor wrappers only proxy reads
+    roll, pitch, spin = (medium_motor(address) for address in outputs[:3])
+    motors = {
+        'roll': LimitedRangeMotor(roll, speed=30, name='roll'),
+        'pitch': LimitedRangeMotor(pitch, speed=10, name='pitch'),
+        'spin': StaticRangeMotor(spin, maxPos=14 * 360, speed=20, name='spin'),
+    }
+
+    grabber = None
+    try:
+        grabber = medium_motor(outputs[3])
+        motors['grabber'] = LimitedRangeMotor(grabber, speed=20, name='grabber')
+        logger.info("Grabber motor detected!")
+    except DeviceNotFound:
+        logger.info("Grabber motor not detected - running without it...")
+
+    # Not sure why but resetting all motors before doing anything else seems to improve reliability
+    for motor in motors.values():
+        motor.reset()
+
+    pitch.stop_action = coast
+    if grabber:
+        grabber.stop_action = coast
+
+    return motors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closed-loop controller for the slave EV3 joints')
+    parser.add_argument('--loopback', action='store_true', help='use simulated motors and listen on localhost')
+    parser.add_argument('--port', type=int, default=SLAVE_CONTROLLER_PORT)
+    parser.add_argument('--udp-port', type=int, default=None, help='port for UDP setpoints, 0 to disable')
+    parser.add_argument('--rate', type=int, default=LOOP_RATE, help='control loop rate in Hz')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(message)s')
+
+    controller = SlaveController(create_motors(args.loopback), coast=COAST_JOINTS, rate=args.rate)
+    control_thread = threading.Thread(target=controller.run, daemon=True)
+    control_thread.start()
+
+    hostname = 'localhost' if args.loopback else ''
+    udp_server = None
+    if args.udp_port != 0:
+        from udp_transport import SLAVE_UDP_PORT, UdpSetpointServer
+        udp_server = UdpSetpointServer(controller, hostname, args.udp_port or SLAVE_UDP_PORT)
+        threading.Thread(target=udp_server.serve_forever, daemon=True).start()
+        logger.info('Listening for UDP setpoints on port {}'.format(udp_server.address[1]))
+
+    from rpyc.utils.server import ThreadedServer
+    server = ThreadedServer(make_rpyc_service(controller), hostname=hostname, port=args.port)
+    logger.info('Slave controller listening on port {}'.format(args.port))
+    try:
+        server.start()
+    finally:
+        if udp_server:
+            udp_server.close()
+        controller.stop()
+        control_thread.join()
+
+
+if __name__ == '__main__':
+    main()
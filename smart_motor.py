@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import time
 
+from joint_estimator import JointEstimator
+from soft_limits import SoftLimits
+
 
 class SmartMotorBase:
     """ base class for handling motors """
@@ -10,6 +13,9 @@ class SmartMotorBase:
     _minPos = -5000  # @TODO revert to None or 5..?
     _maxPos = 5000  # @TODO revert to None
     _motorPadding = 10
+    _estimator = None
+    _softLimits = None
+    _brake = True
 
     def __init__(self, motor, speed=10, name=None):
         self._motor = motor
@@ -19,6 +25,135 @@ class SmartMotorBase:
     def calibrate(self, to_center=True):
         print('Calibrating {}...'.format(self._name))
 
+    def _read_position(self):
+        return self._motor.position
+
+    def _max_speed(self):
+        return self._motor.max_speed
+
+    def enable_estimator(self, **kwargs):
+        """ track the position by dead reckoning instead of reading the encoder all the time """
+        self._estimator = JointEstimator(self._read_position, self._max_speed(), **kwargs)
+        self._estimator.update(force=True)
+
+    def enable_soft_limits(self, **kwargs):
+        """ slow down and stop on() moves ahead of the limits (see soft_limits.py), checked by refresh_estimate() """
+        self._softLimits = SoftLimits(self._max_speed(), **kwargs)
+
+    def _soft_limit_bounds(self):
+        low, high = self.estimated_range()
+        return low, high, self._minPos, self._maxPos
+
+    def _motor_on(self, speed, brake, block):
+        self._motor.on(speed, brake, block)
+
+    def _motor_stop(self, **kwargs):
+        self._motor.stop(**kwargs)
+
+    def _run(self, speed, brake):
+        if speed:
+            self._motor_on(speed, brake, False)
+            if self._estimator:
+                self._estimator.command(speed)
+        else:
+            self._motor_stop()
+            if self._estimator:
+                self._estimator.stop()
+
+    def on(self, speed, brake=True, block=False):
+        if self._softLimits:
+            self._brake = brake
+            # block is ignored, there's no end to wait for
+            self._run(self._softLimits.command(speed, *self._soft_limit_bounds()), brake)
+            return
+        self._motor_on(speed, brake, block)
+        if self._estimator:
+            self._estimator.command(speed)
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        if self._softLimits:
+            self._softLimits.clear()
+        self._motor.on_to_position(speed, position, brake, block)
+        if self._estimator:
+            self._estimator.command(speed, position)
+
+    def hold(self, duty_cycle):
+        """ push with a fixed duty cycle (signed percentage) instead of regulating the speed, to hold on to
+        something with a limited force """
+        if self._softLimits:
+            self._softLimits.clear()
+        self._motor.run_direct(duty_cycle_sp=duty_cycle)
+        if self._estimator:
+            # pressing against something, it isn't going anywhere
+            self._estimator.stop()
+
+    def stop(self, **kwargs):
+        if self._softLimits:
+            self._softLimits.clear()
+        self._motor_stop(**kwargs)
+        if self._estimator:
+            self._estimator.stop()
+
+    def reset(self, **kwargs):
+        if self._softLimits:
+            self._softLimits.clear()
+        self._motor.reset(**kwargs)
+        if self._estimator:
+            # reset zeroes the encoder
+            self._estimator.stop()
+            self._estimator.set_position(0)
+
+    @property
+    def estimated_position(self):
+        """ position estimate, falls back to reading the encoder without an estimator """
+        if self._estimator:
+            return self._estimator.position
+        return self._read_position()
+
+    def estimated_range(self):
+        """ (low, high) range the joint is expected to be in """
+        if self._estimator:
+            return self._estimator.interval_bounds()
+        position = self._read_position()
+        return position, position
+
+    def refresh_estimate(self, force=False):
+        """ read the encoder when the estimator wants it, or when the joint might be close to its limits
+
+        With soft limits this is also where a move gets slowed down or stopped ahead of a limit, so it should be
+        called every control loop pass. Returns True when the encoder was read.
+        """
+        read = False
+        if self._estimator:
+            low, high = self._estimator.interval_bounds()
+            near_limit = low <= self._minPos + self._motorPadding or high >= self._maxPos - self._motorPadding
+            if self._softLimits and not near_limit:
+                near_limit = self._softLimits.approaching(low, high, self._minPos, self._maxPos)
+            read = self._estimator.update(force=force, near_limit=near_limit)
+
+        if self._softLimits and self._softLimits.active:
+            speed = self._softLimits.check(*self._soft_limit_bounds())
+            if speed is not None:
+                self._run(speed, self._brake)
+        return read
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def motor(self):
+        """ the ev3dev2 motor (a list of them for motor sets) """
+        return self._motor
+
+    @property
+    def estimator(self):
+        return self._estimator
+
+    @property
+    def soft_limits(self):
+        return self._softLimits
+
     @property
     def maxPos(self):
         return self._maxPos
@@ -118,22 +253,37 @@ class LimitedRangeMotorSet(LimitedRangeMotor):
         time.sleep(1)
         print('Motor {} found max {}'.format(self._name, self._maxPos))
 
+    def _read_position(self):
+        return self._motor[1].position
+
+    def _max_speed(self):
+        return self._motor[1].max_speed
+
     def on_to_position(self, speed, position, brake, wait):
+        if self._softLimits:
+            self._softLimits.clear()
         for motor in self._motor:
             # @TODO hardcoded no-waiting because of dual motor setup
             motor.on_to_position(speed, position, brake, False)
+        if self._estimator:
+            self._estimator.command(speed, position)
 
     def reset(self):
+        if self._softLimits:
+            self._softLimits.clear()
         for motor in self._motor:
             motor.reset()
+        if self._estimator:
+            self._estimator.stop()
+            self._estimator.set_position(0)
 
-    def stop(self):
+    def _motor_stop(self, **kwargs):
         for motor in self._motor:
             motor.stop()
 
-    def on(self, speed):
+    def _motor_on(self, speed, brake, block):
         for motor in self._motor:
-            motor.on(speed)
+            motor.on(speed, brake)
 
     @property
     def is_running(self):
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Soft limits for joints driven with plain speed commands.
+#
+# Instead of sending run-to-position commands to the limit (which have to be sent again every time the speed
+# changes), a joint runs at a speed and gets slowed down and stopped ahead of its limit. Whether that's needed is
+# predicted from the stopping distance at the current speed: the distance travelled until a stop command reaches
+# the motor plus the distance it needs to brake.
+
+
+# seconds from deciding to stop until the motor gets the command (control loop pass and brick worker queue)
+STOP_LATENCY = 0.05
+# tacho counts/s², how quickly a braking motor comes to rest
+DECELERATION = 5000
+# start slowing down this many stopping distances ahead of a limit
+RAMP = 3
+# speed percentage below which slowing down further means stopping
+MIN_SPEED = 2
+
+
+class SoftLimits:
+    """ slow down and stop speed commands ahead of a joint's limits
+
+    The speed is halved every time the limit gets closer than RAMP stopping distances, so approaching a limit
+    costs a few commands instead of one per control loop pass, and the joint stops once the slowest step would
+    overshoot. Positions are given as the (low, high) range the joint is known to be in, so an uncertain position
+    estimate stops it early rather than late.
+    """
+
+    def __init__(self, max_speed, latency=STOP_LATENCY, deceleration=DECELERATION, ramp=RAMP, min_speed=MIN_SPEED):
+        self._max_speed = max_speed
+        self._latency = latency
+        self._deceleration = deceleration
+        self._ramp = ramp
+        self._min_speed = min_speed
+        self._requested = 0
+        self._sent = 0
+        self.stops = 0
+        self.slowdowns = 0
+
+    def stopping_distance(self, speed):
+        """ tacho counts a joint moving at speed (percentage) travels after deciding to stop """
+        velocity = abs(speed) * self._max_speed / 100.0
+        return velocity * self._latency + velocity * velocity / (2.0 * self._deceleration)
+
+    def margin(self):
+        """ distance from a limit at which the current move starts slowing down """
+        return self._ramp * self.stopping_distance(self._sent)
+
+    def approaching(self, low, high, min_pos, max_pos):
+        """ True once the current move is close enough to the limit it heads for to start slowing down """
+        if self._sent > 0:
+            return max_pos - high <= self.margin()
+        if self._sent < 0:
+            return low - min_pos <= self.margin()
+        return False
+
+    def limit(self, speed, low, high, min_pos, max_pos):
+        """ speed (percentage) a joint between low and high may move at, 0 when it has to stop """
+        if speed > 0:
+            distance = max_pos - high
+        elif speed < 0:
+            distance = low - min_pos
+        else:
+            return speed
+
+        allowed = speed
+        while abs(allowed) >= self._min_speed:
+            # the slowest step may run right up to the limit, faster ones have to leave room to ramp down
+            last_step = abs(allowed) / 2 < self._min_speed
+            if distance > self.stopping_distance(allowed) * (1 if last_step else self._ramp):
+                return allowed
+            allowed /= 2
+        return 0
+
+    @property
+    def active(self):
+        """ True while a requested move is being watched """
+        return bool(self._requested)
+
+    def command(self, speed, low, high, min_pos, max_pos):
+        """ a new speed request, returns the speed to send """
+        allowed = self.limit(speed, low, high, min_pos, max_pos)
+        if speed and not allowed:
+            self.stops += 1
+        elif allowed != speed:
+            self.slowdowns += 1
+        self._requested = speed
+        self._sent = allowed
+        return allowed
+
+    def check(self, low, high, min_pos, max_pos):
+        """ the speed to send when the requested move has to slow down or stop by now, None otherwise """
+        if not self._requested:
+            return None
+        allowed = self.limit(self._requested, low, high, min_pos, max_pos)
+        if allowed == self._sent:
+            return None
+        if allowed:
+            self.slowdowns += 1
+        else:
+            self.stops += 1
+        self._sent = allowed
+        return allowed
+
+    def clear(self):
+        """ the joint was stopped or sent somewhere by other means """
+        self._requested = 0
+        self._sent = 0
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Filters for the scaled stick values, so noise around a held stick position doesn't turn into a stream of
+# slightly different speed commands.
+#
+# Every axis gets a chain of filters, configured as a list of (name, options) pairs:
+#
+#   [('one_euro', {'min_cutoff': 1.0, 'beta': 0.01}), ('hysteresis', {'threshold': 3}), ('quantize', {'step': 5})]
+#
+# A stick back in its deadzone (0) always passes straight through and resets the chain, stopping a joint is
+# never delayed, and so does a stick at full deflection. The filters only run on input events, and a stick which
+# is held still sends none, so smoothing filters (one_euro, low_pass) can be left behind wherever the last event
+# put them. The default chain only uses hysteresis and quantize, which stay within a few percent of the stick
+# however long it's held.
+import math
+
+
+# DualShock 4 report interval, used when events arrive with the same timestamp
+DEFAULT_DT = 0.004
+
+# largest scaled stick value, see scale_stick()
+FULL_SCALE = 80
+
+DEFAULT_CHAIN = [
+    ('hysteresis', {'threshold': 3}),
+    ('quantize', {'step': 5}),
+]
+
+
+class LowPass:
+    """ exponential smoothing, alpha is the weight of a new value """
+
+    def __init__(self, alpha=0.5):
+        self._alpha = alpha
+        self._value = None
+
+    def __call__(self, value, timestamp):
+        if self._value is None:
+            self._value = value
+        else:
+            self._value += self._alpha * (value - self._value)
+        return self._value
+
+    def reset(self):
+        self._value = None
+
+
+def _smoothing(cutoff, dt):
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class OneEuro:
+    """ 1€ filter: smooths a lot while the stick is held, little while it moves fast
+
+    min_cutoff (Hz) sets the smoothing at rest, beta how quickly the cutoff rises with speed (in units per
+    second). See https://gery.casiez.net/1euro/
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.01, d_cutoff=1.0):
+        self._min_cutoff = min_cutoff
+        self._beta = beta
+        self._d_cutoff = d_cutoff
+        self.reset()
+
+    def __call__(self, value, timestamp):
+        if self._value is None:
+            self._value = value
+            self._time = timestamp
+            return value
+
+        dt = timestamp - self._time
+        if dt <= 0:
+            dt = DEFAULT_DT
+        self._time = timestamp
+
+        derivative = (value - self._value) / dt
+        self._derivative += _smoothing(self._d_cutoff, dt) * (derivative - self._derivative)
+        cutoff = self._min_cutoff + self._beta * abs(self._derivative)
+        self._value += _smoothing(cutoff, dt) * (value - self._value)
+        return self._value
+
+    def reset(self):
+        self._value = None
+        self._derivative = 0.0
+        self._time = None
+
+
+class Quantize:
+    """ round to speed steps """
+
+    def __init__(self, step=5):
+        self._step = step
+
+    def __call__(self, value, timestamp):
+        return math.floor(value / self._step + 0.5) * self._step
+
+    def reset(self):
+        pass
+
+
+class Hysteresis:
+    """ hold the output until the input moved at least threshold away from it """
+
+    def __init__(self, threshold=3):
+        self._threshold = threshold
+        self._value = None
+
+    def __call__(self, value, timestamp):
+        if self._value is None or abs(value - self._value) >= self._threshold:
+            self._value = value
+        return self._value
+
+    def reset(self):
+        self._value = None
+
+
+FILTERS = {
+    'low_pass': LowPass,
+    'one_euro': OneEuro,
+    'quantize': Quantize,
+    'hysteresis': Hysteresis,
+}
+
+
+class AxisFilter:
+    """ a chain of filters for one stick axis, counting the updates which didn't change the output
+
+    Values of 0 and of at least full_scale either way pass through unfiltered and restart the chain.
+    """
+
+    def __init__(self, filters, full_scale=FULL_SCALE):
+        self._filters = list(filters)
+        self._full_scale = full_scale
+        self._output = 0
+        self.updates = 0
+        self.suppressed = 0
+
+    def __call__(self, value, timestamp):
+        self.updates += 1
+        if value == 0 or abs(value) >= self._full_scale:
+            # centered or pushed all the way, no reason to hold back
+            for stick_filter in self._filters:
+                stick_filter.reset()
+            output = value
+        else:
+            output = value
+            for stick_filter in self._filters:
+                output = stick_filter(output, timestamp)
+            if (output > 0) != (value > 0):
+                # smoothing lagging behind a quick reversal mustn't drive the joint the wrong way
+                output = 0
+        if output == self._output:
+            self.suppressed += 1
+        self._output = output
+        return output
+
+
+def build_filter(chain):
+    """ an AxisFilter from a list of (name, options) pairs """
+    filters = []
+    for name, options in chain:
+        if name not in FILTERS:
+            raise ValueError('Unknown stick filter {}, use one of {}'.format(name, ', '.join(sorted(FILTERS))))
+        filters.append(FILTERS[name](**options))
+    return AxisFilter(filters)
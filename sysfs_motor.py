@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+import os
+import select
+import stat
+import time
+
+try:
+    from ev3dev2 import DeviceNotFound
+except ImportError:
+    class DeviceNotFound(Exception):
+        pass
+
+
+SYSFS_ROOT = '/sys/class'
+TACHO_MOTOR_CLASS = 'tacho-motor'
+
+# attributes which get a file descriptor on init, everything else is opened on first use
+HOT_ATTRIBUTES = ('speed_sp', 'position_sp', 'command', 'state', 'position', 'stop_action')
+
+READ_SIZE = 256
+
+
+def find_motor_path(address, sysfs_root=SYSFS_ROOT):
+    """ find the tacho-motor directory for a given port address, e.g. 'ev3-ports:outA'
+
+    Like ev3dev2, the address matches when it is a substring of the address attribute.
+    """
+    class_path = os.path.join(sysfs_root, TACHO_MOTOR_CLASS)
+    try:
+        names = sorted(os.listdir(class_path))
+    except FileNotFoundError:
+        names = []
+
+    for name in names:
+        if not name.startswith('motor'):
+            continue
+        path = os.path.join(class_path, name)
+        try:
+            with open(os.path.join(path, 'address')) as address_file:
+                if address in address_file.read():
+                    return path
+        except OSError:
+            continue
+
+    raise DeviceNotFound('tacho-motor at {} is not connected.'.format(address))
+
+
+def create_fake_motor(sysfs_root, index, address, max_speed=1050, count_per_rot=360,
+                      driver_name='lego-ev3-l-motor'):
+    """ create a fake tacho-motor directory under sysfs_root, for tests and benchmarks off the brick """
+    path = os.path.join(sysfs_root, TACHO_MOTOR_CLASS, 'motor{}'.format(index))
+    os.makedirs(path, exist_ok=True)
+    attributes = {
+        'address': address,
+        'driver_name': driver_name,
+        'max_speed': max_speed,
+        'count_per_rot': count_per_rot,
+        'command': '',
+        'state': '',
+        'position': 0,
+        'position_sp': 0,
+        'speed': 0,
+        'speed_sp': 0,
+        'duty_cycle': 0,
+        'duty_cycle_sp': 0,
+        'stop_action': 'coast',
+    }
+    writable = ('command', 'position', 'position_sp', 'speed_sp', 'duty_cycle_sp', 'stop_action')
+    for name, value in attributes.items():
+        attribute_path = os.path.join(path, name)
+        with open(attribute_path, 'w') as attribute_file:
+            attribute_file.write('{}\n'.format(value))
+        os.chmod(attribute_path, 0o664 if name in writable else 0o444)
+    return path
+
+
+class SysfsMotor:
+    """ drop-in replacement for ev3dev2 LargeMotor/MediumMotor talking to sysfs directly
+
+    File descriptors for the attributes used in the control loop are kept open and accessed using positioned
+    I/O (pread/pwrite at offset 0), so every command is a single syscall without path lookups, seeks or
+    ev3dev2's attribute caching layers.
+    """
+    COMMAND_RUN_FOREVER = 'run-forever'
+    COMMAND_RUN_TO_ABS_POS = 'run-to-abs-pos'
+    COMMAND_RUN_DIRECT = 'run-direct'
+    COMMAND_STOP = 'stop'
+    COMMAND_RESET = 'reset'
+
+    STOP_ACTION_COAST = 'coast'
+    STOP_ACTION_BRAKE = 'brake'
+    STOP_ACTION_HOLD = 'hold'
+
+    STATE_RUNNING = 'running'
+
+    def __init__(self, address, sysfs_root=SYSFS_ROOT):
+        self._address = address
+        self._path = find_motor_path(address, sysfs_root)
+        # real sysfs attributes are rewritten as a whole, regular files (fake trees) need truncating
+        self._truncate = os.path.realpath(sysfs_root) != SYSFS_ROOT
+        self._fds = {}
+        # write-through cache so we don't send values the driver already has
+        self._written = {}
+        for name in HOT_ATTRIBUTES:
+            self._fd(name)
+
+        self.max_speed = int(self._read('max_speed'))
+        self.count_per_rot = int(self._read('count_per_rot'))
+
+    def __str__(self):
+        return '{}({})'.format(self.__class__.__name__, self._address)
+
+    def _fd(self, name):
+        fd = self._fds.get(name)
+        if fd is None:
+            path = os.path.join(self._path, name)
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+            if mode & stat.S_IRGRP and mode & stat.S_IWGRP:
+                flags = os.O_RDWR
+            elif mode & stat.S_IWGRP:
+                flags = os.O_WRONLY
+            else:
+                flags = os.O_RDONLY
+            fd = self._fds[name] = os.open(path, flags)
+        return fd
+
+    def _read(self, name):
+        return os.pread(self._fd(name), READ_SIZE, 0).strip().decode()
+
+    def _write(self, name, value):
+        data = str(value).encode()
+        fd = self._fd(name)
+        os.pwrite(fd, data, 0)
+        if self._truncate:
+            os.ftruncate(fd, len(data))
+
+    def _write_cached(self, name, value):
+        if self._written.get(name) != value:
+            self._write(name, value)
+            self._written[name] = value
+
+    def _speed_native_units(self, speed):
+        if not -100 <= speed <= 100:
+            raise ValueError('{} is an invalid speed percentage, must be between -100 and 100 (inclusive)'.format(
+                speed))
+        return int(round(speed * self.max_speed / 100))
+
+    def _set_brake(self, brake):
+        self.stop_action = self.STOP_ACTION_HOLD if brake else self.STOP_ACTION_COAST
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    # attributes
+    @property
+    def position(self):
+        return int(self._read('position'))
+
+    @position.setter
+    def position(self, value):
+        self._write('position', int(value))
+
+    @property
+    def state(self):
+        return self._read('state').split()
+
+    @property
+    def speed(self):
+        return int(self._read('speed'))
+
+    @property
+    def duty_cycle(self):
+        return int(self._read('duty_cycle'))
+
+    @property
+    def speed_sp(self):
+        return int(self._read('speed_sp'))
+
+    @speed_sp.setter
+    def speed_sp(self, value):
+        self._write_cached('speed_sp', int(value))
+
+    @property
+    def duty_cycle_sp(self):
+        return int(self._read('duty_cycle_sp'))
+
+    @duty_cycle_sp.setter
+    def duty_cycle_sp(self, value):
+        self._write_cached('duty_cycle_sp', int(value))
+
+    @property
+    def position_sp(self):
+        return int(self._read('position_sp'))
+
+    @position_sp.setter
+    def position_sp(self, value):
+        self._write_cached('position_sp', int(round(value)))
+
+    @property
+    def stop_action(self):
+        return self._read('stop_action')
+
+    @stop_action.setter
+    def stop_action(self, value):
+        self._write_cached('stop_action', value)
+
+    @property
+    def command(self):
+        raise AttributeError('command is a write-only attribute')
+
+    @command.setter
+    def command(self, value):
+        self._write('command', value)
+
+    @property
+    def is_running(self):
+        return self.STATE_RUNNING in self.state
+
+    # commands
+    def on(self, speed, brake=True, block=False):
+        self.speed_sp = self._speed_native_units(speed)
+        self._set_brake(brake)
+        self.command = self.COMMAND_RUN_FOREVER
+        if block:
+            self.wait_until_not_moving()
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        self.speed_sp = self._speed_native_units(speed)
+        self.position_sp = position
+        self._set_brake(brake)
+        self.command = self.COMMAND_RUN_TO_ABS_POS
+        if block:
+            self.wait_until_not_moving()
+
+    def run_direct(self, **kwargs):
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+        self.command = self.COMMAND_RUN_DIRECT
+
+    def stop(self, **kwargs):
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+        self.command = self.COMMAND_STOP
+
+    def reset(self, **kwargs):
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+        self.command = self.COMMAND_RESET
+        # the driver resets all *_sp attributes, so forget what we wrote
+        self._written = {}
+
+    def wait(self, cond, timeout=None):
+        """ block until cond(state) is True, timeout is in milliseconds like ev3dev2 """
+        tic = time.time()
+        poll = select.poll()
+        poll.register(self._fd('state'), select.POLLPRI)
+        poll_tm = min(timeout, 100) if timeout else 100
+
+        while True:
+            if cond(self.state):
+                return True
+
+            poll.poll(poll_tm)
+
+            if timeout is not None and time.time() >= tic + timeout / 1000:
+                return cond(self.state)
+
+    def wait_until(self, s, timeout=None):
+        return self.wait(lambda state: s in state, timeout)
+
+    def wait_while(self, s, timeout=None):
+        return self.wait(lambda state: s not in state, timeout)
+
+    def wait_until_not_moving(self, timeout=None):
+        return self.wait(lambda state: self.STATE_RUNNING not in state or 'stalled' in state, timeout)
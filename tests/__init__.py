@@ -0,0 +1,13 @@
+class FakeClock:
+    """ stands in for time.monotonic, moving on by step on every call and by sleep() """
+
+    def __init__(self, now=0.0, step=0.0):
+        self.now = now
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
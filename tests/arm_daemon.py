@@ -0,0 +1,140 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from arm_control import Speeds
+from arm_daemon import ArmDaemon, DaemonClient
+from input_replay import ReplayEvent, recording_joints
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class TestArmDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'arm.sock')
+        self.log = []
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.daemon.stop()
+        self.thread.join(2)
+        shutil.rmtree(self.directory)
+
+    def start(self, **kwargs):
+        self.joints = recording_joints(self.log)
+        self.daemon = ArmDaemon(self.joints, Speeds(), path=self.path, tick_interval=0.002, **kwargs)
+        self.daemon.start()
+        self.thread = threading.Thread(target=self.daemon.serve_forever, daemon=True)
+        self.thread.start()
+
+    def attach(self):
+        client = DaemonClient(self.path)
+        self.clients.append(client)
+        return client
+
+    def test_attach_and_drive(self):
+        self.start()
+        client = self.attach()
+        hello = client.request('hello')
+        self.assertEqual(hello['protocol'], 1)
+        self.assertIn('grabber', hello['joints'])
+        self.assertFalse(hello['calibrated'])
+
+        client.send_event(ReplayEvent(0, 0, 1, 310, 1))  # L1
+        self.assertTrue(wait_for(lambda: ('waist', 'on', -25) in self.log))
+        self.assertEqual(client.request('status')['events'], 1)
+
+        # detaching lets go of the controls
+        client.close()
+        self.clients.remove(client)
+        self.assertTrue(wait_for(lambda: ('waist', 'stop') in self.log))
+        self.assertTrue(self.daemon.running)
+
+        status = self.attach().request('status')
+        self.assertEqual(status['clients'], 1)
+        self.assertEqual(status['joints']['elbow']['min'], -2800)
+        self.assertIsNone(status['joints']['elbow']['position'])
+
+    def test_state(self):
+        self.start()
+        client = self.attach()
+        client.request('state', elbow_speed=30, pitch_up=True)
+        self.assertTrue(wait_for(lambda: ('elbow', 'on_to_position', 30.0, -2800) in self.log))
+        self.assertIn(('pitch', 'on', 10), self.log)
+
+        with self.assertRaises(RuntimeError):
+            client.request('state', teleport=True)
+        with self.assertRaises(RuntimeError):
+            client.request('dance')
+
+        client.request('stop')
+        self.assertTrue(wait_for(lambda: ('elbow', 'stop') in self.log and ('pitch', 'stop') in self.log))
+
+    def test_forward_until_quit(self):
+        self.start()
+        client = self.attach()
+        events = [ReplayEvent(0, 0, 1, 311, 1), ReplayEvent(0, 0, 0, 0, 0), ReplayEvent(0, 4000, 1, 316, 1),
+                  ReplayEvent(0, 8000, 1, 310, 1)]
+        self.assertEqual(client.forward(events), 2)
+        self.assertEqual(client.request('status')['events'], 2)
+        # the PS button only detaches the front end
+        self.assertFalse(self.daemon.state.waist_right)
+        self.assertTrue(self.daemon.state.running)
+        self.assertTrue(self.daemon.running)
+        self.assertTrue(wait_for(lambda: not self.joints['waist'].is_running))
+
+    def test_calibrate(self):
+        calls = []
+
+        def calibrate():
+            calls.append((self.daemon._lock.locked(), self.daemon.state.waist_left))
+
+        self.start(calibrate=calibrate)
+        client = self.attach()
+        client.request('state', waist_left=True)
+        client.request('calibrate')
+        self.assertEqual(calls, [(True, False)])
+        self.assertTrue(client.request('hello')['calibrated'])
+
+    def test_no_calibration(self):
+        self.start()
+        with self.assertRaises(RuntimeError):
+            self.attach().request('calibrate')
+
+    def test_shutdown(self):
+        self.start()
+        self.attach().request('shutdown')
+        self.thread.join(2)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_socket_is_private(self):
+        self.start()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_socket_in_use(self):
+        # left behind by a crashed daemon
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.start()
+        with self.assertRaises(RuntimeError):
+            ArmDaemon(recording_joints([]), Speeds(), path=self.path).start()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+import unittest
+from arm_control import Speeds
+from async_runtime import AsyncBrickWorker, AsyncReplay, AsyncRuntime, LatencyStats
+from brick_registry import QueuedJoint
+from input_replay import ReplayEvent, recording_joints
+
+
+class FakeBrick:
+    def __init__(self, name, host=None):
+        self.name = name
+        self.host = host
+
+
+class Forever:
+    """ input which never produces an event """
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(3600)
+
+
+class TestAsyncRuntime(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_session(self):
+        log = []
+        events = [ReplayEvent(0, 0, 1, 310, 1), ReplayEvent(0, 50000, 1, 310, 0), ReplayEvent(0, 100000, 3, 3, 255),
+                  ReplayEvent(0, 150000, 1, 315, 1), ReplayEvent(0, 200000, 1, 316, 1),
+                  ReplayEvent(0, 250000, 1, 311, 1)]
+        actions = []
+        runtime = AsyncRuntime(self.loop, AsyncReplay(events), recording_joints(log), Speeds(),
+                               on_action=actions.append, tick_interval=0.005)
+        runtime.run()
+
+        self.assertFalse(runtime.state.running)
+        self.assertEqual(actions, ['debug'])
+        self.assertEqual(log, [('waist', 'on', -25), ('waist', 'stop'), ('elbow', 'on_to_position', 80, -2800)])
+        summary = runtime.summary()
+        self.assertEqual(summary['input']['count'], 4)
+        self.assertGreater(summary['tick']['count'], 20)
+
+    def test_stop_cancels_everything(self):
+        worker = AsyncBrickWorker(FakeBrick('slave', host='10.42.0.3'))
+        runtime = AsyncRuntime(self.loop, Forever(), recording_joints([]), Speeds(), workers=[worker])
+        self.loop.call_later(0.05, runtime.stop)
+        tic = time.monotonic()
+        runtime.run()
+        self.assertLess(time.monotonic() - tic, 1)
+        self.assertTrue(all(task.done() for task in runtime._tasks))
+        worker.stop()
+
+    def test_workers(self):
+        sent = []
+        remote_threads = set()
+
+        def remote(value):
+            remote_threads.add(threading.current_thread())
+            sent.append(('remote', value))
+
+        local = AsyncBrickWorker(FakeBrick('master'))
+        slave = AsyncBrickWorker(FakeBrick('slave', host='10.42.0.3'))
+        # before the loop runs calls go through right away
+        self.assertEqual(local.call(lambda: 42), 42)
+
+        async def scenario():
+            tasks = [asyncio.ensure_future(local.run()), asyncio.ensure_future(slave.run())]
+            await asyncio.sleep(0)
+            slave.submit('roll', remote, 1)
+            slave.submit('roll', remote, 2)  # replaces 1
+            slave.submit('pitch', remote, 3)
+            local.submit('waist', sent.append, ('local', 4))
+            with self.assertRaises(RuntimeError):
+                local.call(lambda: None)
+            while slave.sent < 2 or local.sent < 1:
+                await asyncio.sleep(0.001)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.loop.run_until_complete(scenario())
+        self.assertEqual(sorted(sent), [('local', 4), ('remote', 2), ('remote', 3)])
+        self.assertEqual(slave.coalesced, 1)
+        self.assertNotIn(threading.current_thread(), remote_threads)
+        self.assertTrue(slave.flush(0.1))
+        slave.stop()
+
+    def test_cancel_and_flush(self):
+        worker = AsyncBrickWorker(FakeBrick('slave', host='10.42.0.3'))
+        fake = []
+        joint = QueuedJoint(type('Joint', (), {'on': lambda self, *args: fake.append(args)})(), worker)
+        joint.on(10)
+        # the loop isn't running, so this never gets sent
+        self.assertFalse(worker.flush(0.05))
+        self.assertFalse(worker.cancel())
+        self.assertTrue(worker.flush(0.05))
+        self.assertEqual(fake, [])
+        worker.stop()
+
+    def test_latency_stats(self):
+        stats = LatencyStats(samples=10)
+        self.assertEqual(stats.summary(), {'count': 0})
+        for value in range(1, 21):
+            stats.add(value / 1000.0)
+        summary = stats.summary()
+        self.assertEqual(summary['count'], 20)
+        self.assertAlmostEqual(summary['mean_ms'], 15.5)
+        self.assertAlmostEqual(summary['max_ms'], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
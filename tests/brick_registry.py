@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from brick_registry import BrickWorker, QueuedJoint, load_topology
+
+
+class RecordingJoint:
+    def __init__(self, delay=0):
+        self.calls = []
+        self.delay = delay
+
+    def _record(self, *call):
+        time.sleep(self.delay)
+        self.calls.append(call)
+
+    def on(self, speed, brake=True, block=False):
+        self._record('on', speed)
+
+    def on_to_position(self, speed, position, brake=True, block=True):
+        self._record('on_to_position', speed, position)
+
+    def stop(self):
+        self._record('stop')
+
+    def reset(self):
+        self._record('reset')
+
+
+class TestTopology(unittest.TestCase):
+
+    def test_default(self):
+        topology = load_topology()
+        self.assertEqual(topology['joints']['shoulder']['ports'], ['OUTPUT_B', 'OUTPUT_C'])
+        # the default is a copy
+        topology['bricks']['slave']['host'] = 'localhost'
+        self.assertNotEqual(load_topology()['bricks']['slave']['host'], 'localhost')
+
+    def test_unknown_brick(self):
+        topology = {'bricks': {'master': {}}, 'joints': {'rail': {'brick': 'rail', 'ports': ['OUTPUT_A']}}}
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as topology_file:
+            json.dump(topology, topology_file)
+        try:
+            with self.assertRaises(ValueError):
+                load_topology(topology_file.name)
+        finally:
+            os.unlink(topology_file.name)
+
+
+class TestBrickWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.workers = []
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.stop()
+            worker.join(1)
+
+    def worker(self, name):
+        worker = BrickWorker(name)
+        worker.start()
+        self.workers.append(worker)
+        return worker
+
+    def test_commands_are_deduplicated(self):
+        joint = RecordingJoint()
+        queued = QueuedJoint(joint, self.worker('master'))
+        for _ in range(10):
+            queued.on(25)
+            queued.worker.flush(1)
+        self.assertTrue(queued.is_running)
+        queued.stop()
+        self.assertFalse(queued.is_running)
+        self.assertTrue(queued.worker.flush(1))
+        self.assertEqual(joint.calls, [('on', 25), ('stop',)])
+
+    def test_latest_command_wins(self):
+        worker = self.worker('slave')
+        blocker = threading.Event()
+        worker.submit('blocker', blocker.wait)
+        joint = RecordingJoint()
+        queued = QueuedJoint(joint, worker)
+        queued.on(10)
+        queued.on(20)
+        queued.on_to_position(30, 100, True, False)
+        blocker.set()
+        self.assertTrue(worker.flush(1))
+        self.assertEqual(joint.calls, [('on_to_position', 30, 100)])
+        self.assertEqual(worker.coalesced, 2)
+
+    def test_call_waits_for_result(self):
+        joint = RecordingJoint()
+        queued = QueuedJoint(joint, self.worker('master'))
+        queued.on(10)
+        queued.reset()
+        self.assertEqual(joint.calls, [('on', 10), ('reset',)])
+        with self.assertRaises(ZeroDivisionError):
+            queued.worker.call(lambda: 1 / 0)
+
+    def test_bricks_run_in_parallel(self):
+        joints = [RecordingJoint(delay=0.2) for _ in range(3)]
+        queued = [QueuedJoint(joint, self.worker(str(index))) for index, joint in enumerate(joints)]
+        tic = time.monotonic()
+        for joint in queued:
+            joint.on(10)
+        for joint in queued:
+            joint.worker.flush(1)
+        self.assertLess(time.monotonic() - tic, 0.5)
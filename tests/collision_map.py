@@ -0,0 +1,116 @@
+import copy
+import os
+import tempfile
+import unittest
+from arm_control import ControlState, Speeds, control_tick
+from collision_map import GEOMETRY, CollisionGuard, build_map, clearance, load_map, load_or_build
+from input_replay import recording_joints
+
+
+def small_geometry():
+    geometry = copy.deepcopy(GEOMETRY)
+    # one degree per count, so encoder positions read as angles
+    geometry['joints'] = {
+        'shoulder': {'zero': 0, 'counts_per_degree': 1.0, 'range': [-90, 90], 'cells': 36},
+        'elbow': {'zero': 0, 'counts_per_degree': 1.0, 'range': [-90, 90], 'cells': 36},
+        'pitch': {'zero': 0, 'counts_per_degree': 1.0, 'range': [-90, 90], 'cells': 4},
+    }
+    return geometry
+
+
+class FakeJoint:
+    def __init__(self, position=0.0):
+        self.estimated_position = position
+
+
+class TestCollisionMap(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geometry = small_geometry()
+        cls.map = build_map(cls.geometry)
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.bin')
+        os.close(handle)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_forward_kinematics(self):
+        upright, reach = clearance(self.geometry, 90, 0, 0)
+        self.assertGreater(upright, 100)
+        self.assertAlmostEqual(reach, 0)
+        # shoulder level, forearm pointing straight down into the floor
+        down, reach = clearance(self.geometry, 0, 90, 0)
+        self.assertLess(down, 0)
+        self.assertAlmostEqual(reach, self.geometry['upper_arm'])
+
+    def test_lookup(self):
+        self.assertLess(self.map.clearance_mm(0, 85, 0), -50)
+        self.assertGreater(self.map.clearance_mm(0, -45, 0), 100)
+        self.assertTrue(self.map.is_extended(0, 0, 0))
+        self.assertFalse(self.map.is_extended(85, 0, 0))
+        # outside the map the edge cells are used
+        self.assertEqual(self.map.index(-1000, 1000, 0), self.map.index(-90, 89, 0))
+
+    def test_cache(self):
+        self.assertIsNone(load_map(self.path, self.geometry))
+        self.map.save(self.path)
+        cached = load_map(self.path, self.geometry)
+        self.assertEqual(cached.cells, self.map.cells)
+
+        # a different geometry doesn't use the cached map
+        changed = small_geometry()
+        changed['hand'] += 10
+        self.assertIsNone(load_map(self.path, changed))
+        rebuilt = load_or_build(self.path, changed)
+        self.assertEqual(load_map(self.path, changed).cells, rebuilt.cells)
+
+    def test_guard_needs_estimates(self):
+        joints = {'shoulder': FakeJoint(0), 'elbow': FakeJoint(15), 'pitch': object()}
+        with self.assertRaises(ValueError):
+            CollisionGuard(self.map, joints)
+
+    def test_guard(self):
+        joints = {'shoulder': FakeJoint(0), 'elbow': FakeJoint(15), 'pitch': FakeJoint(0)}
+        guard = CollisionGuard(self.map, joints, lookahead=30)
+        guard.update()
+        # elbow bending further down hits the floor, back up is fine
+        self.assertEqual(guard.limit('elbow', 50, target=90), 0)
+        self.assertEqual(guard.limit('elbow', -50, target=-90), -50)
+        self.assertEqual(guard.blocked, 1)
+        # already touching the floor, getting out is still allowed but deeper isn't
+        joints['elbow'].estimated_position = 50
+        guard.update()
+        self.assertEqual(guard.limit('elbow', -50, target=-90), -50)
+        self.assertEqual(guard.limit('elbow', 50, target=90), 0)
+        # the arm is extended, so the waist slows down
+        self.assertEqual(guard.limit('waist', 20), 10)
+        self.assertEqual(guard.limit('roll', 20), 20)
+
+        joints['shoulder'].estimated_position = 85
+        joints['elbow'].estimated_position = 0
+        guard.update()
+        self.assertEqual(guard.limit('waist', 20), 20)
+
+    def test_control_tick_with_guard(self):
+        log = []
+        joints = recording_joints(log)
+        joints['shoulder'].estimated_position = 0
+        joints['elbow'].estimated_position = 15
+        joints['pitch'].estimated_position = 0
+        joints['elbow'].minPos, joints['elbow'].maxPos = -90, 90
+        guard = CollisionGuard(self.map, joints)
+
+        state = ControlState()
+        state.elbow_speed = -80  # towards maxPos, down into the floor
+        control_tick(state, joints, Speeds(), guard)
+        self.assertEqual(log, [])
+        state.elbow_speed = 80
+        control_tick(state, joints, Speeds(), guard)
+        self.assertEqual(log, [('elbow', 'on_to_position', 80, -90)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+from brick_registry import BrickWorker, QueuedJoint
+from emergency_stop import emergency_stop
+
+
+class FakeJoint:
+    def __init__(self, stop_delay=0.0):
+        self.is_running = False
+        self.stop_delay = stop_delay
+        self.commands = []
+
+    def on(self, speed, brake=True, block=False):
+        self.commands.append('on')
+        self.is_running = True
+
+    def stop(self):
+        self.commands.append('stop')
+        time.sleep(self.stop_delay)
+        self.is_running = False
+
+    def reset(self):
+        self.commands.append('reset')
+        self.is_running = False
+
+
+class TestEmergencyStop(unittest.TestCase):
+
+    def setUp(self):
+        self.workers = [BrickWorker('master'), BrickWorker('slave')]
+        for worker in self.workers:
+            worker.start()
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.stop()
+            worker.join(1)
+
+    def test_stops_all_joints_in_parallel(self):
+        fakes = [FakeJoint(stop_delay=0.2) for _ in range(4)]
+        joints = dict(('joint{}'.format(i), QueuedJoint(fake, self.workers[i % 2])) for i, fake in enumerate(fakes))
+        for joint in joints.values():
+            joint.on(50)
+        self.assertTrue(self.workers[0].flush(1) and self.workers[1].flush(1))
+
+        report = emergency_stop(joints, deadline=1.0)
+        self.assertTrue(report.all_stopped)
+        self.assertEqual(set(report.stopped), set(joints))
+        self.assertEqual(report.escalated, {})
+        # four stops of 0.2s each, sent one after the other would take 0.8s
+        self.assertLess(report.elapsed, 0.5)
+        self.assertIn('All joints stopped', report.summary())
+        for joint in joints.values():
+            self.assertFalse(joint.is_running)
+
+    def test_queued_commands_are_dropped(self):
+        started = threading.Event()
+        blocker = threading.Event()
+
+        def in_flight():
+            started.set()
+            blocker.wait(0.2)
+
+        fake = FakeJoint()
+        joint = QueuedJoint(fake, self.workers[0])
+        self.workers[0].submit('in flight', in_flight)
+        started.wait(1)
+        joint.on(50)
+
+        report = emergency_stop({'waist': joint}, deadline=1.0)
+        blocker.set()
+        self.assertTrue(report.all_stopped)
+        self.assertTrue(self.workers[0].flush(1))
+        # the queued on() never went out, and the stop was repeated once the worker was idle
+        self.assertEqual(fake.commands, ['stop', 'stop'])
+
+    def test_escalates_to_reset(self):
+        stuck = FakeJoint(stop_delay=0.5)
+        stuck.is_running = True
+        joints = {'pitch': QueuedJoint(stuck, self.workers[1]), 'roll': QueuedJoint(FakeJoint(), self.workers[1])}
+
+        report = emergency_stop(joints, deadline=0.1, escalation_timeout=1.0)
+        self.assertEqual(list(report.stopped), ['roll'])
+        self.assertEqual(dict(report.escalated), {'pitch': True})
+        self.assertTrue(report.all_stopped)
+        self.assertIn('pitch reset', report.summary())
+        self.assertIn('reset', stuck.commands)
+
+    def test_failed_reset(self):
+        broken = FakeJoint()
+        broken.is_running = True
+
+        def fail():
+            raise IOError('gone')
+        broken.stop = fail
+        broken.reset = fail
+
+        report = emergency_stop({'spin': QueuedJoint(broken, self.workers[1])}, deadline=0.1)
+        self.assertFalse(report.all_stopped)
+        self.assertEqual(dict(report.escalated), {'spin': False})
+        self.assertIn('FAILED', report.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import threading
+import time
+import unittest
+from arm_control import ControlState, Speeds, control_tick
+from brick_registry import BrickWorker, QueuedJoint
+from grip import GRIP_CLOSED, GRIP_CLOSING, GRIP_HOLDING, GRIP_IDLE, GripDetector, GripJoint, read_sample
+from input_replay import recording_joints
+from sim_motor import SimulatedMotor
+from smart_motor import LimitedRangeMotor
+from trace_buffer import OP_HOLD, RECORD, TraceBuffer
+from tests import FakeClock
+
+
+class TestSimulatedLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.motor = SimulatedMotor(max_speed=1000, clock=self.clock)
+        self.motor.position = 500
+        self.motor.place_obstacle(200, compliance=20)
+
+    def test_free_running(self):
+        self.motor.on(-50)
+        self.clock.now += 0.1
+        self.assertEqual(self.motor.position, 450)
+        self.assertEqual(self.motor.speed, -500)
+        self.assertEqual(self.motor.duty_cycle, -50)
+
+    def test_squeezing_slows_down_and_pushes_harder(self):
+        self.motor.on(-50)
+        self.clock.now += 0.65
+        self.assertLess(self.motor.position, 200)
+        self.assertGreaterEqual(self.motor.position, 180)
+        self.assertGreater(self.motor.speed, -250)
+        self.assertLess(self.motor.duty_cycle, -75)
+        self.clock.now += 1
+        self.assertEqual(self.motor.position, 180)
+        self.assertEqual(self.motor.speed, 0)
+        self.assertEqual(self.motor.duty_cycle, -100)
+
+    def test_run_direct_squeezes_less(self):
+        self.motor.on(-50)
+        self.clock.now += 2
+        self.motor.run_direct(duty_cycle_sp=-30)
+        self.clock.now += 0.1
+        self.assertEqual(self.motor.position, 194)
+        self.assertEqual(self.motor.speed, 0)
+        self.assertEqual(self.motor.duty_cycle, -30)
+
+    def test_backing_off(self):
+        self.motor.on(-50)
+        self.clock.now += 2
+        self.motor.on(50)
+        self.clock.now += 0.1
+        self.assertEqual(self.motor.position, 230)
+        self.assertEqual(self.motor.speed, 500)
+        self.assertEqual(self.motor.duty_cycle, 50)
+
+
+class TestGripDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.detector = GripDetector(clock=self.clock)
+        self.detector.start(500)
+
+    def update(self, duty_cycle, speed, interval=0.01):
+        self.clock.now += interval
+        return self.detector.update(duty_cycle, speed)
+
+    def test_startup_is_ignored(self):
+        for _ in range(5):
+            self.assertFalse(self.update(100, 0))
+        self.clock.now += 0.2
+        for _ in range(3):
+            self.assertFalse(self.update(-100, 0))
+        self.assertTrue(self.update(100, 0))
+
+    def test_needs_consecutive_samples(self):
+        self.clock.now += 0.2
+        self.assertFalse(self.update(100, 100))
+        self.assertFalse(self.update(100, 100))
+        self.assertFalse(self.update(100, 100))
+        # moving freely again
+        self.assertFalse(self.update(100, 400))
+        self.assertFalse(self.update(100, 100))
+        self.assertFalse(self.update(100, 100))
+        self.assertFalse(self.update(100, 100))
+        self.assertTrue(self.update(100, 100))
+
+    def test_slow_samples(self):
+        # one sample every 50 ms, two of them are plenty
+        self.clock.now += 0.2
+        self.assertFalse(self.update(100, 100, 0.05))
+        self.assertTrue(self.update(100, 100, 0.05))
+
+    def test_thresholds(self):
+        self.clock.now += 0.2
+        for _ in range(5):
+            # accelerating under load, or pushing lightly
+            self.assertFalse(self.update(100, 200))
+            self.assertFalse(self.update(60, 0))
+
+
+class TestGripJoint(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.motor = SimulatedMotor(max_speed=1000, min_stop=-10, max_stop=1010, clock=self.clock)
+        joint = LimitedRangeMotor(self.motor, name='grabber')
+        joint._minPos = 0
+        joint._maxPos = 1000
+        self.motor.position = 800
+        self.grip = GripJoint(joint, hold_duty=25, clock=self.clock)
+
+    def close_for(self, seconds, interval=0.01):
+        self.grip.on(-50, False)
+        for _ in range(int(seconds / interval)):
+            self.clock.now += interval
+            self.grip.sample()
+
+    def test_holds_on(self):
+        self.motor.place_obstacle(400)
+        self.close_for(1.2)
+        self.assertEqual(self.grip.state, GRIP_HOLDING)
+        self.assertEqual(self.grip.holds, 1)
+        self.assertEqual(self.motor.commands, ['run-forever', 'run-direct'])
+        self.assertEqual(self.motor.duty_cycle, -25)
+        self.assertFalse(self.grip.is_running)
+        self.assertGreater(self.motor.position, 380)
+
+        # letting go of the button keeps holding
+        self.grip.stop()
+        self.assertEqual(self.grip.state, GRIP_HOLDING)
+        self.assertEqual(self.motor.duty_cycle, -25)
+
+        self.grip.on(50, False)
+        self.assertEqual(self.grip.state, GRIP_IDLE)
+        self.clock.now += 0.1
+        self.assertGreater(self.motor.position, 420)
+
+    def test_closed_without_object(self):
+        self.close_for(2)
+        self.assertEqual(self.grip.state, GRIP_CLOSED)
+        self.assertEqual(self.grip.empty, 1)
+        self.assertEqual(self.motor.commands[-1], 'stop')
+        self.assertFalse(self.grip.is_running)
+
+    def test_stop_while_closing(self):
+        self.motor.place_obstacle(400)
+        self.close_for(0.1)
+        self.grip.stop()
+        self.assertEqual(self.grip.state, GRIP_IDLE)
+        self.clock.now += 1
+        self.grip.sample()
+        self.assertEqual(self.grip.samples, 10)
+        self.assertEqual(self.motor.commands, ['run-forever', 'stop'])
+
+    def test_slow_samples(self):
+        self.motor.place_obstacle(400)
+        self.close_for(1.2, interval=0.08)
+        self.assertEqual(self.grip.state, GRIP_HOLDING)
+        self.assertGreater(self.motor.position, 370)
+
+    def test_release(self):
+        self.motor.place_obstacle(400)
+        self.close_for(1.2)
+        self.grip.release()
+        self.assertEqual(self.grip.state, GRIP_IDLE)
+        self.assertEqual(self.motor.duty_cycle, 0)
+
+
+class TestGripJointControlLoop(unittest.TestCase):
+
+    def test_sampler_thread(self):
+        motor = SimulatedMotor(max_speed=1000, min_stop=-10, max_stop=1010)
+        joint = LimitedRangeMotor(motor, name='grabber')
+        joint._minPos = 0
+        joint._maxPos = 1000
+        motor.position = 500
+        motor.place_obstacle(300)
+        worker = BrickWorker('test')
+        worker.start()
+        trace = TraceBuffer(64)
+        joints = recording_joints([])
+        readers = set()
+
+        def read(motor):
+            readers.add(threading.current_thread().name)
+            return read_sample(motor)
+
+        joints['grabber'] = grip = GripJoint(QueuedJoint(joint, worker, trace=trace, joint_id=6), read=read)
+        grip.start_sampling()
+        state = ControlState()
+        state.grabber_close = True
+        speeds = Speeds()
+        try:
+            deadline = time.monotonic() + 2
+            while grip.state != GRIP_HOLDING and time.monotonic() < deadline:
+                control_tick(state, joints, speeds)
+                self.assertIn(grip.state, (GRIP_CLOSING, GRIP_HOLDING))
+                time.sleep(0.005)
+            self.assertEqual(grip.state, GRIP_HOLDING)
+            state.grabber_close = False
+            control_tick(state, joints, speeds)
+            self.assertTrue(worker.flush(1))
+        finally:
+            grip.stop_sampling()
+            worker.stop()
+            worker.join()
+        self.assertEqual(motor.commands, ['run-forever', 'run-direct'])
+        self.assertEqual(motor.duty_cycle_sp, -30)
+        self.assertEqual(readers, {worker.name})
+        self.assertIn((OP_HOLD, -30.0), [(record[2], record[4]) for record in RECORD.iter_unpack(trace.snapshot())])
+
+
+if __name__ == '__main__':
+    unittest.main()
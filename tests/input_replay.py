@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from arm_control import ACTION_DEBUG, ACTION_QUIT, ControlState, handle_event
+from input_replay import EventRecorder, ReplayEvent, read_events, replay, replay_commands
+from tests import FakeClock
+
+
+# a short session: shoulder up, waist left then right, roll, grabber open and close, elbow, then PS
+SESSION = [
+    ReplayEvent(0, 0, 3, 0, 255),
+    ReplayEvent(0, 10000, 1, 310, 1),
+    ReplayEvent(0, 20000, 1, 308, 1),
+    ReplayEvent(0, 30000, 1, 317, 1),
+    ReplayEvent(0, 40000, 3, 0, 128),
+    ReplayEvent(0, 50000, 1, 310, 0),
+    ReplayEvent(0, 60000, 1, 311, 1),
+    ReplayEvent(0, 70000, 1, 308, 0),
+    ReplayEvent(0, 80000, 1, 317, 0),
+    ReplayEvent(0, 90000, 1, 318, 1),
+    ReplayEvent(0, 95000, 1, 318, 0),
+    ReplayEvent(0, 100000, 3, 3, 0),
+    ReplayEvent(0, 110000, 1, 311, 0),
+    ReplayEvent(0, 120000, 1, 316, 1),
+    ReplayEvent(1, 0, 1, 304, 1),  # after PS, must not be handled
+]
+
+EXPECTED_COMMANDS = [
+    ('shoulder', 'on_to_position', -80, 0),
+    ('waist', 'on', -25),
+    ('roll', 'on_to_position', 25, -400),
+    ('grabber', 'on', 50),
+    ('shoulder', 'stop'),
+    ('waist', 'stop'),
+    ('waist', 'on', 25),
+    ('roll', 'stop'),
+    ('grabber', 'stop'),
+    ('grabber', 'on', -50),
+    ('grabber', 'stop'),
+    ('elbow', 'on_to_position', -80, 0),
+    ('waist', 'stop'),
+]
+
+
+class TestInputReplay(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.evrec')
+        os.close(handle)
+        recorder = EventRecorder(self.path)
+        # recording passes the events through untouched
+        self.assertEqual(list(recorder.wrap(SESSION)), SESSION)
+        recorder.close()
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_record_and_read(self):
+        events = read_events(self.path)
+        self.assertEqual(events, SESSION)
+        self.assertEqual(events[-1].timestamp(), 1.0)
+
+    def test_not_a_session(self):
+        with open(self.path, 'wb') as session_file:
+            session_file.write(b'EV3T\x01')
+        with self.assertRaises(ValueError):
+            read_events(self.path)
+
+    def test_command_sequence(self):
+        self.assertEqual(replay_commands(self.path), EXPECTED_COMMANDS)
+
+    def test_command_sequence_without_grabber(self):
+        expected = [command for command in EXPECTED_COMMANDS if command[0] != 'grabber']
+        self.assertEqual(replay_commands(self.path, grabber=False), expected)
+
+    def test_realtime_replay_keeps_pace(self):
+        clock = FakeClock(100.0)
+        times = [clock() for _ in replay(SESSION, clock=clock, sleep=clock.sleep)]
+        self.assertEqual([round(t - 100.0, 6) for t in times], [event.timestamp() for event in SESSION])
+
+        clock = FakeClock(100.0)
+        times = [clock() for _ in replay(SESSION, speed=2.0, clock=clock, sleep=clock.sleep)]
+        self.assertAlmostEqual(times[-1] - times[0], 0.5)
+
+    def test_fast_replay_does_not_sleep(self):
+        clock = FakeClock(100.0)
+        list(replay(SESSION, realtime=False, clock=clock, sleep=clock.sleep))
+        self.assertEqual(clock.now, 100.0)
+
+    def test_handle_event(self):
+        state = ControlState()
+        handle_event(state, ReplayEvent(0, 0, 1, 307, 1))  # Triangle
+        self.assertTrue(state.pitch_up)
+        handle_event(state, ReplayEvent(0, 0, 1, 304, 1))  # X cancels Triangle
+        self.assertFalse(state.pitch_up)
+        self.assertTrue(state.pitch_down)
+        handle_event(state, ReplayEvent(0, 0, 1, 304, 2))  # key repeat changes nothing
+        self.assertTrue(state.pitch_down)
+
+        self.assertEqual(handle_event(state, ReplayEvent(0, 0, 1, 315, 1)), ACTION_DEBUG)
+        self.assertIsNone(handle_event(state, ReplayEvent(0, 0, 1, 315, 0)))
+        self.assertTrue(state.running)
+        self.assertEqual(handle_event(state, ReplayEvent(0, 0, 1, 316, 1)), ACTION_QUIT)
+        self.assertFalse(state.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
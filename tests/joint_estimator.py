@@ -0,0 +1,94 @@
+import unittest
+from joint_estimator import JointEstimator
+from sim_motor import SimulatedMotor
+from smart_motor import LimitedRangeMotor
+from tests import FakeClock
+
+
+class TestJointEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.position = 0
+        self.estimator = JointEstimator(lambda: self.position, max_speed=1000, clock=self.clock)
+        self.estimator.update()
+
+    def test_prediction(self):
+        self.estimator.command(10)
+        self.clock.now = 2.0
+        self.assertEqual(self.estimator.position, 200)
+        low, high = self.estimator.interval_bounds()
+        self.assertLess(low, 200)
+        self.assertGreater(high, 200)
+
+    def test_run_to_position_stops_at_target(self):
+        self.estimator.command(-50, target=100)
+        self.clock.now = 5.0
+        self.assertEqual(self.estimator.position, 100)
+
+    def test_no_reads_while_standing_still(self):
+        self.clock.now = 60.0
+        self.assertFalse(self.estimator.update())
+        self.assertEqual(self.estimator.reads, 1)
+
+    def test_interval_adapts(self):
+        self.estimator.command(10)
+        interval = self.estimator.interval
+        # accurate predictions make reads less frequent
+        for step in range(1, 6):
+            self.clock.now = step * 0.2
+            self.position = step * 20
+            self.estimator.correct(self.position)
+        self.assertGreater(self.estimator.interval, interval)
+
+        # a large error makes them more frequent again
+        interval = self.estimator.interval
+        self.clock.now += 0.2
+        self.estimator.correct(self.position)
+        self.assertLess(self.estimator.interval, interval)
+
+    def test_large_uncertainty_forces_read(self):
+        self.estimator.command(100)
+        self.clock.now = 0.01
+        self.assertTrue(self.estimator.due())
+
+
+class TestSmartMotorEstimator(unittest.TestCase):
+
+    def test_reads_are_reduced(self):
+        clock = FakeClock()
+        motor = SimulatedMotor(max_speed=1000, clock=clock)
+        joint = LimitedRangeMotor(motor, name='elbow')
+        joint.enable_estimator(clock=clock)
+        joint.on_to_position(10, joint.maxPos, True, False)
+
+        ticks = 500
+        for tick in range(ticks):
+            clock.now = tick * 0.01
+            joint.refresh_estimate()
+            self.assertLess(abs(joint.estimated_position - motor.position), 30)
+        self.assertLess(joint.estimator.reads, ticks / 5)
+
+    def test_reads_near_limits(self):
+        clock = FakeClock()
+        motor = SimulatedMotor(max_speed=1000, clock=clock)
+        joint = LimitedRangeMotor(motor, name='elbow')
+        joint._maxPos = 200
+        joint.enable_estimator(clock=clock)
+        joint.on_to_position(50, joint.maxPos, True, False)
+        clock.now = 0.35
+        self.assertTrue(joint.refresh_estimate())
+
+    def test_reads_near_limits_are_rate_limited(self):
+        clock = FakeClock()
+        motor = SimulatedMotor(max_speed=1000, clock=clock)
+        joint = LimitedRangeMotor(motor, name='elbow')
+        joint._maxPos = 200
+        joint.enable_estimator(clock=clock)
+        joint.on_to_position(50, joint.maxPos, True, False)
+        clock.now = 0.35
+        # a control loop which never sleeps
+        for tick in range(1000):
+            clock.now += 0.0001
+            joint.refresh_estimate()
+        self.assertLessEqual(joint.estimator.reads, 1 + 0.1 / 0.05 + 1)
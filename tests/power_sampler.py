@@ -0,0 +1,53 @@
+import unittest
+from power_sampler import MAX_COMPENSATION, PowerSampler
+
+
+class FakePowerSupply:
+    def __init__(self, volts, amps=0.5):
+        self.measured_volts = volts
+        self.measured_amps = amps
+
+
+class BrokenPowerSupply:
+    @property
+    def measured_volts(self):
+        raise EOFError('connection closed by peer')
+
+
+class TestPowerSampler(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        supply = FakePowerSupply(8.0)
+        sampler = PowerSampler({'local': supply}, history=3)
+        for volts in (8.0, 7.9, 7.8, 7.7):
+            supply.measured_volts = volts
+            sampler.sample()
+        self.assertEqual([sample[1] for sample in sampler.history['local']], [7.9, 7.8, 7.7])
+        self.assertEqual(sampler.latest('local')[1:], (7.7, 0.5))
+
+    def test_no_compensation_by_default(self):
+        sampler = PowerSampler({'local': FakePowerSupply(6.0)})
+        sampler.sample()
+        self.assertEqual(sampler.speed_factor(), 1.0)
+
+    def test_compensation_uses_emptiest_battery(self):
+        sampler = PowerSampler({'local': FakePowerSupply(8.0), 'remote': FakePowerSupply(7.0)}, nominal_volts=7.7)
+        sampler.sample()
+        self.assertAlmostEqual(sampler.speed_factor(), 1.1)
+
+    def test_compensation_is_limited(self):
+        sampler = PowerSampler({'local': FakePowerSupply(9.0)}, nominal_volts=8.0)
+        sampler.sample()
+        self.assertEqual(sampler.speed_factor(), 1.0)
+
+        sampler = PowerSampler({'local': FakePowerSupply(4.0)}, nominal_volts=8.0)
+        sampler.sample()
+        self.assertEqual(sampler.speed_factor(), MAX_COMPENSATION)
+
+    def test_read_errors_are_counted(self):
+        calls = []
+        sampler = PowerSampler({'remote': BrokenPowerSupply()}, on_sample=calls.append)
+        sampler.sample()
+        self.assertEqual(sampler.errors, 1)
+        self.assertIsNone(sampler.latest('remote'))
+        self.assertEqual(calls, [sampler])
@@ -0,0 +1,90 @@
+import signal
+import time
+import unittest
+import shared_state
+from arm_control import ACTION_DEBUG, ControlState
+from input_replay import ReplayEvent
+from shared_state import SharedControlState, input_loop, start_input_process
+from stick_filter import DEFAULT_CHAIN, build_filter
+
+
+class TestSharedControlState(unittest.TestCase):
+
+    def check_roundtrip(self, shared):
+        state = ControlState()
+        reader = ControlState()
+        self.assertIsNone(shared.read(reader))
+        self.assertEqual(shared.updates, 0)
+
+        state.shoulder_speed = -40.0
+        state.pitch_down = True
+        state.grabber_close = True
+        shared.publish(state, stamp=12.5, action=ACTION_DEBUG)
+        self.assertEqual(shared.read(reader), ACTION_DEBUG)
+        # actions are only returned once
+        self.assertIsNone(shared.read(reader))
+        self.assertEqual(shared.stamp, 12.5)
+        self.assertEqual(shared.updates, 1)
+        self.assertEqual(reader.shoulder_speed, -40.0)
+        self.assertTrue(reader.pitch_down and reader.grabber_close and reader.running)
+        self.assertFalse(reader.pitch_up or reader.waist_left)
+
+        state.running = False
+        shared.publish(state)
+        shared.read(reader)
+        self.assertFalse(reader.running)
+
+    def test_roundtrip(self):
+        shared = SharedControlState()
+        try:
+            self.check_roundtrip(shared)
+        finally:
+            shared.close()
+
+    def test_mmap_fallback(self):
+        original = shared_state.shared_memory
+        shared_state.shared_memory = None
+        try:
+            shared = SharedControlState()
+        finally:
+            shared_state.shared_memory = original
+        try:
+            self.check_roundtrip(shared)
+        finally:
+            shared.close()
+
+    def test_input_process(self):
+        shared = SharedControlState()
+        events = [ReplayEvent(0, 0, 1, 310, 1), ReplayEvent(0, 0, 3, 3, 0), ReplayEvent(0, 0, 1, 316, 1)]
+        process = start_input_process(iter(events), shared)
+        try:
+            process.join(5)
+            self.assertEqual(process.exitcode, 0)
+            state = ControlState()
+            shared.read(state)
+            self.assertTrue(state.waist_left)
+            self.assertEqual(state.elbow_speed, -80)
+            self.assertFalse(state.running)
+            self.assertEqual(shared.updates, 3)
+            self.assertLessEqual(shared.stamp, time.monotonic())
+        finally:
+            process.terminate()
+            shared.close()
+
+    def test_input_loop_logs_filters(self):
+        shared = SharedControlState()
+        filters = {'elbow': build_filter(DEFAULT_CHAIN)}
+        events = [ReplayEvent(0, 0, 3, 3, 0), ReplayEvent(0, 0, 3, 3, 1), ReplayEvent(0, 0, 1, 316, 1)]
+        # input_loop ignores CTRL+C, it normally runs in a process of its own
+        handler = signal.getsignal(signal.SIGINT)
+        try:
+            with self.assertLogs('shared_state', 'INFO') as logs:
+                input_loop(iter(events), shared, filters=filters)
+        finally:
+            signal.signal(signal.SIGINT, handler)
+            shared.close()
+        self.assertEqual(logs.output, ['INFO:shared_state:Elbow stick: 1 of 2 updates suppressed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+from sim_motor import SimulatedMotor
+from slave_controller import RemoteJoint, SlaveController
+from smart_motor import LimitedRangeMotor
+from tests import FakeClock
+
+
+class TestSlaveController(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.motor = SimulatedMotor('outA', max_speed=1000, clock=self.clock)
+        self.controller = SlaveController({'roll': LimitedRangeMotor(self.motor, name='roll')}, clock=self.clock,
+                                          heartbeat_timeout=0.5)
+        self.controller.heartbeat()
+
+    def advance(self, seconds, ticks=10):
+        for _ in range(ticks):
+            self.clock.now += seconds / ticks
+            self.controller.heartbeat()
+            self.controller.tick()
+
+    def test_velocity_command_sent_once(self):
+        self.controller.set_velocity('roll', 10)
+        self.controller.tick()
+        self.advance(1)
+        self.assertEqual(self.motor.commands, ['run-to-abs-pos'])
+        self.assertEqual(self.motor.position, 100)
+
+    def test_velocity_stops_at_soft_limit(self):
+        self.controller.set_velocity('roll', -100)
+        self.advance(10)
+        self.assertEqual(self.motor.position, -5000)
+        self.assertFalse(self.motor.is_running)
+
+    def test_target_is_clamped(self):
+        self.controller.set_target('roll', 9000, 100)
+        self.advance(10)
+        self.assertEqual(self.motor.position, 5000)
+        self.assertFalse(self.controller.joints['roll'].is_running)
+
+    def test_heartbeat_timeout_stops_motors(self):
+        self.controller.set_velocity('roll', 10)
+        self.controller.tick()
+        self.clock.now += 0.6
+        self.controller.tick()
+        self.assertTrue(self.controller.failsafe)
+        self.assertFalse(self.motor.is_running)
+        self.assertEqual(self.motor.commands, ['run-to-abs-pos', 'stop'])
+
+        # setpoints are ignored until the master is back, and stale ones are not resumed
+        self.controller.set_velocity('roll', 20)
+        self.controller.heartbeat()
+        self.controller.tick()
+        self.assertFalse(self.motor.is_running)
+
+    def test_failsafe_stops_once(self):
+        controller = SlaveController({'roll': LimitedRangeMotor(self.motor, name='roll')}, clock=self.clock)
+        # no heartbeat yet, failsafe from the start
+        for _ in range(50):
+            self.clock.now += 0.02
+            controller.tick()
+        self.assertTrue(controller.failsafe)
+        self.assertEqual(controller.commands, 0)
+        self.assertEqual(self.motor.commands, [])
+
+    def test_unknown_joint(self):
+        with self.assertRaises(ValueError):
+            self.controller.set_velocity('elbow', 10)
+
+    def test_remote_joint_deduplicates_commands(self):
+        sent = []
+
+        class Client:
+            def limits(self, name):
+                return (-100, 100, 0)
+
+            def set_velocity(self, name, speed):
+                sent.append(('velocity', name, speed))
+
+            def set_target(self, name, position, speed):
+                sent.append(('target', name, position, speed))
+
+        joint = RemoteJoint(Client(), 'roll')
+        for _ in range(5):
+            joint.on_to_position(25, joint.minPos, True, False)
+        self.assertTrue(joint.is_running)
+        joint.stop()
+        self.assertFalse(joint.is_running)
+        self.assertEqual(sent, [('target', 'roll', -100, 25), ('velocity', 'roll', 0)])
+
+    def test_remote_joint_target_zero(self):
+        sent = []
+
+        class Client:
+            def limits(self, name):
+                return (-100, 100, 0)
+
+            def set_target(self, name, position, speed):
+                sent.append(('target', name, position, speed))
+
+        joint = RemoteJoint(Client(), 'roll')
+        for _ in range(5):
+            joint.on_to_position(25, 0, True, False)
+        self.assertTrue(joint.is_running)
+        self.assertEqual(sent, [('target', 'roll', 0, 25)])
@@ -0,0 +1,120 @@
+import unittest
+from arm_control import ControlState, Speeds, control_tick
+from input_replay import RecordingJoint, recording_joints
+from sim_motor import SimulatedMotor
+from smart_motor import LimitedRangeMotor
+from soft_limits import SoftLimits
+from tests import FakeClock
+
+
+class TestSoftLimits(unittest.TestCase):
+
+    def test_stopping_distance(self):
+        limits = SoftLimits(max_speed=1000)
+        self.assertEqual(limits.stopping_distance(0), 0)
+        self.assertAlmostEqual(limits.stopping_distance(-20), limits.stopping_distance(20))
+        # braking distance grows with the square of the speed
+        self.assertGreater(limits.stopping_distance(80), 4 * limits.stopping_distance(20))
+
+    def test_limit(self):
+        limits = SoftLimits(max_speed=1000)
+        self.assertEqual(limits.limit(40, 0, 0, -1000, 1000), 40)
+        self.assertEqual(limits.limit(40, 900, 900, -1000, 1000), 20)
+        self.assertEqual(limits.limit(40, 999, 999, -1000, 1000), 0)
+        self.assertEqual(limits.limit(40, 1005, 1005, -1000, 1000), 0)
+        # moving away from a limit is always fine
+        self.assertEqual(limits.limit(-40, 1005, 1005, -1000, 1000), -40)
+        self.assertEqual(limits.limit(-40, -900, -900, -1000, 1000), -20)
+        # uncertain positions stop early
+        self.assertEqual(limits.limit(40, 850, 1000, -1000, 1000), 0)
+        self.assertGreater(limits.limit(40, 850, 850, -1000, 1000), 0)
+
+    def test_counters(self):
+        limits = SoftLimits(max_speed=1000)
+        self.assertEqual(limits.command(40, 999, 999, -1000, 1000), 0)
+        self.assertEqual(limits.stops, 1)
+        self.assertEqual(limits.command(40, 0, 0, -1000, 1000), 40)
+        self.assertIsNone(limits.check(100, 100, -1000, 1000))
+        self.assertEqual(limits.check(900, 900, -1000, 1000), 20)
+        self.assertEqual(limits.slowdowns, 1)
+        limits.clear()
+        self.assertFalse(limits.active)
+        self.assertIsNone(limits.check(999, 999, -1000, 1000))
+
+
+class TestSmartMotorSoftLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        # hard stops well beyond the soft limits
+        self.motor = SimulatedMotor(max_speed=1000, min_stop=-800, max_stop=800, clock=self.clock)
+        self.joint = LimitedRangeMotor(self.motor, name='pitch')
+        self.joint._minPos = -500
+        self.joint._maxPos = 500
+
+    def run_for(self, seconds, interval=0.01):
+        for _ in range(int(seconds / interval)):
+            self.clock.now += interval
+            self.joint.refresh_estimate()
+
+    def check_stops_ahead_of_limits(self):
+        self.joint.on(50, False)
+        self.run_for(3)
+        self.assertFalse(self.motor.is_running)
+        self.assertLessEqual(self.motor.position, 500)
+        self.assertGreater(self.motor.position, 450)
+        # ramping down and stopping took a few commands, not one per pass
+        self.assertLessEqual(len(self.motor.commands), 6)
+        self.assertEqual(self.joint.soft_limits.stops, 1)
+
+        # at the limit, only moves away from it go through
+        self.joint.on(50, False)
+        self.assertFalse(self.motor.is_running)
+        self.joint.on(-50, False)
+        self.run_for(4)
+        self.assertFalse(self.motor.is_running)
+        self.assertGreaterEqual(self.motor.position, -500)
+        self.assertLess(self.motor.position, -450)
+
+    def test_with_estimator(self):
+        self.joint.enable_estimator(clock=self.clock)
+        self.joint.enable_soft_limits()
+        self.check_stops_ahead_of_limits()
+        self.assertLess(self.joint.estimator.reads, 100)
+
+    def test_without_estimator(self):
+        self.joint.enable_soft_limits()
+        self.check_stops_ahead_of_limits()
+
+    def test_stop_ends_the_move(self):
+        self.joint.enable_soft_limits()
+        self.joint.on(50, False)
+        self.joint.stop()
+        commands = len(self.motor.commands)
+        self.run_for(1)
+        self.assertEqual(len(self.motor.commands), commands)
+        self.assertFalse(self.joint.soft_limits.active)
+
+
+class SoftLimitedJoint(RecordingJoint):
+    soft_limits = object()
+
+
+class TestControlTick(unittest.TestCase):
+
+    def test_speed_commands(self):
+        log = []
+        joints = recording_joints(log)
+        joints['elbow'] = SoftLimitedJoint('elbow', log, -2800, 0)
+        joints['roll'] = SoftLimitedJoint('roll', log, -400, 400)
+        state = ControlState()
+        state.elbow_speed = 30
+        state.roll_right = True
+        state.spin_left = True
+        control_tick(state, joints, Speeds())
+        # elbow heads for minPos with a positive stick speed
+        self.assertEqual(log, [('elbow', 'on', -30), ('roll', 'on', 25), ('spin', 'on_to_position', 25, -1000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
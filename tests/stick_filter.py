@@ -0,0 +1,88 @@
+import random
+import unittest
+from arm_control import ControlState, handle_event
+from input_replay import ReplayEvent
+from stick_filter import DEFAULT_CHAIN, Hysteresis, OneEuro, Quantize, build_filter
+
+
+class TestStickFilter(unittest.TestCase):
+
+    def test_quantize(self):
+        quantize = Quantize(5)
+        self.assertEqual([quantize(value, 0) for value in (12, 12.5, 14, -12, -13, 0.4)], [10, 15, 15, -10, -15, 0])
+
+    def test_hysteresis(self):
+        hysteresis = Hysteresis(3)
+        self.assertEqual([hysteresis(value, 0) for value in (40, 42, 38, 43, 41)], [40, 40, 40, 43, 43])
+
+    def test_one_euro(self):
+        one_euro = OneEuro(min_cutoff=1.0, beta=0.01)
+        noise = random.Random(1)
+        outputs = [one_euro(40 + noise.uniform(-2, 2), i * 0.004) for i in range(250)]
+        # held stick: the noise mostly goes away
+        self.assertLess(max(outputs[50:]) - min(outputs[50:]), 1.5)
+        # a fast move is followed within a few reports
+        for i in range(250, 265):
+            value = one_euro(80, i * 0.004)
+        self.assertGreater(value, 75)
+
+    def test_release_passes_through(self):
+        axis = build_filter(DEFAULT_CHAIN)
+        for i in range(100):
+            axis(60, i * 0.004)
+        self.assertEqual(axis(0, 0.4), 0)
+        # the chain starts over, no smoothing from before the release
+        self.assertEqual(axis(-30, 0.404), -30)
+
+    def test_no_lag_when_events_stop(self):
+        # a stick held still or pushed all the way sends no more events, the last output has to be right
+        state = ControlState({'elbow': build_filter(DEFAULT_CHAIN)})
+        for i, value in enumerate((150, 180, 220, 255)):
+            handle_event(state, ReplayEvent(0, i * 4000, 3, 3, value))
+        self.assertEqual(state.elbow_speed, 80)
+        handle_event(state, ReplayEvent(0, 20000, 3, 3, 200))
+        self.assertEqual(state.elbow_speed, 45)
+
+    def test_full_deflection_passes_through(self):
+        axis = build_filter([('one_euro', {'min_cutoff': 1.0, 'beta': 0.01})])
+        axis(20, 0)
+        self.assertLess(axis(60, 0.004), 60)
+        self.assertEqual(axis(80, 0.008), 80)
+        self.assertEqual(axis(-80, 0.012), -80)
+
+    def test_reversal_never_drives_the_wrong_way(self):
+        axis = build_filter([('low_pass', {'alpha': 0.1})])
+        axis(60, 0)
+        self.assertEqual(axis(-20, 0.004), 0)
+
+    def test_suppressed(self):
+        axis = build_filter(DEFAULT_CHAIN)
+        for i, value in enumerate((40, 41, 39, 40, 41, 40)):
+            axis(value, i * 0.004)
+        self.assertEqual(axis.updates, 6)
+        self.assertEqual(axis.suppressed, 5)
+
+    def test_unknown_filter(self):
+        with self.assertRaises(ValueError):
+            build_filter([('kalman', {})])
+
+    def test_handle_event(self):
+        noise = random.Random(2)
+        events = [ReplayEvent(0, i * 4000, 3, 3, 200 + noise.randint(-3, 3)) for i in range(200)]
+        unfiltered = ControlState()
+        filtered = ControlState({'elbow': build_filter(DEFAULT_CHAIN)})
+        unfiltered_speeds, filtered_speeds = set(), set()
+        for event in events:
+            handle_event(unfiltered, event)
+            handle_event(filtered, event)
+            unfiltered_speeds.add(unfiltered.elbow_speed)
+            filtered_speeds.add(filtered.elbow_speed)
+        self.assertGreater(len(unfiltered_speeds), 3)
+        self.assertEqual(len(filtered_speeds), 1)
+
+        handle_event(filtered, ReplayEvent(0, 800000, 3, 3, 128))
+        self.assertEqual(filtered.elbow_speed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
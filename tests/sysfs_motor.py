@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sysfs_motor import SysfsMotor, DeviceNotFound, create_fake_motor
+
+
+class TestSysfsMotor(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = create_fake_motor(self.root, 0, 'ev3-ports:outA', max_speed=1000)
+        create_fake_motor(self.root, 1, 'ev3-ports:outB')
+        self.motor = SysfsMotor('outA', sysfs_root=self.root)
+
+    def tearDown(self):
+        self.motor.close()
+        shutil.rmtree(self.root)
+
+    def read_attribute(self, name):
+        with open(os.path.join(self.path, name)) as attribute_file:
+            return attribute_file.read()
+
+    def write_attribute(self, name, value):
+        path = os.path.join(self.path, name)
+        os.chmod(path, 0o664)
+        with open(path, 'w') as attribute_file:
+            attribute_file.write(value)
+
+    def test_find_by_address(self):
+        other = SysfsMotor('ev3-ports:outB', sysfs_root=self.root)
+        self.assertTrue(other._path.endswith('motor1'))
+        other.close()
+
+    def test_not_found(self):
+        with self.assertRaises(DeviceNotFound):
+            SysfsMotor('outD', sysfs_root=self.root)
+
+    def test_on(self):
+        self.motor.on(-25, brake=False)
+        self.assertEqual(self.read_attribute('speed_sp'), '-250')
+        self.assertEqual(self.read_attribute('stop_action'), 'coast')
+        self.assertEqual(self.read_attribute('command'), 'run-forever')
+
+    def test_on_to_position(self):
+        self.motor.on_to_position(50, 1234.4, True, False)
+        self.assertEqual(self.read_attribute('speed_sp'), '500')
+        self.assertEqual(self.read_attribute('position_sp'), '1234')
+        self.assertEqual(self.read_attribute('stop_action'), 'hold')
+        self.assertEqual(self.read_attribute('command'), 'run-to-abs-pos')
+
+    def test_shorter_values_overwrite(self):
+        self.motor.on(100)
+        self.motor.on(1)
+        self.motor.stop()
+        self.assertEqual(self.read_attribute('speed_sp'), '10')
+        self.assertEqual(self.read_attribute('command'), 'stop')
+
+    def test_invalid_speed(self):
+        with self.assertRaises(ValueError):
+            self.motor.on(101)
+
+    def test_reads(self):
+        self.write_attribute('position', '-42\n')
+        self.write_attribute('state', 'running stalled\n')
+        self.assertEqual(self.motor.position, -42)
+        self.assertEqual(self.motor.state, ['running', 'stalled'])
+        self.assertTrue(self.motor.is_running)
+        self.assertTrue(self.motor.wait_until('stalled', timeout=10))
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import threading
+import unittest
+from trace_buffer import OP_INPUT, OP_MARK, OP_ON, OP_TO_POSITION, TraceBuffer, format_record, read_dump
+from tests import FakeClock
+
+
+class TestTraceBuffer(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.trace')
+        os.close(handle)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_dump_and_read(self):
+        trace = TraceBuffer(16, joint_names=['waist', 'elbow'], clock=FakeClock(step=0.5))
+        trace.record(OP_INPUT, 3, 0, 255)
+        trace.record(OP_TO_POSITION, 1, -5000, 25)
+        self.assertEqual(trace.dump(self.path), 2)
+
+        names, written, records = read_dump(self.path)
+        self.assertEqual(names, ['waist', 'elbow'])
+        self.assertEqual(written, 2)
+        self.assertEqual(records, [(0.5, 3, OP_INPUT, 0, 255.0), (1.0, 1, OP_TO_POSITION, -5000, 25.0)])
+        self.assertEqual(format_record(records[1], names, 0.5).split(),
+                         ['0.500000', 'elbow', 'on_to_position', 'position=-5000', 'speed=25'])
+
+    def test_ring_keeps_newest(self):
+        trace = TraceBuffer(4, clock=FakeClock(step=0.5))
+        for value in range(10):
+            trace.record(OP_ON, 0, 0, value)
+        trace.dump(self.path)
+        _, written, records = read_dump(self.path)
+        self.assertEqual(written, 10)
+        self.assertEqual([record[4] for record in records], [6.0, 7.0, 8.0, 9.0])
+
+    def test_argument_is_clamped(self):
+        trace = TraceBuffer(4, clock=FakeClock(step=0.5))
+        trace.record(OP_TO_POSITION, 0, 100000, 10)
+        trace.dump(self.path)
+        self.assertEqual(read_dump(self.path)[2][0][3], 32767)
+
+    def test_threads_recording(self):
+        trace = TraceBuffer(64)
+
+        def record():
+            for value in range(1000):
+                trace.record(OP_ON, 0, 0, value)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(trace.written, 4000)
+        self.assertEqual(trace.dump(self.path), 64)
+
+    def test_record_while_recording(self):
+        # like a signal handler recording on the thread which was in the middle of a record
+        nested = []
+
+        def clock():
+            if not nested:
+                nested.append(OP_MARK)
+                trace.record(OP_MARK, 0, 0, 1)
+            return 1.0
+
+        trace = TraceBuffer(16, clock=clock)
+        thread = threading.Thread(target=trace.record, args=(OP_ON, 0, 0, 2), daemon=True)
+        thread.start()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(trace.written, 2)
+        trace.dump(self.path)
+        self.assertEqual([(record[2], record[4]) for record in read_dump(self.path)[2]],
+                         [(OP_ON, 2.0), (OP_MARK, 1.0)])
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as trace_file:
+            trace_file.write(b'\x00' * 64)
+        with self.assertRaises(ValueError):
+            read_dump(self.path)
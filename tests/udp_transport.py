@@ -0,0 +1,91 @@
+import unittest
+from sim_motor import SimulatedMotor
+from slave_controller import MODE_IDLE, MODE_TARGET, MODE_VELOCITY, SlaveController
+from smart_motor import LimitedRangeMotor
+from udp_transport import (LinkStats, UdpSetpointServer, UdpSlaveClient, is_newer, pack_setpoints, pack_telemetry,
+                           unpack_setpoints, unpack_telemetry)
+
+
+IDLE = (MODE_IDLE, 0.0, 0)
+
+
+class TestUdpTransport(unittest.TestCase):
+
+    def test_setpoint_roundtrip(self):
+        setpoints = [(MODE_VELOCITY, 25.0, 0), (MODE_TARGET, 10.0, -300), IDLE, IDLE]
+        data = pack_setpoints(7, 42, 1.5, setpoints)
+        self.assertEqual(len(data), 54)
+        self.assertEqual(unpack_setpoints(data), (7, 42, 1.5, setpoints))
+
+    def test_telemetry_roundtrip(self):
+        joints = [(10, True), (-20, False), (0, False), (5, True)]
+        data = pack_telemetry(7, 42, 1.5, True, joints)
+        self.assertEqual(unpack_telemetry(data), (7, 42, 1.5, True, joints))
+
+    def test_invalid_packets(self):
+        self.assertIsNone(unpack_setpoints(b'garbage'))
+        self.assertIsNone(unpack_setpoints(b'\x00' * 54))
+
+    def test_sequence_wraparound(self):
+        self.assertTrue(is_newer(1, None))
+        self.assertTrue(is_newer(2, 1))
+        self.assertFalse(is_newer(1, 2))
+        self.assertFalse(is_newer(2, 2))
+        self.assertTrue(is_newer(0, 0xFFFFFFFF))
+
+    def test_stats(self):
+        stats = LinkStats()
+        for seq in (1, 2, 5, 4, 6):
+            stats.accept(seq)
+        summary = stats.summary()
+        self.assertEqual(summary['received'], 4)
+        self.assertEqual(summary['lost'], 2)
+        self.assertEqual(summary['stale'], 1)
+
+
+class TestUdpSetpointServer(unittest.TestCase):
+
+    def setUp(self):
+        self.motor = SimulatedMotor('outA')
+        self.controller = SlaveController({'roll': LimitedRangeMotor(self.motor, name='roll')})
+        self.server = UdpSetpointServer(self.controller, 'localhost', 0)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_newest_packet_wins(self):
+        reply = self.server.handle(pack_setpoints(1, 2, 0.0, [(MODE_VELOCITY, 30.0, 0), IDLE, IDLE, IDLE]))
+        self.assertIsNotNone(unpack_telemetry(reply))
+        self.assertEqual(self.controller.joints['roll'].speed, 30.0)
+
+        # an older packet arriving late is ignored
+        self.assertIsNone(self.server.handle(pack_setpoints(1, 1, 0.0, [(MODE_VELOCITY, 10.0, 0), IDLE, IDLE, IDLE])))
+        self.assertEqual(self.controller.joints['roll'].speed, 30.0)
+
+        # a new session starts over
+        self.server.handle(pack_setpoints(2, 1, 0.0, [(MODE_TARGET, 10.0, 50), IDLE, IDLE, IDLE]))
+        self.assertEqual(self.controller.joints['roll'].target, 50)
+
+    def test_repeated_setpoints_are_applied_once(self):
+        self.controller.heartbeat()
+        for seq in range(1, 11):
+            # heartbeats with every joint idle
+            self.server.handle(pack_setpoints(1, seq, 0.0, [IDLE, IDLE, IDLE, IDLE]))
+            self.controller.tick()
+        self.assertEqual(self.motor.commands, [])
+
+        for seq in range(11, 21):
+            self.server.handle(pack_setpoints(1, seq, 0.0, [(MODE_TARGET, 100.0, 0), IDLE, IDLE, IDLE]))
+            self.controller.tick()
+        self.assertEqual(self.motor.commands, ['run-to-abs-pos'])
+
+
+class TestUdpSlaveClient(unittest.TestCase):
+
+    def test_control_calls_need_a_control_client(self):
+        client = UdpSlaveClient('localhost', 9, heartbeat_interval=60)
+        try:
+            with self.assertRaises(RuntimeError):
+                client.limits('roll')
+        finally:
+            client.close()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Low-overhead binary trace of what happens in the control loop.
+#
+# Records go into a preallocated ring buffer as fixed-size binary structs, which is cheap enough to do on every
+# input event, motor command and encoder read (unlike logging to stdout). The buffer is dumped to a file on
+# request and decoded offline:
+#
+#   python3 trace_buffer.py robot_arm.trace
+import argparse
+import itertools
+import json
+import struct
+import threading
+import time
+
+
+# timestamp, joint (or event type for input), opcode, argument, value
+RECORD = struct.Struct('<dBBhf')
+HEADER = struct.Struct('<4sBHIQI')
+MAGIC = b'EV3T'
+VERSION = 1
+
+DEFAULT_CAPACITY = 65536
+
+OP_INPUT = 1  # joint: event type, argument: event code, value: event value
+OP_ON = 2  # value: speed
+OP_TO_POSITION = 3  # argument: position, value: speed
+OP_STOP = 4
+OP_RESET = 5
+OP_READ = 6  # value: position read from the encoder
+OP_MARK = 7  # free form marker, argument and value are up to the caller
+OP_HOLD = 8  # value: duty cycle
+
+OPCODES = {
+    OP_INPUT: 'input',
+    OP_ON: 'on',
+    OP_TO_POSITION: 'on_to_position',
+    OP_STOP: 'stop',
+    OP_RESET: 'reset',
+    OP_READ: 'read',
+    OP_MARK: 'mark',
+    OP_HOLD: 'hold',
+}
+
+# signed 16 bit argument
+ARG_MIN = -32768
+ARG_MAX = 32767
+
+
+class TraceBuffer:
+    """ preallocated ring buffer of binary trace records, the newest records overwrite the oldest """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, joint_names=(), clock=time.monotonic):
+        self.capacity = capacity
+        self.joint_names = list(joint_names)
+        self._buffer = bytearray(RECORD.size * capacity)
+        # next() on a count is atomic, even for a signal handler recording in the middle of another record
+        self._counter = itertools.count()
+        # count of records up to the newest filled one, published once its slot is filled so snapshots never
+        # include an empty one. Reentrant, as signal handlers record on the main thread which records input.
+        self._lock = threading.RLock()
+        self._written = 0
+        self._clock = clock
+        self._pack_into = RECORD.pack_into
+
+    def record(self, opcode, joint=0, arg=0, value=0.0):
+        with self._lock:
+            index = next(self._counter)
+            self._pack_into(self._buffer, (index % self.capacity) * RECORD.size, self._clock(), joint, opcode,
+                            min(max(int(arg), ARG_MIN), ARG_MAX), value)
+            # a record nested in this one (from a signal handler) may have published a later slot already
+            if index >= self._written:
+                self._written = index + 1
+
+    @property
+    def written(self):
+        """ total number of records ever written, including the ones overwritten since """
+        return self._written
+
+    def _snapshot(self):
+        with self._lock:
+            written = self._written
+            buffer = bytes(self._buffer)
+        if written <= self.capacity:
+            return written, buffer[:written * RECORD.size]
+        split = (written % self.capacity) * RECORD.size
+        return written, buffer[split:] + buffer[:split]
+
+    def snapshot(self):
+        """ the records currently in the buffer as raw bytes, oldest first """
+        return self._snapshot()[1]
+
+    def dump(self, path):
+        """ write the buffer to a file, returns the number of records written """
+        written, data = self._snapshot()
+        names = json.dumps(self.joint_names).encode()
+        with open(path, 'wb') as trace_file:
+            trace_file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.capacity, written, len(names)))
+            trace_file.write(names)
+            trace_file.write(data)
+        return len(data) // RECORD.size
+
+
+def read_dump(path):
+    """ returns (joint_names, total_written, records) from a trace file, records as tuples oldest first """
+    with open(path, 'rb') as trace_file:
+        magic, version, record_size, capacity, written, names_length = HEADER.unpack(trace_file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError('{} is not a trace file this decoder understands'.format(path))
+        names = json.loads(trace_file.read(names_length).decode())
+        data = trace_file.read()
+
+    records = [RECORD.unpack_from(data, offset) for offset in range(0, len(data) - RECORD.size + 1, RECORD.size)]
+    return names, written, records
+
+
+def format_record(record, names, start=0.0):
+    timestamp, joint, opcode, arg, value = record
+    op = OPCODES.get(opcode, 'op{}'.format(opcode))
+    if opcode == OP_INPUT:
+        return '{:12.6f} input type={} code={} value={:g}'.format(timestamp - start, joint, arg, value)
+    name = names[joint] if joint < len(names) else 'joint{}'.format(joint)
+    if opcode == OP_TO_POSITION:
+        return '{:12.6f} {} {} position={} speed={:g}'.format(timestamp - start, name, op, arg, value)
+    if opcode == OP_STOP or opcode == OP_RESET:
+        return '{:12.6f} {} {}'.format(timestamp - start, name, op)
+    if opcode == OP_READ:
+        return '{:12.6f} {} {} position={:g}'.format(timestamp - start, name, op, value)
+    return '{:12.6f} {} {} arg={} value={:g}'.format(timestamp - start, name, op, arg, value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode a trace dumped by robot_arm.py')
+    parser.add_argument('path')
+    parser.add_argument('--joint', help='only show records for this joint')
+    args = parser.parse_args()
+
+    names, written, records = read_dump(args.path)
+    print('{} records ({} written in total, {} overwritten)'.format(len(records), written, written - len(records)))
+    if not records:
+        return
+
+    start = records[0][0]
+    for record in records:
+        if args.joint and (record[2] == OP_INPUT or record[1] >= len(names) or names[record[1]] != args.joint):
+            continue
+        print(format_record(record, names, start))
+
+
+if __name__ == '__main__':
+    main()
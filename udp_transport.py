@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# Compact UDP transport for the slave controller.
+#
+# Every setpoint datagram carries the complete setpoint table for all wrist joints, so the newest packet always
+# wins: anything older than the last packet applied is discarded and a lost packet is repaired by the next one.
+# The slave answers each applied packet with a telemetry datagram which echoes the send time, giving the master
+# round trip latency without needing synchronised clocks.
+import collections
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+
+from slave_controller import HEARTBEAT_INTERVAL, MODE_IDLE, MODE_TARGET, MODE_VELOCITY, WRIST_JOINTS
+
+
+SLAVE_UDP_PORT = 18814
+
+MAGIC = 0xE3A2
+VERSION = 1
+
+FLAG_FAILSAFE = 0x01
+
+# magic, version, flags, session, sequence, send time
+HEADER = '<HBBHId'
+# per joint: mode, speed (percentage), target position
+SETPOINT = 'Bfi'
+# per joint: position, running
+TELEMETRY = 'iB'
+
+SETPOINT_PACKET = struct.Struct(HEADER + SETPOINT * len(WRIST_JOINTS))
+TELEMETRY_PACKET = struct.Struct(HEADER + TELEMETRY * len(WRIST_JOINTS))
+
+SEQUENCE_MASK = 0xFFFFFFFF
+
+logger = logging.getLogger(__name__)
+
+
+def is_newer(seq, last):
+    """ sequence number comparison which survives wrapping around """
+    return last is None or (seq != last and ((seq - last) & SEQUENCE_MASK) < 0x80000000)
+
+
+def pack_setpoints(session, seq, sent, setpoints):
+    """ setpoints is a list of (mode, speed, target) tuples in WRIST_JOINTS order """
+    values = []
+    for mode, speed, target in setpoints:
+        values.extend((mode, speed, int(target or 0)))
+    return SETPOINT_PACKET.pack(MAGIC, VERSION, 0, session, seq, sent, *values)
+
+
+def unpack_setpoints(data):
+    """ returns (session, seq, sent, setpoints) or None for anything which isn't a valid setpoint packet """
+    if len(data) != SETPOINT_PACKET.size:
+        return None
+    values = SETPOINT_PACKET.unpack(data)
+    if values[0] != MAGIC or values[1] != VERSION:
+        return None
+    setpoints = [tuple(values[i:i + 3]) for i in range(6, len(values), 3)]
+    return values[3], values[4], values[5], setpoints
+
+
+def pack_telemetry(session, seq, sent, failsafe, joints):
+    """ joints is a list of (position, running) tuples in WRIST_JOINTS order """
+    values = []
+    for position, running in joints:
+        values.extend((int(position), 1 if running else 0))
+    return TELEMETRY_PACKET.pack(MAGIC, VERSION, FLAG_FAILSAFE if failsafe else 0, session, seq, sent, *values)
+
+
+def unpack_telemetry(data):
+    """ returns (session, seq, sent, failsafe, joints) or None """
+    if len(data) != TELEMETRY_PACKET.size:
+        return None
+    values = TELEMETRY_PACKET.unpack(data)
+    if values[0] != MAGIC or values[1] != VERSION:
+        return None
+    joints = [(values[i], bool(values[i + 1])) for i in range(6, len(values), 2)]
+    return values[3], values[4], values[5], bool(values[2] & FLAG_FAILSAFE), joints
+
+
+class LinkStats:
+    """ packet loss, reordering and latency of one direction of the link """
+
+    def __init__(self, samples=1000):
+        self.received = 0
+        self.lost = 0
+        self.stale = 0
+        self.invalid = 0
+        self._last = None
+        self._rtt = collections.deque(maxlen=samples)
+
+    def reset_sequence(self):
+        self._last = None
+
+    def accept(self, seq):
+        """ register an incoming sequence number, returns False when the packet is stale """
+        if not is_newer(seq, self._last):
+            self.stale += 1
+            return False
+        if self._last is not None:
+            self.lost += ((seq - self._last) & SEQUENCE_MASK) - 1
+        self._last = seq
+        self.received += 1
+        return True
+
+    def add_rtt(self, seconds):
+        self._rtt.append(seconds)
+
+    def summary(self):
+        rtt = sorted(self._rtt)
+        total = self.received + self.lost
+        result = {
+            'received': self.received,
+            'lost': self.lost,
+            'stale': self.stale,
+            'invalid': self.invalid,
+            'loss': self.lost / total if total else 0.0,
+        }
+        if rtt:
+            result.update({
+                'rtt_min_ms': rtt[0] * 1000,
+                'rtt_mean_ms': sum(rtt) / len(rtt) * 1000,
+                'rtt_p99_ms': rtt[min(len(rtt) - 1, int(len(rtt) * 0.99))] * 1000,
+                'rtt_max_ms': rtt[-1] * 1000,
+            })
+        return result
+
+
+class UdpSetpointServer:
+    """ slave side, applies setpoint packets to a SlaveController and answers with telemetry """
+
+    def __init__(self, controller, host='', port=SLAVE_UDP_PORT):
+        self._controller = controller
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self._session = None
+        # the setpoint last applied per joint, packets repeat the whole table every heartbeat
+        self._applied = {}
+        self.stats = LinkStats()
+        self.running = False
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def handle(self, data):
+        """ apply a datagram, returns the telemetry reply or None when it was dropped """
+        packet = unpack_setpoints(data)
+        if packet is None:
+            self.stats.invalid += 1
+            return None
+
+        session, seq, sent, setpoints = packet
+        if session != self._session:
+            # the master restarted, its sequence numbers start over
+            self._session = session
+            self.stats.reset_sequence()
+            self._applied = {}
+        if not self.stats.accept(seq):
+            return None
+
+        controller = self._controller
+        controller.heartbeat()
+        for name, (mode, speed, target) in zip(WRIST_JOINTS, setpoints):
+            if name not in controller.joints or self._applied.get(name) == (mode, speed, target):
+                # a joint which reached its target mustn't be sent there again
+                continue
+            self._applied[name] = (mode, speed, target)
+            if mode == MODE_TARGET:
+                controller.set_target(name, target, speed)
+            elif mode == MODE_VELOCITY:
+                controller.set_velocity(name, speed)
+            else:
+                controller.set_velocity(name, 0)
+
+        joints = []
+        for name in WRIST_JOINTS:
+            joint = controller.joints.get(name)
+            joints.append((joint.motor.position, joint.is_running) if joint else (0, False))
+        return pack_telemetry(session, seq, sent, controller.failsafe, joints)
+
+    def serve_forever(self):
+        self.running = True
+        while self.running:
+            try:
+                data, address = self._socket.recvfrom(SETPOINT_PACKET.size + 1)
+            except OSError:
+                break
+            reply = self.handle(data)
+            if reply is not None:
+                self._socket.sendto(reply, address)
+
+    def close(self):
+        self.running = False
+        try:
+            # wakes up a blocking recvfrom
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+
+
+class UdpSlaveClient:
+    """ master side, same interface as RpycSlaveClient but setpoints go out as datagrams
+
+    The setpoint table is resent every heartbeat interval, which doubles as the heartbeat. Calls which are
+    not setpoints (limits, reset, calibrate, status) are forwarded to an optional RPyC control client.
+    """
+
+    def __init__(self, host, port=SLAVE_UDP_PORT, control=None, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self._address = (host, port)
+        self._control = control
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.connect(self._address)
+        self._session = random.randint(0, 0xFFFF)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._setpoints = dict((name, (MODE_IDLE, 0.0, 0)) for name in WRIST_JOINTS)
+        self._heartbeat_interval = heartbeat_interval
+        self.stats = LinkStats()
+        self.sent = 0
+        self.telemetry = None
+        self.failsafe = False
+        self._running = True
+        self._receive_thread = threading.Thread(target=self._receive_loop, daemon=True)
+        self._receive_thread.start()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat_thread.start()
+
+    def _send(self):
+        with self._lock:
+            self._seq = (self._seq + 1) & SEQUENCE_MASK
+            data = pack_setpoints(self._session, self._seq, time.monotonic(),
+                                  [self._setpoints[name] for name in WRIST_JOINTS])
+            try:
+                self._socket.send(data)
+            except OSError:
+                # nothing listening (yet), the next heartbeat will try again
+                return
+            self.sent += 1
+
+    def _heartbeat_loop(self):
+        while self._running:
+            self._send()
+            time.sleep(self._heartbeat_interval)
+
+    def _receive_loop(self):
+        while self._running:
+            try:
+                data = self._socket.recv(TELEMETRY_PACKET.size + 1)
+            except OSError:
+                if not self._running:
+                    break
+                continue
+            packet = unpack_telemetry(data)
+            if packet is None or packet[0] != self._session:
+                self.stats.invalid += 1
+                continue
+            session, seq, sent, failsafe, joints = packet
+            if not self.stats.accept(seq):
+                continue
+            self.stats.add_rtt(time.monotonic() - sent)
+            self.failsafe = failsafe
+            self.telemetry = dict(zip(WRIST_JOINTS, joints))
+
+    def _set(self, name, setpoint):
+        if name not in self._setpoints:
+            raise ValueError('Unknown joint {}'.format(name))
+        self._setpoints[name] = setpoint
+        self._send()
+
+    def set_velocity(self, name, speed):
+        self._set(name, (MODE_VELOCITY if speed else MODE_IDLE, speed, 0))
+
+    def set_target(self, name, position, speed):
+        self._set(name, (MODE_TARGET, speed, position))
+
+    def _require_control(self):
+        if self._control is None:
+            raise RuntimeError('UDP transport only carries setpoints, pass an RPyC control client')
+        return self._control
+
+    def limits(self, name):
+        return self._require_control().limits(name)
+
+    def reset(self, name):
+        self._require_control().reset(name)
+
+    def calibrate(self, name, to_center=True):
+        self._require_control().calibrate(name, to_center)
+
+    def status(self):
+        return self._require_control().status()
+
+    def close(self):
+        self._running = False
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        if self._control is not None:
+            self._control.close()